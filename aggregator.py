@@ -0,0 +1,254 @@
+from typing import Any, Dict, List, Optional, Tuple
+from utility import MacAddress, is_physical
+
+
+class DeviceStats:
+    """ Running statistics of one MAC address on one channel in a session """
+
+    __slots__ = ("count", "rssi_sum", "first_seen")
+
+    def __init__(self, rssi: int, captureTime: int):
+        self.count = 1
+        self.rssi_sum = rssi
+        self.first_seen = captureTime
+
+
+class SessionAggregator:
+    """
+    Aggregate probe requests of a monitoring session per (channel, MAC). Only
+    the running count and sum of rssi, and the FIRST captureTime are kept, so
+    memory grows with the number of distinct devices instead of the number
+    of probe requests. Replaces the data_chunk built by `make_data_chunk`.
+    """
+
+    def __init__(self):
+        self.channels: Dict[int, Dict[MacAddress, DeviceStats]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(devices) for devices in self.channels.values())
+
+    def add(
+        self,
+        channel: int,
+        mac_address: MacAddress,
+        rssi: int,
+        captureTime: int,
+    ) -> None:
+        """
+        Record one probe request.
+
+        Args:
+            channel:        The channel where the probe request is captured.
+            mac_address:    The MAC address of the device making probe request.
+            rssi:           Signal strength of the probe request.
+            captureTime:    Time the probe request is captured, in ms since
+                            epoch.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        devices = self.channels.get(channel)
+        if devices is None:
+            devices = self.channels[channel] = {}
+        stats = devices.get(mac_address)
+        if stats is None:
+            devices[mac_address] = DeviceStats(rssi, captureTime)
+        else:
+            stats.count += 1
+            stats.rssi_sum += rssi
+
+    def make_rows(
+        self, is_wifi: bool
+    ) -> List[Tuple[MacAddress, bool, bool, int, int, int]]:
+        """
+        Generate a list of tuples that are insertable to sqlite. The rows are
+        the same, in the same order, as those produced by
+        `make_db_insertable_data` on the equivalent data_chunk.
+
+        Args:
+            is_wifi:    Whether the probe requests are captured via WiFi.
+        Returns:
+            A list of tuples, in which each tuple is a piece of insertable data
+            to "Probes" table in "mobintel" database
+        Raises:
+            None
+        """
+        return [
+            (
+                mac_address,
+                is_physical(mac_address),
+                is_wifi,
+                stats.first_seen,
+                stats.rssi_sum // stats.count,
+                channel,
+            )
+            for channel, devices in self.channels.items()
+            for mac_address, stats in devices.items()
+        ]
+
+    def clear(self) -> None:
+        """ Drop all data of the current session """
+        self.channels.clear()
+
+    def dump(self) -> Dict[int, Dict[MacAddress, Tuple[int, int, int]]]:
+        """
+        The statistics of each (channel, MAC) as (count, rssi_sum,
+        first_seen) tuples, which pickle several times faster than
+        DeviceStats.
+        """
+        return {
+            channel: {
+                mac_address: (stats.count, stats.rssi_sum, stats.first_seen)
+                for mac_address, stats in devices.items()
+            }
+            for channel, devices in self.channels.items()
+        }
+
+    @classmethod
+    def load(
+        cls, channels: Dict[int, Dict[MacAddress, Tuple[int, int, int]]]
+    ) -> "SessionAggregator":
+        """ Rebuild a SessionAggregator from its `dump` """
+        aggregator = cls()
+        for channel, devices in channels.items():
+            aggregator.channels[channel] = restored = {}
+            for mac_address, (count, rssi_sum, first_seen) in devices.items():
+                stats = restored[mac_address] = DeviceStats(0, first_seen)
+                stats.count = count
+                stats.rssi_sum = rssi_sum
+        return aggregator
+
+
+class TumblingWindows:
+    """
+    Assign probe requests to sessions by their captureTime instead of their
+    arrival time: tumbling windows of {size} ms, aligned on the epoch, each
+    aggregated by a SessionAggregator.
+
+    A window is closed once the watermark passes its end. The watermark is
+    the latest captureTime seen, advanced by the wall clock time elapsed
+    since it was seen, minus {lateness} ms allowed for late probe requests.
+    Advancing with the wall clock closes windows even when no probe request
+    arrives. A probe request arriving after its window is closed goes into a
+    new window of the same time range, closed at the next check.
+    """
+
+    def __init__(self, size: int, lateness: int):
+        self.size = max(size, 1)
+        self.lateness = lateness
+        self.windows: Dict[int, SessionAggregator] = {}
+        # window receiving the latest probe requests, for the fast path
+        self.current: Optional[SessionAggregator] = None
+        self.current_start = 0
+        self.current_end = 0
+        self.max_time = 0  # latest captureTime seen, in ms since epoch
+        self.max_time_seen = 0  # its value at the last `advance`
+        self.max_arrival = 0.0  # wall clock time it was seen, in seconds
+        self.closed_until = 0  # windows ending before have been pushed
+        self.late = 0  # probe requests arriving after their window closed
+
+    def __len__(self) -> int:
+        return sum(len(window) for window in self.windows.values())
+
+    def add(
+        self,
+        channel: int,
+        mac_address: MacAddress,
+        rssi: int,
+        captureTime: int,
+    ) -> None:
+        """ Record one probe request, see `SessionAggregator.add` """
+        if not self.current_start <= captureTime < self.current_end:
+            self.switch_window(captureTime)
+        self.current.add(channel, mac_address, rssi, captureTime)
+        if captureTime > self.max_time:
+            self.max_time = captureTime
+
+    def switch_window(self, captureTime: int) -> None:
+        start = captureTime - captureTime % self.size
+        if start < self.closed_until:
+            self.late += 1
+        window = self.windows.get(start)
+        if window is None:
+            window = self.windows[start] = SessionAggregator()
+        self.current = window
+        self.current_start = start
+        self.current_end = start + self.size
+
+    def watermark(self, now: float) -> int:
+        """
+        The watermark at wall clock time `now`, in seconds since epoch. The
+        latest captureTime must have been recorded with `advance`.
+        """
+        return int(
+            self.max_time + (now - self.max_arrival) * 1000 - self.lateness
+        )
+
+    def advance(self, now: float) -> None:
+        """ Note the wall clock time `now` at which max_time was seen """
+        if self.max_time != self.max_time_seen:
+            self.max_time_seen = self.max_time
+            self.max_arrival = now
+
+    def pop_closed(self, now: float) -> List[SessionAggregator]:
+        """
+        Take the windows closed at wall clock time `now`, in seconds since
+        epoch, oldest first.
+        """
+        self.advance(now)
+        if not self.max_time:
+            return []
+        watermark = self.watermark(now)
+        closed = sorted(
+            start for start in self.windows if start + self.size <= watermark
+        )
+        if closed:
+            self.closed_until = max(self.closed_until, closed[-1] + self.size)
+        return self.pop(closed)
+
+    def pop_all(self) -> List[SessionAggregator]:
+        """ Take all windows, oldest first """
+        return self.pop(sorted(self.windows))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ The open windows and the progress of the watermark """
+        return {
+            "size": self.size,
+            "max_time": self.max_time,
+            "closed_until": self.closed_until,
+            "windows": {
+                start: window.dump() for start, window in self.windows.items()
+            },
+        }
+
+    def restore(self, state: Dict[str, Any], now: float) -> bool:
+        """
+        Resume the windows of a `snapshot`, taken by a data collection
+        process that is gone, before any probe request is added. The
+        watermark resumes from the latest captureTime of the snapshot, as if
+        nothing had been captured since, until wall clock time `now`.
+
+        Args:
+            state:  A snapshot taken with the same window size.
+            now:    Wall clock time, in seconds since epoch.
+        Returns:
+            True if the windows are resumed, False if the size differs.
+        Raises:
+            None
+        """
+        if state["size"] != self.size:
+            return False
+        for start, channels in state["windows"].items():
+            self.windows[start] = SessionAggregator.load(channels)
+        self.closed_until = max(self.closed_until, state["closed_until"])
+        if state["max_time"] > self.max_time:
+            self.max_time = self.max_time_seen = state["max_time"]
+            self.max_arrival = now
+        return True
+
+    def pop(self, starts: List[int]) -> List[SessionAggregator]:
+        if self.current_start in starts:
+            self.current = None
+            self.current_start = self.current_end = 0
+        return [self.windows.pop(start) for start in starts]
@@ -0,0 +1,172 @@
+from collections import deque
+from multiprocessing import Queue, Value
+from queue import Empty
+from typing import Any, Deque, List, Tuple
+
+
+class BatchQueue:
+    """
+    A multiprocessing queue whose messages are whole batches (lists) of rows
+    instead of single rows, such that a session pays the cost of pickling,
+    the pipe and the lock once instead of once per row.
+
+    Batches are taken off the queue by `wait_batch` alone, typically in a
+    worker thread, and put in a local deque with `append` on the consumer
+    thread. Consumers slice the batches in the local deque to get exactly the
+    number of rows they need, and put unconsumed rows back in front. With a
+    single reader of the queue, the order of rows is preserved. All
+    consumers must live in the same process (the main process).
+
+    The number of rows held, in the queue and in the local deque, is counted
+    in shared memory. Once it reaches {high_water} rows, producers are meant
+    to put new batches in an overflow store instead (see `should_overflow`),
+    and the consumer to page them back in once below the mark. The number of
+    rows in the overflow store is counted in shared memory as well.
+    """
+
+    def __init__(self, high_water: int = 0):
+        self._q = Queue()
+        self._pending: Deque[List[Tuple[Any, ...]]] = deque()
+        self.high_water = high_water  # 0 means unbounded
+        self._rows = Value("q", 0)
+        self._overflow_rows = Value("q", 0)
+
+    def __getstate__(self):
+        # the local deque belongs to the consumer process only
+        return {
+            "_q": self._q,
+            "high_water": self.high_water,
+            "_rows": self._rows,
+            "_overflow_rows": self._overflow_rows,
+        }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pending = deque()
+
+    def __len__(self) -> int:
+        """ Number of rows held, in the queue and in the local deque """
+        return self._rows.value
+
+    def _count(self, counter, num_rows: int) -> None:
+        with counter.get_lock():
+            counter.value += num_rows
+
+    def should_overflow(self) -> bool:
+        """
+        Whether a producer should put its next batch in the overflow store:
+        the high water mark is reached, or rows are still in the overflow
+        store, which must be paged back first to keep rows in order.
+        """
+        if not self.high_water:
+            return False
+        return self.overflow_rows() > 0 or len(self) >= self.high_water
+
+    def overflow_rows(self) -> int:
+        """ Number of rows in the overflow store """
+        return self._overflow_rows.value
+
+    def add_overflow(self, num_rows: int) -> None:
+        """
+        Count rows a producer is about to put in the overflow store, before
+        writing them, or uncount them with a negative number if that fails
+        """
+        self._count(self._overflow_rows, num_rows)
+
+    def page_in(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Put rows taken out of the overflow store at the back of the line,
+        and stop counting them as in the overflow store. Producers count rows
+        before writing them, so the count does not go below 0 unless it has
+        drifted, which is left to show.
+        """
+        if rows:
+            self._count(self._overflow_rows, -len(rows))
+            self.append_local(rows)
+
+    def put_batch(self, rows: List[Tuple[Any, ...]]) -> None:
+        """ Put a batch of rows in the queue. Empty batches are dropped. """
+        if rows:
+            self._count(self._rows, len(rows))
+            self._q.put(rows)
+
+    def empty(self) -> bool:
+        """
+        Return True if there is no row left in the local deque, otherwise
+        False. Batches still in the queue are not in line until appended.
+        """
+        return not self._pending
+
+    def get_rows(self, max_rows: int) -> List[Tuple[Any, ...]]:
+        """
+        Get at most {max_rows} rows from the local deque, oldest first,
+        without blocking. A batch larger than what is needed is sliced, and
+        its remainder stays first in line.
+
+        Args:
+            max_rows:   Max number of rows to get.
+        Returns:
+            A list of rows. Empty if there is no row.
+        Raises:
+            None
+        """
+        rows: List[Tuple[Any, ...]] = []
+        while self._pending and len(rows) < max_rows:
+            batch = self._pending.popleft()
+            need = max_rows - len(rows)
+            if len(batch) > need:
+                self._pending.appendleft(batch[need:])
+                batch = batch[:need]
+            rows.extend(batch)
+        self._count(self._rows, -len(rows))
+        return rows
+
+    def get_all(self) -> List[Tuple[Any, ...]]:
+        """ Get all rows in the local deque, oldest first """
+        rows: List[Tuple[Any, ...]] = []
+        while self._pending:
+            rows.extend(self._pending.popleft())
+        self._count(self._rows, -len(rows))
+        return rows
+
+    def wait_batch(self, timeout: float) -> List[Tuple[Any, ...]]:
+        """
+        Block until a batch arrives in the queue, for at most {timeout}
+        seconds. This is the only reader of the queue. The local deque is not
+        touched, so this can be called from a worker thread while the
+        consumer thread works on the local deque.
+
+        Args:
+            timeout:    Max number of seconds to wait.
+        Returns:
+            The batch, or an empty list if none arrives in time.
+        Raises:
+            None
+        """
+        try:
+            return self._q.get(timeout=timeout)
+        except Empty:
+            return []
+
+    def append(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Put rows obtained from `wait_batch` at the back of the line. They are
+        already counted by `put_batch`.
+        """
+        if rows:
+            self._pending.append(rows)
+
+    def append_local(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Put rows loaded in the consumer process, e.g. from the local store,
+        at the back of the line.
+        """
+        if rows:
+            self._count(self._rows, len(rows))
+            self.append(rows)
+
+    def requeue(self, rows: List[Tuple[Any, ...]]) -> None:
+        """ Put rows that could not be consumed back in front of the line """
+        if rows:
+            self._pending.appendleft(rows)
+            self._count(self._rows, len(rows))
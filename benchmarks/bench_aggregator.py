@@ -0,0 +1,92 @@
+"""
+Compare memory and throughput of the nested defaultdict data_chunk against
+SessionAggregator over one monitoring session.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_aggregator [-n 500000] [-d 20000]
+"""
+import argparse
+import random
+import tracemalloc
+from collections import defaultdict
+from time import perf_counter
+from typing import List, Tuple
+
+from aggregator import SessionAggregator
+from benchmarks.synthetic import random_mac
+from utility import make_data_chunk, make_db_insertable_data
+
+
+def make_probes(
+    num_probes: int, num_devices: int
+) -> List[Tuple[int, str, int, str]]:
+    rng = random.Random(0)
+    macs = [random_mac(rng) for _ in range(num_devices)]
+    return [
+        (
+            rng.randrange(1, 12),
+            rng.choice(macs),
+            -rng.randrange(20, 95),
+            f"2019-10-24 13:00:{i * 60 // num_probes:02d}.000",
+        )
+        for i in range(num_probes)
+    ]
+
+
+def legacy(probes):
+    data_chunk = defaultdict(dict)
+    for channel, mac, rssi, capture_time in probes:
+        make_data_chunk(data_chunk, channel, mac, rssi, capture_time)
+    return data_chunk, make_db_insertable_data(data_chunk, True)
+
+
+def aggregated(probes):
+    data_chunk = SessionAggregator()
+    for channel, mac, rssi, capture_time in probes:
+        data_chunk.add(channel, mac, rssi, capture_time)
+    return data_chunk, data_chunk.make_rows(True)
+
+
+def run(name: str, func, probes):
+    start = perf_counter()
+    func(probes)
+    elapsed = perf_counter() - start
+
+    tracemalloc.start()
+    data_chunk, rows = func(probes)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>10}: {len(probes) / elapsed:>10,.0f} probes/sec, "
+        f"peak {peak / 2 ** 20:>7.1f} MiB"
+    )
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_probes",
+        default=500000,
+        type=int,
+        help="Number of probe requests in the session. Default: 500000",
+    )
+    parser.add_argument(
+        "-d",
+        dest="num_devices",
+        default=20000,
+        type=int,
+        help="Number of distinct devices. Default: 20000",
+    )
+    args = parser.parse_args()
+
+    probes = make_probes(args.num_probes, args.num_devices)
+    print(f"{args.num_probes:,} probes from {args.num_devices:,} devices")
+    old_rows = run("legacy", legacy, probes)
+    new_rows = run("aggregator", aggregated, probes)
+    assert old_rows == new_rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Per-row cost of captureTime handling, before (string kept from parse time
+and converted with strptime in convert_to_payload) and after (epoch ms int
+computed at parse time with a cached per-second prefix).
+
+Usage (from the repo root):
+    python -m benchmarks.bench_capture_time [-n 200000]
+"""
+import argparse
+from time import perf_counter
+
+from benchmarks.synthetic import make_tcpdump_lines
+from probe_parser import PROBE_PATTERN, capture_time_to_ms
+from utility import convert_to_payload
+
+
+def timed(name: str, func, count: int) -> None:
+    start = perf_counter()
+    func()
+    elapsed = perf_counter() - start
+    print(f"{name:>22}: {elapsed / count * 1e6:>8.3f} us/row")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_rows",
+        default=200000,
+        type=int,
+        help="Number of rows. Default: 200000",
+    )
+    args = parser.parse_args()
+
+    lines = [
+        line for line in make_tcpdump_lines(args.num_rows) if len(line) > 8
+    ]
+    stamps = [PROBE_PATTERN.match(line).group(1) for line in lines]
+    str_rows = [
+        ("ab:cd:ef:01:23:45", True, True, s.decode("ascii"), -50, 6)
+        for s in stamps
+    ]
+    int_rows = [
+        ("ab:cd:ef:01:23:45", True, True, capture_time_to_ms(s), -50, 6)
+        for s in stamps
+    ]
+    assert convert_to_payload(str_rows[:100], "t") == convert_to_payload(
+        int_rows[:100], "t"
+    )
+    n = len(stamps)
+
+    print("parse time")
+    timed("decode to str", lambda: [s.decode("ascii") for s in stamps], n)
+    timed(
+        "epoch ms, cached", lambda: [capture_time_to_ms(s) for s in stamps], n
+    )
+    print("convert_to_payload")
+    timed("str captureTime", lambda: convert_to_payload(str_rows, "t"), n)
+    timed("int captureTime", lambda: convert_to_payload(int_rows, "t"), n)
+
+
+if __name__ == "__main__":
+    main()
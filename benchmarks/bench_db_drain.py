@@ -0,0 +1,114 @@
+"""
+Drain a large backlog from the local database in batches and report the
+batch latency as the table shrinks, for keyset-paginated `drain_rows` and
+for the SELECT + DELETE by subquery it replaced.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_db_drain [-n 5000000] [-b 500] [-s 200]
+"""
+import argparse
+import configparser
+import logging
+import os
+import tempfile
+from time import perf_counter
+
+import db
+
+
+def fill(localDB, num_rows: int) -> None:
+    chunk = 100000
+    for start in range(0, num_rows, chunk):
+        rows = [
+            ("aa:bb:cc:dd:ee:ff", True, True, 1571922000000, -50, 6)
+        ] * min(chunk, num_rows - start)
+        assert localDB.insert_mult_rows(rows)
+
+
+def legacy_drain(localDB, num_rows: int):
+    """ SELECT the oldest rows, then DELETE them by subquery on ROW_ID """
+    with localDB.conn:
+        rows = localDB.select_rows(localDB.SCHEMA, num_rows)
+        if rows:
+            # DELETE ... LIMIT is only available if SQLite is compiled with
+            # SQLITE_ENABLE_UPDATE_DELETE_LIMIT, hence the subquery.
+            localDB.conn.execute(
+                f"""DELETE FROM {localDB.TABLE} WHERE {localDB.ROW_ID} IN (
+                    SELECT {localDB.ROW_ID} FROM {localDB.TABLE}
+                    ORDER BY {localDB.ROW_ID} LIMIT ?)""",
+                (len(rows),),
+            )
+    return rows
+
+
+def run(name: str, drain, args) -> None:
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config["sqlite"]["DB_LOC"] = os.path.join(tmp_dir, "bench.db")
+        localDB = db.SQLiteDB(config["sqlite"], config["health_check"])
+        fill(localDB, args.num_rows)
+
+        start_all = perf_counter()
+        drained, next_pct = 0, 0
+        while True:
+            if next_pct < 100 and drained >= args.num_rows * next_pct / 100:
+                start = perf_counter()
+                for _ in range(args.sample):
+                    drained += len(drain(localDB, args.batch_size))
+                elapsed = (perf_counter() - start) / args.sample
+                print(
+                    f"{name:>7} at {next_pct:>3}% drained: "
+                    f"{elapsed * 1000:>8.3f} ms/batch"
+                )
+                next_pct += 10
+                continue
+            num_drained = len(drain(localDB, args.batch_size))
+            if not num_drained:
+                break
+            drained += num_drained
+        print(
+            f"{name:>7} total: {perf_counter() - start_all:.1f}s "
+            f"for {args.num_rows:,} rows"
+        )
+        localDB.close_connection()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_rows",
+        default=5000000,
+        type=int,
+        help="Number of rows in the backlog. Default: 5000000",
+    )
+    parser.add_argument(
+        "-b",
+        dest="batch_size",
+        default=500,
+        type=int,
+        help="Number of rows drained per batch. Default: 500",
+    )
+    parser.add_argument(
+        "-s",
+        dest="sample",
+        default=200,
+        type=int,
+        help="Number of batches timed at each checkpoint. Default: 200",
+    )
+    parser.add_argument(
+        "--legacy",
+        action="store_true",
+        help="Also time SELECT + DELETE (slow on large backlogs)",
+    )
+    args = parser.parse_args()
+    logging.getLogger("db").setLevel(logging.WARNING)
+
+    run("keyset", lambda d, n: d.drain_rows(n), args)
+    if args.legacy:
+        run("legacy", legacy_drain, args)
+
+
+if __name__ == "__main__":
+    main()
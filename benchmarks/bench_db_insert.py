@@ -0,0 +1,87 @@
+"""
+Insert rows into the local database with each INSERT_MODE and PRAGMA set and
+report rows/sec.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_db_insert [-n 1000000] [-l 100000]
+"""
+import argparse
+import configparser
+import logging
+import os
+import random
+import tempfile
+from time import perf_counter
+
+import db
+from benchmarks.synthetic import random_mac
+from utility import is_physical
+
+
+def make_rows(num_rows: int):
+    rng = random.Random(0)
+    macs = [random_mac(rng) for _ in range(10000)]
+    rows = []
+    for i in range(num_rows):
+        mac = rng.choice(macs)
+        rows.append(
+            (
+                mac,
+                is_physical(mac),
+                True,
+                1571922000000 + i,
+                -rng.randrange(20, 95),
+                rng.randrange(1, 12),
+            )
+        )
+    return rows
+
+
+def run(name: str, rows, mode: str, journal_mode: str, synchronous: str):
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config["sqlite"]["DB_LOC"] = os.path.join(tmp_dir, "bench.db")
+        config["sqlite"]["INSERT_MODE"] = mode
+        config["sqlite"]["JOURNAL_MODE"] = journal_mode
+        config["sqlite"]["SYNCHRONOUS"] = synchronous
+        localDB = db.SQLiteDB(config["sqlite"], config["health_check"])
+
+        start = perf_counter()
+        assert localDB.insert_mult_rows(list(rows))
+        elapsed = perf_counter() - start
+        localDB.close_connection()
+    print(
+        f"{name:>30}: {len(rows) / elapsed:>10,.0f} rows/sec "
+        f"({len(rows):,} rows in {elapsed:.2f}s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_rows",
+        default=1000000,
+        type=int,
+        help="Number of rows inserted in bulk mode. Default: 1000000",
+    )
+    parser.add_argument(
+        "-l",
+        dest="legacy_rows",
+        default=100000,
+        type=int,
+        help="Number of rows inserted in row mode. Default: 100000",
+    )
+    args = parser.parse_args()
+    logging.getLogger("db").setLevel(logging.WARNING)
+
+    rows = make_rows(args.num_rows)
+    legacy_rows = rows[: args.legacy_rows]
+    run("row, DELETE, FULL", legacy_rows, "row", "DELETE", "FULL")
+    run("bulk, DELETE, FULL", rows, "bulk", "DELETE", "FULL")
+    run("bulk, WAL, NORMAL", rows, "bulk", "WAL", "NORMAL")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Measure how much delta mode (DELTA_MODE, see delta_filter.py) cuts the rows
+pushed by the data collection process, and the bytes of their payloads, by
+replaying probe requests through sessions of -s seconds of capture time.
+
+Probe requests come from a recorded tcpdump output (-f, as produced by
+`sniff-probes.sh --channel_hop -o`) or from a synthetic office, where -p
+devices stay all day at their desk, mostly probing on the same channel with
+a steady rssi, and -n devices pass by for 5 minutes on average.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_delta [-f recorded.txt] [-t 3600] [-s 60]
+        [-p 300] [-n 2000] [-e binary]
+"""
+import argparse
+import configparser
+import random
+from typing import Iterator, List, Tuple
+
+from aggregator import SessionAggregator
+from benchmarks.synthetic import random_mac
+from delta_filter import DeltaFilter
+from payload_encoding import get_encoder
+from probe_parser import parse_channel, parse_probe
+
+# (captureTime in ms, channel, MAC address, rssi)
+Probe = Tuple[int, int, str, int]
+START_MS = 1571922000000
+
+
+def office_probes(
+    duration: float, num_persistent: int, num_transient: int, seed: int = 0
+) -> List[Probe]:
+    """
+    Persistent devices send a burst of probe requests every 60s on average,
+    90% of them on their usual channel, with an rssi drifting by a few dB and
+    moving by 15 dB or more once an hour on average. Transient devices arrive
+    over time, stay 5 minutes on average and probe every 30s on average.
+    """
+    rng = random.Random(seed)
+    probes: List[Probe] = []
+
+    def bursts(mac, t, leave, period, channel, rssi, move_rate):
+        while t < leave:
+            t += rng.expovariate(1 / period)
+            if rng.random() < move_rate * period:
+                rssi = rng.randint(-90, -30)
+            if 0 <= t < min(leave, duration):
+                ch = channel if rng.random() < 0.9 else rng.randint(1, 11)
+                for k in range(rng.randint(1, 4)):
+                    probes.append(
+                        (
+                            START_MS + int((t + 0.02 * k) * 1000),
+                            ch,
+                            mac,
+                            rssi + rng.randint(-3, 3),
+                        )
+                    )
+
+    for _ in range(num_persistent):
+        bursts(
+            random_mac(rng),
+            0.0,
+            duration,
+            60,
+            rng.choice((1, 6, 11)),
+            rng.randint(-90, -30),
+            1 / 3600,
+        )
+    for _ in range(num_transient):
+        t = rng.uniform(-300, duration)
+        bursts(
+            random_mac(rng),
+            t,
+            t + rng.expovariate(1 / 300),
+            30,
+            rng.randint(1, 11),
+            rng.randint(-90, -30),
+            0,
+        )
+    probes.sort()
+    return probes
+
+
+def recorded_probes(path: str) -> List[Probe]:
+    probes: List[Probe] = []
+    channel = None
+    with open(path, "rb") as f:
+        for line in f:
+            new_channel = parse_channel(line)
+            if new_channel is not None:
+                channel = new_channel
+                continue
+            probe = parse_probe(line)
+            if probe is not None and channel is not None:
+                probes.append((probe[0], channel, probe[2], probe[1]))
+    probes.sort()
+    return probes
+
+
+def sessions(
+    probes: List[Probe], sess_dur: float
+) -> Iterator[SessionAggregator]:
+    """ Cut probe requests, sorted by time, into sessions of capture time """
+    size = max(int(sess_dur * 1000), 1)
+    session, end = SessionAggregator(), None
+    for captureTime, channel, mac, rssi in probes:
+        if end is None or captureTime >= end:
+            if end is not None:
+                yield session
+                session = SessionAggregator()
+            end = captureTime - captureTime % size + size
+        session.add(channel, mac, rssi, captureTime)
+    yield session
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f",
+        dest="recorded",
+        default=None,
+        type=str,
+        help="Recorded tcpdump output with channel lines. Default: synthetic",
+    )
+    parser.add_argument(
+        "-t",
+        dest="duration",
+        default=3600,
+        type=float,
+        help="Duration of the synthetic office, in seconds. Default: 3600",
+    )
+    parser.add_argument(
+        "-s",
+        dest="session_duration",
+        default=60,
+        type=float,
+        help="Duration of a monitoring session, in seconds. Default: 60",
+    )
+    parser.add_argument(
+        "-p",
+        dest="num_persistent",
+        default=300,
+        type=int,
+        help="Devices staying all along in the synthetic office. Default: 300",
+    )
+    parser.add_argument(
+        "-n",
+        dest="num_transient",
+        default=2000,
+        type=int,
+        help="Devices passing by in the synthetic office. Default: 2000",
+    )
+    parser.add_argument(
+        "-e",
+        dest="encoding",
+        default="binary",
+        type=str,
+        help="Payload encoding, see payload_encoding.py. Default: binary",
+    )
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    COLLECT_CONFIG = config["collect_data"]
+    encode = get_encoder(args.encoding)
+
+    if args.recorded is not None:
+        probes = recorded_probes(args.recorded)
+    else:
+        probes = office_probes(
+            args.duration, args.num_persistent, args.num_transient
+        )
+    delta = DeltaFilter(COLLECT_CONFIG)
+    full_rows = full_bytes = delta_rows = delta_bytes = 0
+    num_sessions = max_devices = 0
+    for session in sessions(probes, args.session_duration):
+        rows = session.make_rows(True)
+        full_rows += len(rows)
+        full_bytes += len(encode(rows, "bench"))
+        rows = delta.filter_rows(rows)
+        delta_rows += len(rows)
+        if rows:
+            delta_bytes += len(encode(rows, "bench"))
+        num_sessions += 1
+        max_devices = max(max_devices, len(delta))
+
+    print(
+        f"{len(probes):,} probe requests in {num_sessions:,} sessions, "
+        f"{args.encoding} payloads"
+    )
+    for name, rows, size in (
+        ("full", full_rows, full_bytes),
+        ("delta", delta_rows, delta_bytes),
+    ):
+        print(f"{name:>6}: {rows:>10,} rows {size:>14,} bytes")
+    print(
+        f"reduction: {full_rows / max(delta_rows, 1):.1f}x rows, "
+        f"{full_bytes / max(delta_bytes, 1):.1f}x bytes, "
+        f"device table peaked at {max_devices:,} entries"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Spill rows to each local store backend and drain them again, as the main
+process does during and after an outage, and report throughput and write
+amplification. Bytes written are taken from /proc/self/io: wchar counts bytes
+handed to write(), write_bytes counts bytes sent to the storage device (0 on
+tmpfs, so point -d at the SD card). Amplification is relative to the size of
+the rows pickled as one block.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_local_store [-n 200000] [-s 5000] [-b 500]
+        [-d ./database/bench]
+"""
+import argparse
+import configparser
+import logging
+import os
+import pickle
+import shutil
+from time import perf_counter
+from typing import Dict
+
+from benchmarks.bench_db_insert import make_rows
+from local_store import make_local_store
+
+
+def proc_io() -> Dict[str, int]:
+    with open("/proc/self/io", "r") as f:
+        return {
+            key: int(value) for key, value in (line.split(": ") for line in f)
+        }
+
+
+def run(name: str, config, rows, spill_size: int, batch_size: int) -> None:
+    raw_bytes = len(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+    os.sync()
+    io_before = proc_io()
+    store = make_local_store(config)
+    start = perf_counter()
+    for i in range(0, len(rows), spill_size):
+        assert store.store_rows(rows[i : i + spill_size])
+    os.sync()
+    write_elapsed = perf_counter() - start
+    io_written = proc_io()
+
+    start = perf_counter()
+    drained = 0
+    while True:
+        batch = store.fetch_rows_all_col(batch_size)
+        if not batch:
+            break
+        drained += len(batch)
+    store.close_connection()
+    os.sync()
+    drain_elapsed = perf_counter() - start
+    io_after = proc_io()
+    assert drained == len(rows), drained
+
+    def amplification(key: str, io_from, io_to) -> str:
+        written = io_to[key] - io_from[key]
+        return (
+            f"{written / len(rows):>7.1f} B/row ({written / raw_bytes:>5.2f}x)"
+        )
+
+    print(f"{name}:")
+    print(
+        f"    spill: {len(rows) / write_elapsed:>10,.0f} rows/sec, "
+        f"wchar {amplification('wchar', io_before, io_written)}, "
+        f"write_bytes {amplification('write_bytes', io_before, io_written)}"
+    )
+    print(
+        f"    drain: {len(rows) / drain_elapsed:>10,.0f} rows/sec, "
+        f"wchar {amplification('wchar', io_written, io_after)}, "
+        f"write_bytes {amplification('write_bytes', io_written, io_after)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_rows",
+        default=200000,
+        type=int,
+        help="Number of rows to spill and drain. Default: 200000",
+    )
+    parser.add_argument(
+        "-s",
+        dest="spill_size",
+        default=5000,
+        type=int,
+        help="Number of rows spilled at once. Default: 5000",
+    )
+    parser.add_argument(
+        "-b",
+        dest="batch_size",
+        default=500,
+        type=int,
+        help="Number of rows drained at once. Default: 500",
+    )
+    parser.add_argument(
+        "-d",
+        dest="bench_dir",
+        default="./database/bench",
+        type=str,
+        help="Directory holding the stores. Default: ./database/bench",
+    )
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    rows = make_rows(args.num_rows)
+    for backend in ["sqlite", "journal"]:
+        os.makedirs(args.bench_dir, exist_ok=True)
+        config = configparser.ConfigParser()
+        config.read("app_config.ini")
+        config["sqlite"]["DB_LOC"] = os.path.join(args.bench_dir, "bench.db")
+        config["local_store"]["JOURNAL_DIR"] = os.path.join(
+            args.bench_dir, "journal"
+        )
+        config["local_store"]["BACKEND"] = backend
+        try:
+            run(backend, config, rows, args.spill_size, args.batch_size)
+        finally:
+            shutil.rmtree(args.bench_dir)
+
+
+if __name__ == "__main__":
+    main()
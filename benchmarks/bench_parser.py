@@ -0,0 +1,97 @@
+"""
+Replay tcpdump captures through the line parser and report lines/sec.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_parser [capture.txt ...] [-n 200000]
+
+Captures are the text files produced by `sniff-probes.sh -o`. If none is
+given, a synthetic capture is generated instead.
+"""
+import argparse
+import re
+from time import perf_counter
+from typing import Callable, List
+
+from benchmarks.synthetic import make_tcpdump_lines
+from probe_parser import capture_time_to_ms, parse_channel, parse_probe
+
+
+def legacy_parse(line: bytes):
+    """ The per-line parsing previously done inline in collect_data """
+    decoded_line = line.decode("utf-8").strip()
+    if decoded_line.isnumeric():
+        return int(decoded_line)
+    return re.match(
+        r"(\d{4}-\d{2}-\d{2}\s\d{2}\:\d{2}\:\d{2}\.\d{3}).+(-\d+)dBm.+SA((\:[0-9a-f]{2}){6})",
+        decoded_line,
+    )
+
+
+def fast_parse(line: bytes):
+    """ The per-line parsing now done in collect_data """
+    channel = parse_channel(line)
+    if channel is not None:
+        return channel
+    return parse_probe(line)
+
+
+def fast_parse_int(line: bytes):
+    """ Same as fast_parse, with MAC addresses packed into ints """
+    channel = parse_channel(line)
+    if channel is not None:
+        return channel
+    return parse_probe(line, True)
+
+
+def run(name: str, func: Callable, lines: List[bytes], repeat: int) -> None:
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        for line in lines:
+            func(line)
+        best = min(best, perf_counter() - start)
+    print(f"{name:>8}: {len(lines) / best:>12,.0f} lines/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="*", help="Recorded captures")
+    parser.add_argument(
+        "-n",
+        dest="num_lines",
+        default=200000,
+        type=int,
+        help="Synthetic lines if no capture is given. Default: 200000",
+    )
+    parser.add_argument(
+        "-r", dest="repeat", default=5, type=int, help="Repeats. Default: 5"
+    )
+    args = parser.parse_args()
+
+    lines: List[bytes] = []
+    for capture in args.captures:
+        with open(capture, "rb") as f:
+            lines.extend(f.readlines())
+    if not lines:
+        lines = make_tcpdump_lines(args.num_lines)
+
+    # make sure both parsers agree before timing them
+    for line in lines:
+        old, new = legacy_parse(line), fast_parse(line)
+        if isinstance(old, int) or old is None:
+            assert old == new, line
+        else:
+            assert new == (
+                capture_time_to_ms(old.group(1).encode("ascii")),
+                int(old.group(2)),
+                old.group(3)[1:],
+            )
+
+    print(f"{len(lines):,} lines")
+    run("legacy", legacy_parse, lines, args.repeat)
+    run("fast", fast_parse, lines, args.repeat)
+    run("fast-int", fast_parse_int, lines, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
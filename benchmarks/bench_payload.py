@@ -0,0 +1,93 @@
+"""
+Encode batches of rows with each payload encoding and report encode time and
+bytes per row, for raw, int and hashed MAC addresses.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_payload [-b 500] [-r 200]
+"""
+import argparse
+import random
+from time import perf_counter
+
+from benchmarks.synthetic import random_mac
+from payload_encoding import decode_payload, get_encoder
+from utility import hash_mac, is_physical, mac_to_int, mac_to_str
+
+ENCODINGS = [
+    "json",
+    "columnar",
+    "columnar+zlib",
+    "columnar+lzma",
+    "binary",
+    "binary+zlib",
+    "binary+lzma",
+]
+
+
+def make_batch(batch_size: int, mac_form: str):
+    rng = random.Random(0)
+    macs = [random_mac(rng) for _ in range(batch_size // 2)]
+    rows = []
+    for i in range(batch_size):
+        mac = rng.choice(macs)
+        if mac_form == "int":
+            mac = mac_to_int(mac)
+        elif mac_form == "hashed":
+            mac = hash_mac(mac)
+        rows.append(
+            (
+                mac,
+                is_physical(mac),
+                True,
+                1571922000000 + 7 * i,
+                -rng.randrange(20, 95),
+                rng.randrange(1, 12),
+            )
+        )
+    return rows
+
+
+def run(name: str, batch, repeat: int) -> None:
+    encode = get_encoder(name)
+    payload = encode(batch, "MobintelSensor1")
+    if name != "json":  # json has no decoder, it is the reference format
+        _, rows = decode_payload(payload)
+        assert [r[3:] for r in rows] == [r[3:] for r in batch]
+        assert [r[0] for r in rows] == [mac_to_str(r[0]) for r in batch]
+    start = perf_counter()
+    for _ in range(repeat):
+        encode(batch, "MobintelSensor1")
+    elapsed = (perf_counter() - start) / repeat
+    print(
+        f"{name:>14}: {elapsed * 1000:>7.2f} ms/batch, "
+        f"{len(payload) / len(batch):>6.1f} bytes/row"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-b",
+        dest="batch_size",
+        default=500,
+        type=int,
+        help="Number of rows in each batch. Default: 500",
+    )
+    parser.add_argument(
+        "-r",
+        dest="repeat",
+        default=200,
+        type=int,
+        help="Number of times each batch is encoded. Default: 200",
+    )
+    args = parser.parse_args()
+
+    for mac_form in ["str", "int", "hashed"]:
+        print(f"MAC addresses as {mac_form}:")
+        batch = make_batch(args.batch_size, mac_form)
+        for name in ENCODINGS:
+            run(name, batch, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare the text pipeline (tcpdump text read in blocks, then parsed with
+parse_channel/parse_probe) against the pcap pipeline (pcap records read in
+blocks, then decoded with parse_radiotap_probe), each fed through `cat` the
+way collect_data reads sniff-probes.sh.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_pcap [capture.pcap ...] [-n 100000] [-b 65536]
+
+Captures are the files produced by `sniff-probes.sh --pcap -o`. If none is
+given, a synthetic text feed and a synthetic pcap holding the same number of
+probe requests are compared.
+"""
+import argparse
+import os
+import tempfile
+from subprocess import PIPE, Popen
+from time import perf_counter
+
+from benchmarks.synthetic import make_pcap, make_tcpdump_lines
+from line_reader import iter_line_batches
+from pcap_parser import iter_pcap_records, parse_radiotap_probe
+from probe_parser import parse_channel, parse_probe
+
+
+def consume_text(stream, block_size: int, mac_as_int: bool) -> int:
+    count = 0
+    for lines in iter_line_batches(stream, block_size):
+        for line in lines:
+            if parse_channel(line) is None:
+                if parse_probe(line, mac_as_int) is not None:
+                    count += 1
+    return count
+
+
+def consume_pcap(stream, block_size: int, mac_as_int: bool) -> int:
+    count = 0
+    for records in iter_pcap_records(stream, block_size):
+        for _, frame in records:
+            if parse_radiotap_probe(frame, mac_as_int) is not None:
+                count += 1
+    return count
+
+
+def run(name: str, path: str, consume, block_size: int, mac_as_int: bool):
+    proc = Popen(["cat", path], stdout=PIPE, bufsize=-1)
+    start = perf_counter()
+    count = consume(proc.stdout, block_size, mac_as_int)
+    elapsed = perf_counter() - start
+    proc.wait()
+    size = os.path.getsize(path)
+    print(
+        f"{name:>14}: {count / elapsed:>12,.0f} probes/sec "
+        f"({count:,} probes, {size / max(count, 1):.0f} bytes/probe)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="*", help="Recorded pcap captures")
+    parser.add_argument(
+        "-n",
+        dest="num_probes",
+        default=100000,
+        type=int,
+        help="Number of probe requests in synthetic feeds. Default: 100000",
+    )
+    parser.add_argument(
+        "-b",
+        dest="block_size",
+        default=65536,
+        type=int,
+        help="Block size of the readers. Default: 65536",
+    )
+    args = parser.parse_args()
+
+    if args.captures:
+        for path in args.captures:
+            print(path)
+            for mac_as_int in (False, True):
+                name = "pcap, int MAC" if mac_as_int else "pcap"
+                run(name, path, consume_pcap, args.block_size, mac_as_int)
+        return
+
+    paths = []
+    try:
+        for suffix, data in (
+            (".txt", b"".join(make_tcpdump_lines(args.num_probes))),
+            (".pcap", make_pcap(args.num_probes)),
+        ):
+            fd, path = tempfile.mkstemp(suffix=suffix)
+            paths.append(path)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        for mac_as_int in (False, True):
+            print("int MAC" if mac_as_int else "str MAC")
+            run("text", paths[0], consume_text, args.block_size, mac_as_int)
+            run("pcap", paths[1], consume_pcap, args.block_size, mac_as_int)
+    finally:
+        for path in paths:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Compare reading the output of a child process line by line against reading
+it in blocks, on a synthetic feed piped through `cat`.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_reader [-n 100000] [-b 65536]
+"""
+import argparse
+import os
+import tempfile
+from subprocess import PIPE, Popen
+from time import perf_counter
+
+from benchmarks.synthetic import make_tcpdump_lines
+from line_reader import iter_line_batches, iter_lines
+from probe_parser import parse_channel, parse_probe
+
+
+def consume(reader, parse: bool) -> int:
+    count = 0
+    for lines in reader:
+        if parse:
+            for line in lines:
+                if parse_channel(line) is None:
+                    parse_probe(line)
+        count += len(lines)
+    return count
+
+
+def readline_reader(stream):
+    # the original reader, line by line with no timeout, as a baseline
+    for line in iter(stream.readline, b""):
+        yield [line]
+
+
+def run(name: str, path: str, bufsize: int, make_reader, parse: bool):
+    proc = Popen(["cat", path], stdout=PIPE, bufsize=bufsize)
+    start = perf_counter()
+    count = consume(make_reader(proc.stdout), parse)
+    elapsed = perf_counter() - start
+    proc.wait()
+    print(f"{name:>14}: {count / elapsed:>12,.0f} lines/sec ({count:,} lines)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="num_lines",
+        default=100000,
+        type=int,
+        help="Number of probe lines in the feed. Default: 100000",
+    )
+    parser.add_argument(
+        "-b",
+        dest="block_size",
+        default=65536,
+        type=int,
+        help="Block size of the block reader. Default: 65536",
+    )
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.writelines(make_tcpdump_lines(args.num_lines))
+
+        def block_reader(stream):
+            return iter_line_batches(stream, args.block_size)
+
+        for parse in (False, True):
+            print("read + parse" if parse else "read only")
+            run("readline", path, 1, readline_reader, parse)
+            run("line", path, -1, iter_lines, parse)
+            run("block", path, -1, block_reader, parse)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Kill the data collection process every -k seconds (SIGKILL, as in a crash)
+while the pipeline runs as in benchmarks.replay, and measure the restart gap,
+i.e. the time from the kill until another data collection process runs, and
+the rows delivered compared to a run without kills, when:
+
+- restart:      data collection is restarted on the same capture, without
+                checkpoints, so its open sessions are lost;
+- checkpoint:   open sessions are checkpointed every CHECKPOINT_INTERVAL
+                seconds, as configured, and resumed;
+- standby:      checkpoints, and a warm standby takes over.
+
+Each scenario runs in its own interpreter. STABLE_AFTER is lowered below -k,
+so that every kill is restarted at once rather than backed off.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_restart [-t 60] [-k 7] [-s 10] [-r 1000]
+        [-e binary]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+from time import monotonic
+
+from benchmarks.replay import make_config, percentile
+from benchmarks.stubs import ProbeStub, StubMQTTClient
+from orchestrator import Orchestrator
+
+# settings of app_config.ini changed by each scenario
+SCENARIOS = {
+    "no kills": {},
+    "restart": {("collect_data", "CHECKPOINT_INTERVAL"): "0"},
+    "checkpoint": {},
+    "standby": {("health_check", "WARM_STANDBY"): "true"},
+}
+
+
+async def run(args, orchestrator, client, kills: bool):
+    task = asyncio.ensure_future(orchestrator.run())
+    radio = orchestrator.radios[0]
+    start = monotonic()
+    next_kill = start + args.kill_interval
+    gaps = []
+    while monotonic() - start < args.duration and not task.done():
+        await asyncio.sleep(0.05)
+        proc = radio.col_data_proc
+        if not kills or monotonic() < next_kill or proc is None:
+            continue
+        os.kill(proc.pid, signal.SIGKILL)
+        killed_at = monotonic()
+        while radio.col_data_proc is proc and not task.done():
+            await asyncio.sleep(0.001)
+        gaps.append(monotonic() - killed_at)
+        next_kill = monotonic() + args.kill_interval
+    rows = client.acked_rows + len(orchestrator.data_q)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return {"rows": rows, "gaps": gaps}
+
+
+def run_scenario(args, name: str) -> None:
+    """ Run one scenario, and print its result as JSON """
+    logging.disable(logging.INFO)
+    tmp_dir = tempfile.mkdtemp(prefix="restart-")
+    probe = ProbeStub()
+    client = StubMQTTClient()
+    config = make_config(args, tmp_dir, probe.port)
+    config["health_check"]["STABLE_AFTER"] = str(args.kill_interval / 2)
+    for (section, key), value in SCENARIOS[name].items():
+        config[section][key] = value
+    sniff_cmd = (
+        f"exec {sys.executable} -m benchmarks.fake_sniffer -r {args.rate} -t 0"
+    )
+    orchestrator = Orchestrator(
+        config,
+        {"restart": sniff_cmd},
+        args.session_duration,
+        mqtt_client=client,
+    )
+    kills = name != "no kills"
+    try:
+        result = asyncio.run(run(args, orchestrator, client, kills))
+    finally:
+        orchestrator.stop_processes()
+        shutil.rmtree(tmp_dir)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-t",
+        dest="duration",
+        default=60,
+        type=float,
+        help="Duration of each scenario in seconds. Default: 60",
+    )
+    parser.add_argument(
+        "-k",
+        dest="kill_interval",
+        default=7,
+        type=float,
+        help="Seconds between kills of data collection. Default: 7",
+    )
+    parser.add_argument(
+        "-s",
+        dest="session_duration",
+        default=10,
+        type=int,
+        help="Duration of a monitoring session, in seconds. Default: 10",
+    )
+    parser.add_argument(
+        "-r",
+        dest="rate",
+        default=1000,
+        type=float,
+        help="Probe request lines per second. Default: 1000",
+    )
+    parser.add_argument(
+        "-e",
+        dest="encoding",
+        default="binary",
+        type=str,
+        help="PAYLOAD_ENCODING. Default: binary",
+    )
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.scenario:
+        run_scenario(args, args.scenario)
+        return
+
+    results = {}
+    for name in SCENARIOS:
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_restart"]
+            + ["--scenario", name]
+            + sys.argv[1:],
+            stdout=subprocess.PIPE,
+            timeout=args.duration + 120,
+            check=True,
+        ).stdout
+        results[name] = json.loads(out.splitlines()[-1])
+    baseline = max(results["no kills"]["rows"], 1)
+    for name, result in results.items():
+        gaps = result["gaps"]
+        line = (
+            f"{name:>10}: {result['rows']:>8,} rows "
+            f"({result['rows'] / baseline:.1%})"
+        )
+        if gaps:
+            line += (
+                f", {len(gaps)} kills, restart gap p50 "
+                f"{percentile(gaps, 0.5) * 1000:.0f} ms, "
+                f"max {max(gaps) * 1000:.0f} ms"
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Measure cold start: the time from launching a fresh interpreter until the
+first probe request line is parsed by the data collection process. Each run
+boots like main.py (imports, Orchestrator, asyncio loop), with sniff-probes.sh
+replaced by `cat` of synthetic tcpdump lines and the MQTT client by
+StubMQTTClient, and stops once the first line is parsed. Also reported are
+the times at which the imports are done and the Orchestrator is built.
+
+Usage (from the repo root):
+    python -m benchmarks.bench_startup [-n 10] [-y]
+"""
+import argparse
+import asyncio
+import configparser
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import time
+from typing import Dict
+
+STAGES = ("imported", "constructed", "first_line")
+
+
+def mark(marker: str, stage: str) -> None:
+    """ Append the time `stage` is reached to the marker file """
+    fd = os.open(marker, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, f"{stage} {time()}\n".encode("ascii"))
+    finally:
+        os.close(fd)
+
+
+def read_marks(marker: str) -> Dict[str, float]:
+    try:
+        with open(marker, "r") as f:
+            return {
+                stage: float(t) for stage, t in (line.split() for line in f)
+            }
+    except OSError:
+        return {}
+
+
+def boot(marker: str, feed: str, tmp_dir: str) -> None:
+    """ Boot the way main.py does, until the first line is parsed """
+    import main  # noqa: F401, the imports and logging setup of a real boot
+    import logging
+    import collect_data
+    from benchmarks.stubs import StubMQTTClient
+    from orchestrator import Orchestrator
+
+    mark(marker, "imported")
+    logging.disable(logging.INFO)
+    parse_probe = collect_data.parse_probe
+
+    def first_parse(line, *args):  # runs in the data collection process
+        collect_data.parse_probe = parse_probe
+        mark(marker, "first_line")
+        return parse_probe(line, *args)
+
+    collect_data.parse_probe = first_parse
+
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    config["sqlite"]["DB_LOC"] = os.path.join(tmp_dir, "startup.db")
+    config["local_store"]["JOURNAL_DIR"] = os.path.join(tmp_dir, "journal")
+    config["overflow"]["JOURNAL_DIR"] = os.path.join(tmp_dir, "overflow")
+    config["collect_data"]["CHECKPOINT_DIR"] = os.path.join(
+        tmp_dir, "checkpoint"
+    )
+    config["metrics"]["METRICS_DIR"] = os.path.join(tmp_dir, "metrics")
+    config["health_check"]["PROBE_HOST"] = "127.0.0.1"
+    orchestrator = Orchestrator(
+        config,
+        {"startup": f"exec cat {feed}"},
+        60,
+        mqtt_client=StubMQTTClient(),
+    )
+    mark(marker, "constructed")
+
+    async def run_until_parsed():
+        task = asyncio.ensure_future(orchestrator.run())
+        while not task.done() and "first_line" not in read_marks(marker):
+            await asyncio.sleep(0.005)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        asyncio.run(run_until_parsed())
+    finally:
+        orchestrator.stop_processes()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-n",
+        dest="runs",
+        default=10,
+        type=int,
+        help="Number of cold starts. Default: 10",
+    )
+    parser.add_argument(
+        "-y",
+        dest="no_log_cache",
+        action="store_true",
+        help="Drop the cached logging config before each run, such that "
+        "logger_config.yaml is parsed again",
+    )
+    parser.add_argument("--boot", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.boot:
+        boot(*args.boot)
+        return
+
+    from benchmarks.synthetic import make_tcpdump_lines
+    from log_setup import CACHE_FILE
+
+    tmp_dir = tempfile.mkdtemp(prefix="startup-")
+    feed = os.path.join(tmp_dir, "feed.txt")
+    with open(feed, "wb") as f:
+        f.writelines(make_tcpdump_lines(1000))
+    marker = os.path.join(tmp_dir, "marks")
+    results: Dict[str, list] = {stage: [] for stage in STAGES}
+    try:
+        for _ in range(args.runs):
+            if os.path.exists(marker):
+                os.remove(marker)
+            if args.no_log_cache and os.path.exists(CACHE_FILE):
+                os.remove(CACHE_FILE)
+            run_dir = tempfile.mkdtemp(dir=tmp_dir)
+            start = time()
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.bench_startup",
+                    "--boot",
+                    marker,
+                    feed,
+                    run_dir,
+                ],
+                stdout=subprocess.DEVNULL,
+                timeout=60,
+                check=True,
+            )
+            marks = read_marks(marker)
+            for stage in STAGES:
+                results[stage].append(marks[stage] - start)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    print(f"{args.runs} cold starts, seconds since launch:")
+    for stage in STAGES:
+        times = results[stage]
+        print(
+            f"{stage:>12}: median {median(times):.3f} "
+            f"min {min(times):.3f} max {max(times):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
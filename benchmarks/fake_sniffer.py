@@ -0,0 +1,87 @@
+"""
+Stand-in for sniff-probes.sh: write tcpdump probe request lines and channel
+switch lines to stdout at a given rate. Lines come from a recorded tcpdump
+output (-f) or are synthetic, and their timestamps are rewritten to the
+current time, so that latency from capture to publish can be measured.
+
+Usage (from the repo root):
+    python -m benchmarks.fake_sniffer [-r 1000] [-t 60] [-f recorded.txt]
+        [-c 0.5]
+"""
+import argparse
+import sys
+from datetime import datetime
+from itertools import cycle
+from time import monotonic, sleep
+
+from benchmarks.synthetic import make_tcpdump_lines
+from probe_parser import parse_channel
+
+TIME_LEN = len("2019-10-24 13:45:01.123456")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r",
+        dest="rate",
+        default=1000,
+        type=float,
+        help="Probe request lines per second. Default: 1000",
+    )
+    parser.add_argument(
+        "-t",
+        dest="duration",
+        default=60,
+        type=float,
+        help="Seconds to run for, 0 to run until killed. Default: 60",
+    )
+    parser.add_argument(
+        "-f",
+        dest="recorded",
+        default=None,
+        type=str,
+        help="Recorded tcpdump output to replay. Default: synthetic lines",
+    )
+    parser.add_argument(
+        "-c",
+        dest="channel_dur",
+        default=0.5,
+        type=float,
+        help="Time spent on each channel, in seconds. Default: 0.5",
+    )
+    args = parser.parse_args()
+
+    if args.recorded is not None:
+        with open(args.recorded, "rb") as f:
+            lines = [line for line in f if parse_channel(line) is None]
+    else:
+        lines = make_tcpdump_lines(10000, lines_per_channel=10**9)[1:]
+    out = sys.stdout.buffer
+    start = next_hop = monotonic()
+    channel = 0
+    sent = 0
+    # write in chunks of 10 ms worth of lines
+    chunk = max(int(args.rate / 100), 1)
+    source = cycle(lines)
+    try:
+        while not args.duration or monotonic() - start < args.duration:
+            now = monotonic()
+            if now >= next_hop:
+                channel = channel % 11 + 1
+                out.write(f"{channel}\n".encode("ascii"))
+                next_hop = now + args.channel_dur
+            stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f").encode()
+            for _ in range(chunk):
+                out.write(stamp + next(source)[TIME_LEN:])
+            out.flush()
+            sent += chunk
+            ahead = start + sent / args.rate - monotonic()
+            if ahead > 0:
+                sleep(ahead)
+    except BrokenPipeError:  # the reader is gone
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+End-to-end benchmark of the whole pipeline without a monitor-mode interface
+or AWS IoT. The Orchestrator runs as in main.py, but sniff-probes.sh is
+replaced by benchmarks.fake_sniffer, the MQTT client by StubMQTTClient, and
+the connectivity probe target by a local ProbeStub. The link can go down and
+up periodically, cutting both MQTT and the probe. Reports throughput,
+latency from capture to acknowledgement and peak memory of each process.
+
+Usage (from the repo root):
+    python -m benchmarks.replay [-r 1000] [-t 60] [-s 10] [-f recorded.txt]
+        [-o 20:10] [-e binary] [-a 0.05]
+"""
+import argparse
+import asyncio
+import configparser
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from time import monotonic
+from typing import Dict
+
+from benchmarks.stubs import ProbeStub, StubMQTTClient
+from orchestrator import Orchestrator
+
+
+def peak_rss_mb(pid: int) -> float:
+    """ Peak resident set size (VmHWM) of a process in MB, 0 if it is gone """
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def make_config(args, tmp_dir: str, probe_port: int):
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    config["sqlite"]["DB_LOC"] = os.path.join(tmp_dir, "replay.db")
+    config["local_store"]["JOURNAL_DIR"] = os.path.join(tmp_dir, "journal")
+    config["overflow"]["JOURNAL_DIR"] = os.path.join(tmp_dir, "overflow")
+    config["collect_data"]["CHECKPOINT_DIR"] = os.path.join(
+        tmp_dir, "checkpoint"
+    )
+    config["metrics"]["METRICS_DIR"] = os.path.join(tmp_dir, "metrics")
+    config["metrics"]["FLUSH_INTERVAL"] = "1"
+    config["health_check"]["PROBE_HOST"] = "127.0.0.1"
+    config["health_check"]["PROBE_PORT"] = str(probe_port)
+    config["health_check"]["PROBE_BACKOFF_MAX"] = "4"
+    config["health_check"]["STATS_INTERVAL"] = "10"
+    config["aws_iot"]["PAYLOAD_ENCODING"] = args.encoding
+    return config
+
+
+async def run(args, orchestrator, client, probe) -> Dict[str, float]:
+    task = asyncio.ensure_future(orchestrator.run())
+    up, down = 0.0, 0.0
+    if args.outage:
+        up, down = (float(v) for v in args.outage.split(":"))
+    start = monotonic()
+    link_up, next_switch = True, start + up
+    peaks = {"main": 0.0, "collector": 0.0}
+    outages = 0
+    while monotonic() - start < args.duration and not task.done():
+        await asyncio.sleep(0.5)
+        if down and monotonic() >= next_switch:
+            link_up = not link_up
+            outages += not link_up
+            client.set_link(link_up)
+            orchestrator.monitor.PROBE_PORT = (
+                probe.port if link_up else probe.dead_port
+            )
+            next_switch = monotonic() + (up if link_up else down)
+        peaks["main"] = max(peaks["main"], peak_rss_mb(os.getpid()))
+        radio = orchestrator.radios[0]
+        if radio.col_data_proc is not None:
+            peaks["collector"] = max(
+                peaks["collector"], peak_rss_mb(radio.col_data_proc.pid)
+            )
+    elapsed = monotonic() - start
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    peaks["elapsed"] = elapsed
+    peaks["outages"] = outages
+    return peaks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-r",
+        dest="rate",
+        default=1000,
+        type=float,
+        help="Probe request lines per second. Default: 1000",
+    )
+    parser.add_argument(
+        "-t",
+        dest="duration",
+        default=60,
+        type=float,
+        help="Duration of the run in seconds. Default: 60",
+    )
+    parser.add_argument(
+        "-s",
+        dest="session_duration",
+        default=10,
+        type=int,
+        help="Duration of a monitoring session, in seconds. Default: 10",
+    )
+    parser.add_argument(
+        "-f",
+        dest="recorded",
+        default=None,
+        type=str,
+        help="Recorded tcpdump output to replay. Default: synthetic lines",
+    )
+    parser.add_argument(
+        "-o",
+        dest="outage",
+        default="",
+        type=str,
+        help="UP:DOWN, seconds of link up and down, repeated. "
+        "Default: no outage",
+    )
+    parser.add_argument(
+        "-e",
+        dest="encoding",
+        default="binary",
+        type=str,
+        help="PAYLOAD_ENCODING, columnar or binary (+zlib/+lzma). "
+        "Default: binary",
+    )
+    parser.add_argument(
+        "-a",
+        dest="ack_latency",
+        default=0.05,
+        type=float,
+        help="Seconds before the broker stand-in acknowledges. Default: 0.05",
+    )
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    tmp_dir = tempfile.mkdtemp(prefix="replay-")
+    probe = ProbeStub()
+    client = StubMQTTClient(args.ack_latency)
+    config = make_config(args, tmp_dir, probe.port)
+    sniff_cmd = (
+        f"exec {sys.executable} -m benchmarks.fake_sniffer -r {args.rate} -t 0"
+    )
+    if args.recorded is not None:
+        sniff_cmd += f" -f {args.recorded}"
+    orchestrator = Orchestrator(
+        config,
+        {"replay": sniff_cmd},
+        args.session_duration,
+        mqtt_client=client,
+    )
+    try:
+        result = asyncio.run(run(args, orchestrator, client, probe))
+    finally:
+        orchestrator.stop_processes()
+    with open(os.path.join(tmp_dir, "metrics", "collect_data.json")) as f:
+        collected = json.load(f)["metrics"]
+    shutil.rmtree(tmp_dir)
+
+    elapsed = result["elapsed"]
+    print(f"{elapsed:.0f}s run, {result['outages']:.0f} outages")
+    print(
+        f"lines read: {collected['collect_lines_total'] / elapsed:,.0f}/sec, "
+        f"{collected['collect_parse_failures_total']:.0f} parse failures"
+    )
+    print(
+        f"rows acked: {client.acked_rows:,} "
+        f"({client.acked_rows / elapsed:,.1f}/sec), "
+        f"{client.acked_bytes / max(client.acked_rows, 1):.1f} bytes/row"
+    )
+    latencies = client.latencies
+    print(
+        "capture to ack latency: "
+        + ", ".join(
+            f"p{int(q * 100)} {percentile(latencies, q):.2f}s"
+            for q in (0.5, 0.95, 0.99)
+        )
+        + f", max {max(latencies, default=float('nan')):.2f}s"
+    )
+    print(
+        f"peak RSS: main {result['main']:.1f} MB, "
+        f"collector {result['collector']:.1f} MB"
+    )
+
+
+if __name__ == "__main__":
+    main()
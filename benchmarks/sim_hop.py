@@ -0,0 +1,251 @@
+"""
+Simulate channel hopping against per-channel probe request traffic, and
+compare the unique devices captured by the fixed rotation of sniff-probes.sh
+with those captured by the adaptive HopScheduler, on the same radio.
+
+Traffic comes from a recorded tcpdump output (-f, as produced by
+`sniff-probes.sh --channel_hop -o`) or from a synthetic model where devices
+come and go and probe mostly on channels 1, 6 and 11. A recording only holds
+what the radio heard while on each channel, so the stretches spent on a
+channel are concatenated into a stream of that channel, which is looped.
+Each switch costs -w seconds during which nothing is captured.
+
+Usage (from the repo root):
+    python -m benchmarks.sim_hop [-f recorded.txt] [-t 1800] [-s 60]
+        [-d 0.5] [-m 0.03] [-w 0.05] [-n 3000]
+"""
+import argparse
+import configparser
+import random
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+from typing import Dict, List, Optional, Set, Tuple
+
+from hop_scheduler import HopScheduler
+from probe_parser import parse_channel, parse_probe
+
+# share of probe bursts sent on each channel in the synthetic model
+CHANNEL_WEIGHTS = {1: 0.3, 6: 0.3, 11: 0.25}
+OTHER_CHANNELS_WEIGHT = 0.15
+
+
+class ChannelStream:
+    """ Probe requests heard on one channel, by time in seconds """
+
+    def __init__(self, events: List[Tuple[float, str]], loop: Optional[float]):
+        events.sort()
+        self.times = [t for t, _ in events]
+        self.macs = [mac for _, mac in events]
+        self.loop = loop  # length of the stream if looped, else None
+
+    def heard(self, t0: float, t1: float) -> List[str]:
+        """ MAC addresses of probe requests sent between t0 and t1 """
+        if self.loop:
+            t0, t1 = t0 % self.loop, t0 % self.loop + (t1 - t0)
+            if t1 > self.loop:  # wraps around
+                return self.heard(t0, self.loop) + self.heard(
+                    0, t1 - self.loop
+                )
+        start = bisect_left(self.times, t0)
+        return self.macs[start : bisect_left(self.times, t1, start)]
+
+
+def synthetic_streams(
+    duration: float, num_devices: int, seed: int = 0
+) -> Dict[int, ChannelStream]:
+    """
+    Devices arrive over time, stay 5 minutes on average, and send a burst of
+    probe requests on one channel, drawn by CHANNEL_WEIGHTS, every 30s on
+    average.
+    """
+    rng = random.Random(seed)
+    weights = dict(CHANNEL_WEIGHTS)
+    others = [c for c in range(1, 12) if c not in weights]
+    for c in others:
+        weights[c] = OTHER_CHANNELS_WEIGHT / len(others)
+    channels = list(weights)
+    cum_weights = list(accumulate(weights[c] for c in channels))
+    events: Dict[int, List[Tuple[float, str]]] = defaultdict(list)
+    for i in range(num_devices):
+        mac = f"{i:012x}"
+        t = rng.uniform(-300, duration)
+        leave = t + rng.expovariate(1 / 300)  # stays 5 min on average
+        while t < leave:
+            t += rng.expovariate(1 / 30)  # a burst every 30s on average
+            if 0 <= t < duration:
+                channel = rng.choices(channels, cum_weights=cum_weights)[0]
+                for k in range(rng.randint(1, 4)):
+                    events[channel].append((t + 0.02 * k, mac))
+    return {c: ChannelStream(events[c], None) for c in range(1, 12)}
+
+
+def recorded_streams(
+    path: str, channel_dur: float
+) -> Dict[int, ChannelStream]:
+    """
+    Cut a recording into the stretches spent on each channel, assumed to be
+    {channel_dur} seconds each, and concatenate them by channel.
+    """
+    events: Dict[int, List[Tuple[float, str]]] = defaultdict(list)
+    stretches: Dict[int, int] = defaultdict(int)
+    channel, start = None, None
+    with open(path, "rb") as f:
+        for line in f:
+            new_channel = parse_channel(line)
+            if new_channel is not None:
+                channel, start = new_channel, None
+                stretches[channel] += 1
+                continue
+            probe = parse_probe(line)
+            if probe is None or channel is None:
+                continue
+            t = probe[0] / 1000
+            if start is None:
+                start = t
+            offset = min(max(t - start, 0), channel_dur * 0.999)
+            events[channel].append(
+                ((stretches[channel] - 1) * channel_dur + offset, probe[2])
+            )
+    return {
+        c: ChannelStream(events[c], stretches[c] * channel_dur)
+        for c in stretches
+    }
+
+
+def simulate(
+    streams: Dict[int, ChannelStream],
+    scheduler: HopScheduler,
+    adaptive: bool,
+    duration: float,
+    sess_dur: float,
+    switch_cost: float,
+) -> Tuple[float, int, Dict[int, float]]:
+    """
+    Hop through the channels of `scheduler` for `duration` seconds.
+
+    Returns:
+        (mean unique MAC addresses per minute, unique MAC addresses overall,
+        share of time spent on each channel)
+    """
+    t, next_session = 0.0, sess_dur
+    seen: Dict[int, Set[str]] = defaultdict(set)  # this session, by channel
+    per_minute: Dict[int, Set[str]] = defaultdict(set)
+    overall: Set[str] = set()
+    time_on: Dict[int, float] = defaultdict(float)
+    while t < duration:
+        for channel, dwell in scheduler.plan():
+            end = min(t + dwell, duration)
+            stream = streams.get(channel)
+            if stream is not None:
+                for mac in stream.heard(t + switch_cost, end):
+                    seen[channel].add(mac)
+                    per_minute[int(t // 60)].add(mac)
+                    overall.add(mac)
+            scheduler.record_dwell(channel, end - t)
+            time_on[channel] += end - t
+            t = end
+            if t >= next_session:
+                if adaptive:
+                    scheduler.reweight({c: len(m) for c, m in seen.items()})
+                seen.clear()
+                next_session += sess_dur
+            if t >= duration:
+                break
+    minutes = [
+        len(macs) for m, macs in per_minute.items() if m < duration // 60
+    ]
+    shares = {c: time_on[c] / duration for c in sorted(time_on)}
+    return sum(minutes) / max(len(minutes), 1), len(overall), shares
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-f",
+        dest="recorded",
+        default=None,
+        type=str,
+        help="Recorded tcpdump output with channel lines. Default: synthetic",
+    )
+    parser.add_argument(
+        "-t",
+        dest="duration",
+        default=1800,
+        type=float,
+        help="Simulated duration, in seconds. Default: 1800",
+    )
+    parser.add_argument(
+        "-s",
+        dest="session_duration",
+        default=60,
+        type=float,
+        help="Duration of a monitoring session, in seconds. Default: 60",
+    )
+    parser.add_argument(
+        "-d",
+        dest="channel_dur",
+        default=None,
+        type=float,
+        help="CHANNEL_DUR, also that of the recording. Default: from config",
+    )
+    parser.add_argument(
+        "-m",
+        dest="min_share",
+        default=None,
+        type=float,
+        help="MIN_SHARE of the adaptive scheduler. Default: from config",
+    )
+    parser.add_argument(
+        "-w",
+        dest="switch_cost",
+        default=0.05,
+        type=float,
+        help="Seconds lost at each channel switch. Default: 0.05",
+    )
+    parser.add_argument(
+        "-n",
+        dest="num_devices",
+        default=3000,
+        type=int,
+        help="Devices in the synthetic model. Default: 3000",
+    )
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    HOP_CONFIG = config["channel_hop"]
+    if args.channel_dur is not None:
+        HOP_CONFIG["CHANNEL_DUR"] = str(args.channel_dur)
+    if args.min_share is not None:
+        HOP_CONFIG["MIN_SHARE"] = str(args.min_share)
+
+    if args.recorded is not None:
+        streams = recorded_streams(
+            args.recorded, float(HOP_CONFIG["CHANNEL_DUR"])
+        )
+    else:
+        streams = synthetic_streams(args.duration, args.num_devices)
+    channels = sorted(streams)
+    for name, adaptive in (("fixed", False), ("adaptive", True)):
+        scheduler = HopScheduler("sim", channels, HOP_CONFIG)
+        per_min, overall, shares = simulate(
+            streams,
+            scheduler,
+            adaptive,
+            args.duration,
+            args.session_duration,
+            args.switch_cost,
+        )
+        print(
+            f"{name:>9}: {per_min:8.1f} unique MACs/min, {overall:,} overall"
+        )
+        print(
+            " " * 11
+            + "time share "
+            + " ".join(f"{c}:{s:.0%}" for c, s in shares.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
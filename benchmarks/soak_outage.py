@@ -0,0 +1,177 @@
+"""
+Soak test of the bounded data queue: simulate a long outage at a high probe
+rate, then the link recovering. A collector process pushes one session every
+SESS_DUR simulated seconds with push_session, as collect_data does, while the
+main process keeps ingesting from data_q but uploads nothing. Once the outage
+is over, the main process drains data_q and pages the overflow journal back
+in, as the orchestrator does. Reports peak memory of both processes, and
+checks that every row comes back exactly once and in order.
+
+Run with -w 0 to compare against an unbounded queue (needs a lot of RAM).
+
+Usage (from the repo root):
+    python -m benchmarks.soak_outage [-H 24] [-s 60] [-r 2000] [-w 100000]
+        [-d ./database/soak]
+"""
+import argparse
+import configparser
+import logging
+import os
+import shutil
+from multiprocessing import Process
+from time import perf_counter
+
+from aggregator import SessionAggregator
+from batch_queue import BatchQueue
+from benchmarks.synthetic import random_mac
+from collect_data import push_session
+from spill_journal import SpillJournal
+import random
+
+START_MS = 1571922000000
+
+
+def rss_mb() -> float:
+    """ Resident set size of the current process in MB """
+    with open("/proc/self/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def collector(
+    data_q, OVERFLOW_CONFIG, num_sessions, sess_dur, rows_per_session
+):
+    rng = random.Random(0)
+    macs = [random_mac(rng) for _ in range(rows_per_session)]
+    overflow = None
+    if data_q.high_water:
+        overflow = SpillJournal(OVERFLOW_CONFIG, mode="a")
+    peak_rss = 0.0
+    for session in range(num_sessions):
+        data_chunk = SessionAggregator()
+        capture_time = START_MS + session * sess_dur * 1000
+        for i, mac in enumerate(macs):
+            data_chunk.add(
+                i % 11 + 1, mac, -rng.randrange(20, 95), capture_time
+            )
+        push_session(data_chunk, data_q, None, overflow)
+        peak_rss = max(peak_rss, rss_mb())
+    print(f"collector: peak RSS {peak_rss:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-H",
+        dest="hours",
+        default=24,
+        type=float,
+        help="Duration of the outage in hours. Default: 24",
+    )
+    parser.add_argument(
+        "-s",
+        dest="sess_dur",
+        default=60,
+        type=int,
+        help="Duration of a session in seconds. Default: 60",
+    )
+    parser.add_argument(
+        "-r",
+        dest="rows_per_session",
+        default=2000,
+        type=int,
+        help="Number of rows (device, channel pairs) per session. "
+        "Default: 2000",
+    )
+    parser.add_argument(
+        "-w",
+        dest="high_water",
+        default=None,
+        type=int,
+        help="HIGH_WATER_ROWS, 0 for unbounded. Default: from app_config.ini",
+    )
+    parser.add_argument(
+        "-d",
+        dest="soak_dir",
+        default="./database/soak",
+        type=str,
+        help="Directory holding the overflow journal. "
+        "Default: ./database/soak",
+    )
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    config = configparser.ConfigParser()
+    config.read("app_config.ini")
+    OVERFLOW_CONFIG = config["overflow"]
+    OVERFLOW_CONFIG["JOURNAL_DIR"] = args.soak_dir
+    if args.high_water is not None:
+        OVERFLOW_CONFIG["HIGH_WATER_ROWS"] = str(args.high_water)
+    high_water = int(OVERFLOW_CONFIG["HIGH_WATER_ROWS"])
+    low_water = int(OVERFLOW_CONFIG["LOW_WATER_ROWS"])
+    page_rows = int(OVERFLOW_CONFIG["PAGE_ROWS"])
+    num_sessions = int(args.hours * 3600 / args.sess_dur)
+    total_rows = num_sessions * args.rows_per_session
+    print(
+        f"{num_sessions} sessions, {total_rows:,} rows, "
+        f"HIGH_WATER_ROWS {high_water or 'unbounded'}"
+    )
+
+    data_q = BatchQueue(high_water)
+    os.makedirs(args.soak_dir, exist_ok=True)
+    try:
+        reader = SpillJournal(OVERFLOW_CONFIG, mode="r")
+        proc = Process(
+            target=collector,
+            args=(
+                data_q,
+                OVERFLOW_CONFIG,
+                num_sessions,
+                args.sess_dur,
+                args.rows_per_session,
+            ),
+        )
+        start = perf_counter()
+        proc.start()
+        # outage: ingest, but upload nothing
+        peak_rss, peak_rows = 0.0, 0
+        while proc.is_alive() or not data_q._q.empty():
+            data_q.append(data_q.wait_batch(0.1))
+            peak_rss = max(peak_rss, rss_mb())
+            peak_rows = max(peak_rows, len(data_q))
+        proc.join()
+        outage_elapsed = perf_counter() - start
+        print(
+            f"outage: {outage_elapsed:.1f}s, main peak RSS {peak_rss:.1f} MB, "
+            f"peak rows in memory {peak_rows:,}, "
+            f"rows in overflow journal {data_q.overflow_rows():,}"
+        )
+
+        # link recovers: upload everything, oldest first
+        start = perf_counter()
+        received, last_time = 0, START_MS
+        while True:
+            if len(data_q) < low_water and data_q.overflow_rows() > 0:
+                data_q.page_in(reader.fetch_rows_all_col(page_rows))
+            rows = data_q.get_rows(500)
+            if not rows:
+                break
+            for row in rows:
+                assert row[3] >= last_time, "rows out of order"
+                last_time = row[3]
+            received += len(rows)
+            peak_rss = max(peak_rss, rss_mb())
+        drain_elapsed = perf_counter() - start
+        assert received == total_rows, (received, total_rows)
+        print(
+            f"recovery: {received / drain_elapsed:,.0f} rows/sec, "
+            f"main peak RSS {peak_rss:.1f} MB, all {received:,} rows in order"
+        )
+    finally:
+        shutil.rmtree(args.soak_dir)
+
+
+if __name__ == "__main__":
+    main()
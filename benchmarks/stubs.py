@@ -0,0 +1,124 @@
+import socket
+import threading
+from time import time
+from typing import List
+
+from payload_encoding import decode_payload
+
+
+class StubMQTTClient:
+    """
+    In-process stand-in for AWSIoTMQTTClient. A publish is acknowledged
+    after {ack_latency} seconds, unless the link goes down in the meantime,
+    in which case the acknowledgement is lost. While the link is down,
+    connecting fails. A publish while disconnected is queued, as by the SDK,
+    and returns "QUEUED" without an acknowledgement; the queue is sent on
+    reconnecting. With `configureOfflinePublishQueueing(0)`, the publish
+    raises instead. Acknowledged payloads are decoded to measure the latency
+    from capture to acknowledgement of each row.
+    """
+
+    def __init__(self, ack_latency: float = 0.05):
+        self.ack_latency = ack_latency
+        self.onOnline = None
+        self.onOffline = None
+        self.link_up = True
+        self.connected = False
+        self.offline_queue_size = -1  # unlimited, as the SDK's default
+        self.offline_queue: List[bytes] = []
+        self.lock = threading.Lock()
+        self.mid = 0
+        self.acked_rows = 0
+        self.acked_bytes = 0
+        self.latencies: List[float] = []  # seconds, one per acknowledged row
+
+    def __getattr__(self, name):
+        # configureEndpoint, configureCredentials, ...
+        if name.startswith("configure"):
+            return lambda *args, **kwargs: None
+        raise AttributeError(name)
+
+    def configureOfflinePublishQueueing(
+        self, queueSize: int, dropBehavior: int = 1
+    ) -> None:
+        self.offline_queue_size = queueSize
+
+    def set_link(self, up: bool) -> None:
+        """ Bring the link up or down. Going down drops the connection """
+        self.link_up = up
+        if not up and self.connected:
+            self.connected = False
+            self.onOffline()
+
+    def connect(self) -> bool:
+        if not self.link_up:
+            raise Exception("connect timed out")
+        self.connected = True
+        # the SDK sends its offline queue on reconnecting, without callbacks
+        queued, self.offline_queue = self.offline_queue, []
+        for payload in queued:
+            self.record(payload)
+        self.onOnline()
+        return True
+
+    def disconnect(self) -> bool:
+        if self.connected:
+            self.connected = False
+            self.onOffline()
+        return True
+
+    def publishAsync(self, topic, payload, qos, ackCallback=None) -> int:
+        if not self.connected:
+            if self.offline_queue_size == 0:
+                raise Exception("offline publish queue disabled")
+            self.offline_queue.append(payload)
+            return "QUEUED"
+        with self.lock:
+            self.mid += 1
+            mid = self.mid
+        timer = threading.Timer(
+            self.ack_latency, self.ack, args=(mid, payload, ackCallback)
+        )
+        timer.daemon = True
+        timer.start()
+        return mid
+
+    def ack(self, mid, payload, ackCallback) -> None:
+        if not self.connected:  # lost with the connection
+            return
+        self.record(payload)
+        if ackCallback is not None:
+            ackCallback(mid)
+
+    def record(self, payload) -> None:
+        now = time()
+        _, rows = decode_payload(payload)
+        with self.lock:
+            self.acked_rows += len(rows)
+            self.acked_bytes += len(payload)
+            self.latencies.extend(now - r[3] / 1000 for r in rows)
+
+
+class ProbeStub:
+    """
+    Local TCP listener standing in for the connectivity probe target.
+    Connections to `port` are accepted and closed right away, connections to
+    `dead_port` are refused. Point the probe at the latter to simulate a
+    network outage. Listening is never stopped and started again, because
+    forked child processes share the listening socket.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.dead_sock = socket.socket()  # bound, but not listening
+        self.dead_sock.bind(("127.0.0.1", 0))
+        self.dead_port = self.dead_sock.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self) -> None:
+        while True:
+            conn, _ = self.sock.accept()
+            conn.close()
@@ -0,0 +1,136 @@
+import random
+import struct
+from datetime import datetime, timedelta
+from typing import List
+
+
+LINE_TEMPLATE = (
+    "{time} 1.0 Mb/s 2412 MHz 11b {rssi}dBm signal antenna 1 "
+    "BSSID:Broadcast DA:Broadcast SA:{mac} (oui Unknown) "
+    "Probe Request () [1.0* 2.0* 5.5* 11.0* Mbit]\n"
+)
+
+
+def random_mac(rng: random.Random) -> str:
+    """ Produce a random lower-case colon separated MAC address """
+    return ":".join(f"{rng.randrange(256):02x}" for _ in range(6))
+
+
+def make_tcpdump_lines(
+    num_lines: int,
+    num_devices: int = 500,
+    lines_per_channel: int = 200,
+    seed: int = 0,
+) -> List[bytes]:
+    """
+    Generate lines mimicking the output of sniff-probes.sh, i.e. tcpdump probe
+    request lines interleaved with channel switch lines.
+
+    Args:
+        num_lines:          Number of probe request lines to generate.
+        num_devices:        Number of distinct MAC addresses to draw from.
+        lines_per_channel:  Number of probe lines between two channel switches.
+        seed:               Seed for the random generator.
+    Returns:
+        A list of raw lines, each terminated by a newline.
+    Raises:
+        None
+    """
+    rng = random.Random(seed)
+    macs = [random_mac(rng) for _ in range(num_devices)]
+    now = datetime(2019, 10, 24, 13, 0, 0)
+    lines: List[bytes] = []
+    channel = 1
+    for i in range(num_lines):
+        if i % lines_per_channel == 0:
+            channel = channel % 11 + 1
+            lines.append(f"{channel}\n".encode("ascii"))
+        now += timedelta(microseconds=rng.randrange(1000, 5000))
+        lines.append(
+            LINE_TEMPLATE.format(
+                time=now.strftime("%Y-%m-%d %H:%M:%S.%f"),
+                rssi=-rng.randrange(20, 95),
+                mac=rng.choice(macs),
+            ).encode("ascii")
+        )
+    return lines
+
+
+# radiotap header as written by common monitor mode drivers: TSFT, flags,
+# rate, channel, dBm antenna signal, antenna and RX flags.
+RADIOTAP_PRESENT = 0x0000482F
+RADIOTAP_HEADER = struct.Struct("<BBHIQBBHHbBH")
+
+
+def channel_to_frequency(channel: int) -> int:
+    if channel == 14:
+        return 2484
+    if channel < 14:
+        return 2407 + 5 * channel
+    return 5000 + 5 * channel
+
+
+def make_pcap(
+    num_frames: int,
+    num_devices: int = 500,
+    frames_per_channel: int = 200,
+    seed: int = 0,
+) -> bytes:
+    """
+    Generate the pcap output of `sniff-probes.sh --pcap`, i.e. probe requests
+    with radiotap headers, drawn like the lines of `make_tcpdump_lines`.
+
+    Args:
+        num_frames:         Number of probe requests to generate.
+        num_devices:        Number of distinct MAC addresses to draw from.
+        frames_per_channel: Number of frames received on a channel before
+                            moving to the next one.
+        seed:               Seed for the random generator.
+    Returns:
+        The content of a pcap file, global header included.
+    Raises:
+        None
+    """
+    rng = random.Random(seed)
+    macs = [
+        bytes(rng.randrange(256) for _ in range(6)) for _ in range(num_devices)
+    ]
+    now = datetime(2019, 10, 24, 13, 0, 0).timestamp()
+    out = [struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 256, 127)]
+    channel = 1
+    # probe request to broadcast, then SSID, supported rates and FCS
+    body = b"\x00\x00\x01\x04\x02\x04\x0b\x16" + bytes(4)
+    for i in range(num_frames):
+        if i % frames_per_channel == 0:
+            channel = channel % 11 + 1
+        now += rng.randrange(1000, 5000) / 1e6
+        radiotap = RADIOTAP_HEADER.pack(
+            0,
+            0,
+            RADIOTAP_HEADER.size,
+            RADIOTAP_PRESENT,
+            rng.getrandbits(64),
+            0x10,  # frame includes FCS
+            2,
+            channel_to_frequency(channel),
+            0x00A0,
+            -rng.randrange(20, 95),
+            1,
+            0,
+        )
+        header = (
+            b"\x40\x00\x00\x00"
+            + b"\xff" * 6
+            + rng.choice(macs)
+            + b"\xff" * 6
+            + b"\x00\x00"
+        )
+        frame = radiotap + header + body
+        sec = int(now)
+        out.append(
+            struct.pack(
+                "<IIII", sec, int((now - sec) * 1e6), len(frame), len(frame)
+            )
+        )
+        out.append(frame)
+    return b"".join(out)
@@ -0,0 +1,121 @@
+import os
+import pickle
+from time import monotonic, time
+from aggregator import TumblingWindows
+from log_setup import get_logger
+
+
+logger = get_logger("collect_data")
+
+
+class WindowCheckpoint:
+    """
+    Save the open sessions of a data collection process to a file every
+    CHECKPOINT_INTERVAL seconds, and after each push, such that a data
+    collection process restarted after a crash resumes them instead of
+    losing them. 0 turns checkpoints off.
+
+    A checkpoint is taken after the sessions closed are pushed, so a crash
+    in between pushes them again when resumed, rather than losing them. What
+    is captured after the last checkpoint is lost in a crash. The file is
+    replaced atomically but not fsynced: it survives the process, not the
+    device losing power.
+
+    The yield estimates of a HopScheduler are saved next to it after each
+    session, and kept once data collection ends, such that a restarted
+    process does not hop from untrained weights.
+    """
+
+    def __init__(self, COLLECT_CONFIG, name: str):
+        self.INTERVAL = float(COLLECT_CONFIG["CHECKPOINT_INTERVAL"])
+        self.CHECKPOINT_DIR = COLLECT_CONFIG["CHECKPOINT_DIR"]
+        self.path = os.path.join(self.CHECKPOINT_DIR, f"{name}.pkl")
+        self.weights_path = os.path.join(
+            self.CHECKPOINT_DIR, f"{name}.hop.pkl"
+        )
+        self.saved_at = monotonic()
+
+    def restore(self, windows: TumblingWindows) -> None:
+        """ Resume the sessions of the last checkpoint, if any, in windows """
+        if not self.INTERVAL:
+            return
+        state = self.read(self.path)
+        if state is None:
+            return
+        if windows.restore(state, time()):
+            logger.info(
+                f"Resumed {len(state['windows'])} sessions, {len(windows)} "
+                f"rows, from checkpoint {self.path}"
+            )
+        else:
+            logger.warning(
+                f"Checkpoint {self.path} has another session duration. Skip."
+            )
+
+    def save(self, windows: TumblingWindows, force: bool = False) -> None:
+        """
+        Save the open sessions of windows, if CHECKPOINT_INTERVAL has passed
+        since the last checkpoint or if forced. Without open sessions, the
+        checkpoint is dropped instead.
+        """
+        if not self.INTERVAL:
+            return
+        now = monotonic()
+        if not force and now - self.saved_at < self.INTERVAL:
+            return
+        self.saved_at = now
+        if not windows.windows:
+            self.clear()
+            return
+        self.write(self.path, windows.snapshot())
+
+    def restore_weights(self, scheduler) -> None:
+        """ Resume the yield estimates of the last process in scheduler """
+        if not self.INTERVAL:
+            return
+        yields = self.read(self.weights_path)
+        if yields:
+            scheduler.restore(yields)
+            logger.info(
+                f"Resumed hop weights of {len(yields)} channels from "
+                f"{self.weights_path}"
+            )
+
+    def save_weights(self, scheduler) -> None:
+        """ Save the yield estimates of scheduler, after a session """
+        if not self.INTERVAL:
+            return
+        self.write(self.weights_path, scheduler.weights())
+
+    def read(self, path: str):
+        """ The state saved in path, None if missing or unreadable """
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            logger.exception(f"Error! Cannot read checkpoint {path}.")
+            return None
+
+    def write(self, path: str, state) -> None:
+        """ Replace the state saved in path atomically """
+        tmp = f"{path}.tmp"
+        try:
+            os.makedirs(self.CHECKPOINT_DIR, exist_ok=True)
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except (OSError, pickle.PicklingError):
+            logger.exception(f"Error! Cannot write checkpoint {path}.")
+
+    def clear(self) -> None:
+        """ Drop the checkpoint once all sessions are pushed """
+        if not self.INTERVAL:
+            return
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.exception(f"Error! Cannot remove checkpoint {self.path}.")
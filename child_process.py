@@ -1,28 +1,27 @@
-import logging
-import logging.config
-import yaml
+from log_setup import get_logger
+import os
+import signal
 import sys
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, TimeoutExpired
 from multiprocessing import Process
 from time import sleep
 
 
-# set up logger
-with open("logger_config.yaml", "r") as f:
-    config = yaml.safe_load(f.read())
-    logging.config.dictConfig(config)
-logger = logging.getLogger("child_process")
+logger = get_logger("child_process")
 
 
-def start_command(CMD: str, name: str, HEALTH_CHECK_CONFIG):
+def start_command(CMD: str, name: str, HEALTH_CHECK_CONFIG, bufsize: int = 1):
     """
     Run a command in a child process, and pipe its stdout through Popen's PIPE,
-    such that the output can be picked up elsewhere in the program
+    such that the output can be picked up elsewhere in the program. The command
+    runs in a session of its own, so that `kill_cmd` can kill whatever it
+    starts along with it, e.g. sniff-probes.sh and tcpdump behind `sh -c`.
 
     Args:
         CMD:                    Command to be run.
         name:                   Name of the child process
         HEALTH_CHECK_CONFIG:    Config for TOTAL_RETRIES and RETRY_INTERVAL
+        bufsize:                Buffer size of the stdout pipe, see `Popen`.
     Return:
         An object generated from `Popen`, running the command
     Raises:
@@ -33,7 +32,13 @@ def start_command(CMD: str, name: str, HEALTH_CHECK_CONFIG):
     RETRY_INTERVAL = int(HEALTH_CHECK_CONFIG["RETRY_INTERVAL"])
     while retries <= TOTAL_RETRIES:
         try:
-            cmd_process = Popen(CMD, shell=True, stdout=PIPE, bufsize=1)
+            cmd_process = Popen(
+                CMD,
+                shell=True,
+                stdout=PIPE,
+                bufsize=bufsize,
+                start_new_session=True,
+            )
             logger.info(f"{name} process successfully created!")
             return cmd_process
         except Exception:
@@ -79,16 +84,20 @@ def start_child(func, name: str, HEALTH_CHECK_CONFIG, *args):
     sys.exit(1)
 
 
-def kill_child(process, name: str, msg_q):
+def kill_child(process, name: str, msg_q, timeout: float = 10):
     """
     Utility function to kill a child process spun up from a python function.
     Specifically, a "Kill Imminent" signal is sent to the child process, such
-    that it can finish up its job first before being killed.
+    that it can finish up its job first before being killed. The process
+    itself is joined rather than msg_q, which would block forever if the
+    process ended without taking the signal.
 
     Args:
         process:        A child process spun up from a python function.
         name:           Name of the process.
         msg_q:          A JoinableQueue to warn the process of imminent kill.
+        timeout:        Max seconds given to the process to finish up, after
+                        which it is terminated.
     Returns:
         None
     Raises:
@@ -96,25 +105,37 @@ def kill_child(process, name: str, msg_q):
     """
     if process.is_alive():
         msg_q.put("Kill Imminent")
-        msg_q.join()  # block until col_data_proc finishes handling the remaining data
-        process.terminate()
-        process.join()
+        process.join(timeout)  # col_data_proc pushes its open sessions
+        if process.is_alive():
+            process.terminate()
+            process.join()
     logger.info(f"Child process {name} has been terminated")
 
 
-def kill_cmd(process, name: str):
+def kill_cmd(process, name: str, timeout: float = 10):
     """
-    Utility function to kill a child process spun up from a bash command.
+    Utility function to kill a child process spun up from a bash command, see
+    `start_command`. Its whole process group is sent SIGTERM, such that the
+    processes it started end as well and can clean up, e.g. the trap of
+    sniff-probes.sh, then SIGKILL if the command is still running after
+    `timeout` seconds.
 
     Args:
         process:        A child process spun up from a bash command.
         name:           Name of the process
+        timeout:        Max seconds given to the process to end on SIGTERM.
     Returns:
         None
     Raises:
         None
     """
     if process.poll() is None:
-        process.kill()
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout)
+        except ProcessLookupError:  # ended meanwhile
+            pass
+        except TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
         process.wait()
     logger.info(f"Child process {name} has been killed")
@@ -1,78 +1,311 @@
-from collections import defaultdict
 from time import time
-import re
-from utility import make_data_chunk, make_db_insertable_data
-import logging
-import logging.config
-import yaml
+from aggregator import TumblingWindows
+from checkpoint import WindowCheckpoint
+from delta_filter import DeltaFilter
+from line_reader import make_line_reader
+from mac_hash import MacHasher
+import metrics
+from pcap_parser import iter_pcap_records, parse_radiotap_probe
+from probe_parser import parse_channel, parse_probe
+from spill_journal import SpillJournal
+from log_setup import get_logger
 
 
-# set up logger
-with open("logger_config.yaml", "r") as f:
-    config = yaml.safe_load(f.read())
-    logging.config.dictConfig(config)
-logger = logging.getLogger("collect_data")
+logger = get_logger("collect_data")
 
 
-def collect_data(probe_proc, data_q, msg_q, sess_dur):
+def push_session(
+    data_chunk, data_q, hasher, overflow=None, scheduler=None, delta=None
+) -> None:
+    """
+    Turn the data collected in a session into rows and push them to data_q,
+    or to the overflow journal if data_q holds too many rows already.
+
+    Args:
+        data_chunk: A SessionAggregator holding the data of the session.
+        data_q:     A BatchQueue to which the rows are pushed as one batch.
+        hasher:     A MacHasher to hash MAC addresses with, or None to push
+                    MAC addresses as they are.
+        overflow:   A SpillJournal opened in append mode, or None if data_q is
+                    unbounded.
+        scheduler:  A HopScheduler to reweight with the distinct MAC addresses
+                    seen on each channel in the session, or None.
+        delta:      A DeltaFilter dropping the rows of devices reported
+                    recently and not moved since, or None to push all rows.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    if scheduler is not None:
+        scheduler.reweight({c: len(d) for c, d in data_chunk.channels.items()})
+    rows = data_chunk.make_rows(True)
+    if delta is not None:
+        num_rows = len(rows)
+        rows = delta.filter_rows(rows)
+        metrics.counter(
+            "collect_delta_suppressed_rows_total",
+            "Rows of devices already reported, not pushed in delta mode",
+        ).inc(num_rows - len(rows))
+        if not rows:
+            return
+    if hasher is not None:
+        rows = hasher.hash_rows(rows)
+        logger.debug(f"MAC hash cache hit rate: {hasher.hit_rate():.2%}")
+    metrics.histogram(
+        "collect_session_rows", "Rows per session", metrics.SIZE_BUCKETS
+    ).observe(len(rows))
+    if overflow is not None and data_q.should_overflow():
+        # counted before they are written, as they can be paged in as soon as
+        # they are in the journal
+        data_q.add_overflow(len(rows))
+        if overflow.store_rows(rows):
+            metrics.counter(
+                "collect_overflow_rows_total",
+                "Rows written to the overflow journal",
+            ).inc(len(rows))
+            return
+        data_q.add_overflow(-len(rows))
+        logger.error("Cannot write to overflow journal. Push to data_q.")
+    data_q.put_batch(rows)
+
+
+def add_lines(
+    lines, data_chunk, curr_channel, mac_as_int, parse_failures, scheduler
+):
+    """
+    Add the probe requests of a batch of tcpdump lines to data_chunk. Each
+    probe request is captured on the channel of the last channel line, or,
+    with a scheduler, on the channel the radio was on at its capture time.
+
+    Args:
+        lines:          A batch of lines output by sniff-probes.sh.
+        data_chunk:     A TumblingWindows (or SessionAggregator) collecting
+                        probe requests.
+        curr_channel:   The channel of the last channel line read, or None
+                        if none is read yet, e.g. when taking over a capture
+                        midway. Probe requests are skipped until there is one.
+        mac_as_int:     Produce MAC addresses as 48-bit ints instead of str.
+        parse_failures: A Counter of lines that cannot be parsed.
+        scheduler:      A HopScheduler switching channels, or None.
+    Returns:
+        The channel of the last channel line read, or None.
+    Raises:
+        None
+    """
+    for line in lines:
+        channel = parse_channel(line)
+        if channel is not None:  # switch to a new channel
+            curr_channel = channel
+            continue
+        # parse the output. Note that there is no more data parsing in sniff-probes
+        probe = parse_probe(line, mac_as_int)
+        if probe is None:
+            logger.warning(f"Unable to parse line: {line!r}")
+            parse_failures.inc()
+            continue
+        if scheduler is not None:  # no channel lines
+            data_chunk.add(
+                scheduler.channel_at(probe[0]), probe[2], probe[1], probe[0]
+            )
+        elif curr_channel is not None:
+            data_chunk.add(curr_channel, probe[2], probe[1], probe[0])
+    return curr_channel
+
+
+def add_pcap_records(records, data_chunk, mac_as_int, parse_failures):
+    """
+    Add the probe requests of a batch of pcap records to data_chunk. Each
+    frame carries the frequency, hence the channel, it is received on.
+
+    Args:
+        records:        A batch of (captureTime, frame) tuples yielded by
+                        `iter_pcap_records`.
+        data_chunk:     A TumblingWindows (or SessionAggregator) collecting
+                        probe requests.
+        mac_as_int:     Produce MAC addresses as 48-bit ints instead of str.
+        parse_failures: A Counter of frames that cannot be parsed.
+    Returns:
+        None
+    Raises:
+        None
+    """
+    for capture_time, frame in records:
+        probe = parse_radiotap_probe(frame, mac_as_int)
+        if probe is None:
+            logger.warning(f"Unable to parse frame: {frame!r}")
+            parse_failures.inc()
+        else:
+            data_chunk.add(probe[0], probe[2], probe[1], capture_time)
+
+
+def make_reader(stream, COLLECT_CONFIG):
+    """
+    Create a reader of the output of sniff-probes.sh, yielding batches of
+    lines, or of (captureTime, frame) records in "pcap" mode.
+    """
+    if COLLECT_CONFIG["READ_MODE"] == "pcap":
+        return iter_pcap_records(
+            stream,
+            int(COLLECT_CONFIG["BLOCK_SIZE"]),
+            float(COLLECT_CONFIG["IDLE_TICK"]),
+        )
+    return make_line_reader(stream, COLLECT_CONFIG)
+
+
+def make_row_filters(COLLECT_CONFIG):
+    """
+    Create the MacHasher (HASH_MAC) and the DeltaFilter (DELTA_MODE) applied
+    to the rows of each session, None for those turned off.
+    """
+    hasher = None
+    if COLLECT_CONFIG.getboolean("HASH_MAC"):
+        hasher = MacHasher(int(COLLECT_CONFIG["HASH_CACHE_SIZE"]))
+    delta = None
+    if COLLECT_CONFIG.getboolean("DELTA_MODE"):
+        delta = DeltaFilter(COLLECT_CONFIG)
+    return hasher, delta
+
+
+def collect_data(
+    probe_proc,
+    data_q,
+    msg_q,
+    sess_dur,
+    COLLECT_CONFIG,
+    OVERFLOW_CONFIG=None,
+    METRICS_CONFIG=None,
+    METRICS_NAME="collect_data",
+    scheduler=None,
+):
     """
     Collect data (done in a separate process) provided by sniff-probes.sh
-    and push each data_chunk to the main process every sess_dur seconds
+    into sessions of sess_dur seconds of capture time, and push each session
+    to the main process once the watermark passes its end. The output of
+    sniff-probes.sh is waited for at most IDLE_TICK seconds at a time, so
+    that sessions are pushed and msg_q is read even when no data arrives.
+    Open sessions are checkpointed, see WindowCheckpoint, and resumed by the
+    next data collection process if this one fails.
 
     Args:
-        probe_proc: A subprocess running `sniff-probes.sh` that pipes out its output.
-        q:          A queue for communication between the child running this function
-                    and its parent.
-        sess_dur:   Duration of a monitoring session before the data chunk
-                    currently collected is pushed to q.
+        probe_proc:     A subprocess running `sniff-probes.sh` that pipes out its output.
+        data_q:         A BatchQueue to send session data from the child
+                        running this function to its parent.
+        msg_q:          A JoinableQueue for communication between the child
+                        running this function and its parent.
+        sess_dur:       Duration of a monitoring session, i.e. the size of a
+                        tumbling window of capture time.
+        COLLECT_CONFIG: Config for how the output of probe_proc is read and
+                        parsed.
+        OVERFLOW_CONFIG: Config of the overflow journal receiving sessions
+                        while data_q is above its high water mark. None if
+                        data_q is unbounded.
+        METRICS_CONFIG: Config of metrics, flushed to {METRICS_NAME} files.
+                        None to not flush metrics.
+        METRICS_NAME:   Name of the collector, naming its metrics files and
+                        its checkpoint of open sessions.
+        scheduler:      A HopScheduler to switch channels with, and reweight
+                        after each session. None if sniff-probes.sh hops.
     Returns:
         None
     Raises:
         None
     """
-    data_chunk = defaultdict(dict)
+    windows = TumblingWindows(
+        int(sess_dur * 1000),
+        int(float(COLLECT_CONFIG["ALLOWED_LATENESS"]) * 1000),
+    )
+    mac_as_int = COLLECT_CONFIG.getboolean("MAC_AS_INT")
+    hasher, delta = make_row_filters(COLLECT_CONFIG)
+    overflow = None
+    if OVERFLOW_CONFIG is not None and data_q.high_water:
+        overflow = SpillJournal(OVERFLOW_CONFIG, mode="a")
+    flusher = None
+    if METRICS_CONFIG is not None:
+        flusher = metrics.start_flusher(METRICS_CONFIG, METRICS_NAME)
+    lines_total = metrics.counter(
+        "collect_lines_total", "Lines or pcap records read from sniff-probes"
+    )
+    parse_failures = metrics.counter(
+        "collect_parse_failures_total", "Lines that cannot be parsed"
+    )
+    lines_per_sec = metrics.gauge(
+        "collect_lines_per_second", "Lines read per second, last session"
+    )
+    metrics.gauge(
+        "collect_late_probes",
+        "Probe requests arriving after their session is pushed",
+        lambda: windows.late,
+    )
+    checkpoint = WindowCheckpoint(COLLECT_CONFIG, METRICS_NAME)
+    checkpoint.restore(windows)
+    if scheduler is not None:
+        checkpoint.restore_weights(scheduler)
+        scheduler.start()
+    session_lines = 0
     start_time = time()
+    curr_channel = None
+    lines = []
 
-    # read output from sniff-probes line by line. See SO discussion below for details
+    # read output from sniff-probes in batches of lines. In "line" mode, each
+    # batch is a single line. See SO discussion below for details
     # https://stackoverflow.com/questions/803265/getting-realtime-output-using-subprocess
+    # In "pcap" mode, each batch holds (captureTime, frame) records instead,
+    # and each frame carries its own channel.
+    pcap_mode = COLLECT_CONFIG["READ_MODE"] == "pcap"
     try:
-        for line in iter(probe_proc.stdout.readline, b""):
-            decoded_line = line.decode("utf-8").strip()
-            if decoded_line.isnumeric():  # switch to a new channel
-                curr_channel = int(decoded_line)
+        for lines in make_reader(probe_proc.stdout, COLLECT_CONFIG):
+            if pcap_mode:
+                add_pcap_records(lines, windows, mac_as_int, parse_failures)
             else:
-                # parse the output. Note that there is no more data parsing in sniff-probes
-                m = re.match(
-                    r"(\d{4}-\d{2}-\d{2}\s\d{2}\:\d{2}\:\d{2}\.\d{3}).+(-\d+)dBm.+SA((\:[0-9a-f]{2}){6})",
-                    decoded_line,
-                )
-                make_data_chunk(
-                    data_chunk,
+                curr_channel = add_lines(
+                    lines,
+                    windows,
                     curr_channel,
-                    m.group(3)[1:],
-                    int(m.group(2)),
-                    m.group(1),
+                    mac_as_int,
+                    parse_failures,
+                    scheduler,
                 )
-            # every sess_dur time, we process data_chunk and push the processed
-            # data to q.
-            if time() - start_time >= sess_dur:
+            lines_total.inc(len(lines))
+            session_lines += len(lines)
+            # push the sessions the watermark has passed. The reader yields
+            # empty batches while idle, so this happens without new data.
+            closed = windows.pop_closed(time())
+            if closed:
+                lines_per_sec.set(session_lines / (time() - start_time))
+                session_lines = 0
                 start_time = time()
-                for row in make_db_insertable_data(data_chunk, True):
-                    data_q.put(row)
-                data_chunk.clear()
+            for data_chunk in closed:
+                push_session(
+                    data_chunk, data_q, hasher, overflow, scheduler, delta
+                )
+            checkpoint.save(windows, force=bool(closed))
+            if closed and scheduler is not None:
+                checkpoint.save_weights(scheduler)
             # This is for the special situation where probe_proc is to be killed
             # while everything else is running fine. We will send out the last
             # chunk of data before killing col_data_proc.
             if not msg_q.empty() and msg_q.get() == "Kill Imminent":
-                if len(data_chunk):
-                    for row in make_db_insertable_data(data_chunk, True):
-                        data_q.put(row)
+                for data_chunk in windows.pop_all():
+                    push_session(
+                        data_chunk, data_q, hasher, overflow, delta=delta
+                    )
+                checkpoint.clear()
                 msg_q.task_done()  # signal to main process that collect_data can be killed
                 break
+        else:  # probe_proc is gone. Send out the last chunk of data.
+            for data_chunk in windows.pop_all():
+                push_session(data_chunk, data_q, hasher, overflow, delta=delta)
+            checkpoint.clear()
     except Exception:
-        logger.info(f"current line read from probe_proc: {decoded_line}")
+        logger.info(f"current batch read from probe_proc: {lines[:10]!r}")
         logger.exception(
             "Error! Unable to read output from probing process. Data collection failed."
         )
-        msg_q.put("fail")  # notify parent process
-        msg_q.join()
+        # the data collection process taking over resumes the open sessions
+        checkpoint.save(windows, force=True)
+        msg_q.put("fail")  # notify parent process, then exit
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        metrics.stop_flusher(flusher)  # last metrics of this process
@@ -0,0 +1,108 @@
+import socket
+from threading import Event, Thread
+from time import monotonic
+from typing import Callable, Optional
+from log_setup import get_logger
+
+
+logger = get_logger("main")
+
+
+class ConnectivityMonitor:
+    """
+    Keep track of internet connectivity in a background thread, such that
+    readers of `online` never block.
+
+    While the MQTT client of the UploadService is online, the device is
+    online and nothing is probed. Otherwise, a TCP connection to
+    PROBE_HOST:PROBE_PORT is attempted. A successful probe is trusted for
+    PROBE_TTL seconds, unless the MQTT client goes offline in the meantime.
+    After a failed probe, the next one waits for a delay that doubles after
+    each failure, from CONNECTIVITY_INTERVAL up to PROBE_BACKOFF_MAX seconds.
+    """
+
+    def __init__(self, HEALTH_CHECK_CONFIG, us):
+        self.INTERVAL = float(HEALTH_CHECK_CONFIG["CONNECTIVITY_INTERVAL"])
+        self.PROBE_HOST = HEALTH_CHECK_CONFIG["PROBE_HOST"]
+        self.PROBE_PORT = int(HEALTH_CHECK_CONFIG["PROBE_PORT"])
+        self.PROBE_TIMEOUT = float(HEALTH_CHECK_CONFIG["PROBE_TIMEOUT"])
+        self.PROBE_TTL = float(HEALTH_CHECK_CONFIG["PROBE_TTL"])
+        self.PROBE_BACKOFF_MAX = float(
+            HEALTH_CHECK_CONFIG["PROBE_BACKOFF_MAX"]
+        )
+        self.us = us
+        self.online = False
+        # invoked from the monitor thread whenever `online` changes
+        self.on_change: Optional[Callable[[], None]] = None
+
+        self.probe_ok = False  # result of the last probe
+        self.next_probe = 0.0  # monotonic time the last result expires
+        self.backoff = self.INTERVAL
+        self.mqtt_online = False
+        self.wakeup = Event()
+        self.thread = Thread(target=self.run, name="Connectivity", daemon=True)
+
+    def start(self) -> None:
+        """ Start monitoring in the background """
+        self.thread.start()
+
+    def invalidate(self) -> None:
+        """
+        Drop the cached probe result and check again right away, e.g. when the
+        MQTT client goes offline
+        """
+        self.next_probe = 0.0
+        self.wakeup.set()
+
+    def probe(self) -> bool:
+        """ Whether a TCP connection to PROBE_HOST:PROBE_PORT can be made """
+        try:
+            with socket.create_connection(
+                (self.PROBE_HOST, self.PROBE_PORT), self.PROBE_TIMEOUT
+            ):
+                return True
+        except OSError:
+            return False
+
+    def check(self) -> bool:
+        """
+        Work out whether the device is online, probing only if the MQTT
+        client is offline and the last probe result has expired.
+
+        Returns:
+            True if the device is online, otherwise False.
+        Raises:
+            None
+        """
+        mqtt_online = self.us.online
+        if self.mqtt_online and not mqtt_online:
+            self.next_probe = 0.0  # MQTT connection just dropped
+        self.mqtt_online = mqtt_online
+        if mqtt_online:
+            return True
+        now = monotonic()
+        if now >= self.next_probe:
+            self.probe_ok = self.probe()
+            if self.probe_ok:
+                self.backoff = self.INTERVAL
+                self.next_probe = now + self.PROBE_TTL
+            else:
+                self.next_probe = now + self.backoff
+                logger.debug(
+                    f"Probe to {self.PROBE_HOST}:{self.PROBE_PORT} failed. "
+                    f"Next probe in {self.backoff:.0f} seconds"
+                )
+                self.backoff = min(self.backoff * 2, self.PROBE_BACKOFF_MAX)
+        return self.probe_ok
+
+    def run(self) -> None:
+        """ Check connectivity every CONNECTIVITY_INTERVAL seconds """
+        while True:
+            online = self.check()
+            if online != self.online:
+                self.online = online
+                logger.info(f"Device {'online' if online else 'offline'}")
+                if self.on_change is not None:
+                    self.on_change()
+            self.wakeup.wait(self.INTERVAL)
+            self.wakeup.clear()
@@ -1,29 +1,36 @@
 # Some code borrowed from https://www.sqlitetutorial.net/sqlite-python/
 import sqlite3
 from sqlite3 import Error
-import logging
-import logging.config
-import yaml
-from time import sleep
+from log_setup import get_logger
+from time import perf_counter, sleep
+import metrics
 from typing import Any, List, Tuple
 
 
-# set up logger
-with open("logger_config.yaml", "r") as f:
-    config = yaml.safe_load(f.read())
-    logging.config.dictConfig(config)
-logger = logging.getLogger("db")
+logger = get_logger("db")
 
 
 class SQLiteDB:
-    def __init__(self, DB_CONFIG, HEALTH_CHECK_CONFIG):
+    def __init__(self, DB_CONFIG, HEALTH_CHECK_CONFIG, mac_as_int=False):
         self.DB_LOC = DB_CONFIG["DB_LOC"]
         self.TABLE = DB_CONFIG["TABLE"]
         self.ROW_ID = DB_CONFIG["ROW_ID"]
         self.SCHEMA = DB_CONFIG["SCHEMA"]
+        self.INSERT_MODE = DB_CONFIG["INSERT_MODE"]
+        self.PRAGMAS = {
+            "journal_mode": DB_CONFIG["JOURNAL_MODE"],
+            "synchronous": DB_CONFIG["SYNCHRONOUS"],
+            "cache_size": DB_CONFIG["CACHE_SIZE"],
+        }
+        self.INSERT_SQL = f""" INSERT INTO {self.TABLE}({self.SCHEMA})
+                  VALUES({','.join(['?'] * len(self.SCHEMA.split(',')))}) """
         self.RETRY_INTERVAL = int(HEALTH_CHECK_CONFIG["RETRY_INTERVAL"])
         self.TOTAL_RETRIES = int(HEALTH_CHECK_CONFIG["TOTAL_RETRIES"])
+        # store macAddress as a 48-bit int instead of a string
+        self.mac_as_int = mac_as_int
         self.conn = None
+        # largest ROW_ID drained so far, see `drain_rows`
+        self.last_drained_id = 0
         self.initialize()
 
     def initialize(self) -> bool:
@@ -62,17 +69,24 @@ class SQLiteDB:
             logger.info("Database successfully connected.")
         except Error:
             logger.exception("Error! Cannot establish database connection.")
+            return
+        for pragma, value in self.PRAGMAS.items():
+            try:
+                self.conn.execute(f"PRAGMA {pragma} = {value}")
+            except Error:
+                logger.exception(f"Error! Cannot set PRAGMA {pragma}.")
 
     def create_table(self) -> bool:
         """ create a table
         :return: True if table creation succeeds, otherwise false
         """
+        mac_type = "INTEGER" if self.mac_as_int else "NVARCHAR(64)"
         CREATE_TABLE = f""" CREATE TABLE IF NOT EXISTS {self.TABLE} (
                                         probeId INTEGER PRIMARY KEY,
-                                        macAddress NVARCHAR(64),
+                                        macAddress {mac_type},
                                         isPhysical BOOLEAN,
                                         isWifi BOOLEAN,
-                                        captureTime DATETIME,
+                                        captureTime INTEGER,
                                         rssi INTEGER,
                                         channel INTEGER
                                     ); """
@@ -85,6 +99,17 @@ class SQLiteDB:
             logger.exception("Error! Cannot create table.")
             return False
 
+    def _load_mac(self, mac_address):
+        """
+        A table created before MAC_AS_INT was switched on has TEXT affinity on
+        macAddress, which turns the stored ints into strings of digits. Turn
+        them back into ints. Colon separated strings are left as they are.
+        """
+        if self.mac_as_int and isinstance(mac_address, str):
+            if mac_address.isdigit():
+                return int(mac_address)
+        return mac_address
+
     def close_connection(self) -> None:
         """ close the db connection """
         try:
@@ -115,7 +140,9 @@ class SQLiteDB:
         try:
             cur = self.conn.cursor()
             cur.execute(
-                f"SELECT {col_names} FROM {self.TABLE} LIMIT ?", (num_rows,)
+                f"SELECT {col_names} FROM {self.TABLE} "
+                f"ORDER BY {self.ROW_ID} LIMIT ?",
+                (num_rows,),
             )
             rows = cur.fetchall()
             logger.info(f"Successfully selected {len(rows)} rows.")
@@ -130,39 +157,61 @@ class SQLiteDB:
         :param row_data: insertable data repr the row
         :return: True if row insertion succeeds, otherwise false
         """
-        sql = f""" INSERT INTO {self.TABLE}({self.SCHEMA})
-                  VALUES({','.join(['?'] * len(self.SCHEMA.split(',')))}) """
         try:
             cur = self.conn.cursor()
-            cur.execute(sql, row_data)
+            cur.execute(self.INSERT_SQL, row_data)
             logger.debug(f"Row {row_data} successful inserted.")
             return True
         except Error:
             logger.exception(f"Error! Cannot insert row to {self.TABLE}.")
             return False
 
-    def delete_rows(self, num_rows: int) -> None:
+    def drain_rows(self, num_rows: int) -> List[Any]:
         """
-        Delete the top {num_rows} rows sorted by {id}
+        Select the next {num_rows} rows by keyset pagination on ROW_ID, i.e.
+        `ROW_ID > last_drained_id ORDER BY ROW_ID`, and delete exactly those
+        rows by ROW_ID range, in one transaction. Both statements walk the
+        primary key index, so the cost depends on {num_rows}, not on the size
+        of the table.
+
         Args:
-            conn:           Connection object to database
-            table_name:     Name of the table
-            row_id:         The id column (primary key, autoincremented)
-            num_rows:       Number of rows to be deleted
+            num_rows:       Number of rows to be drained
         Returns:
-            None
+            A list of sqlite3.Row drained, in ROW_ID order. If no row is
+            drained or an error occurs, return empty list.
         Raises:
             None
         """
+        rows: List[Any] = []
         try:
-            cur = self.conn.cursor()
-            cur.execute(
-                f"DELETE FROM {self.TABLE} ORDER BY ? LIMIT ?",
-                (self.ROW_ID, num_rows),
-            )
-            logger.info(f"Successfully deleted {num_rows} rows.")
+            with self.conn:
+                cur = self.conn.cursor()
+                # Rows up to last_drained_id are all deleted, so a row at or
+                # below it means ROW_ID restarted from 1 once the table was
+                # emptied: drain from the beginning again, in order.
+                cur.execute(f"SELECT MIN({self.ROW_ID}) FROM {self.TABLE}")
+                (min_id,) = cur.fetchone()
+                if min_id is not None and min_id <= self.last_drained_id:
+                    self.last_drained_id = 0
+                cur.execute(
+                    f"""SELECT {self.ROW_ID}, {self.SCHEMA} FROM {self.TABLE}
+                    WHERE {self.ROW_ID} > ? ORDER BY {self.ROW_ID} LIMIT ?""",
+                    (self.last_drained_id, num_rows),
+                )
+                rows = cur.fetchall()
+                if rows:
+                    max_id = rows[-1][0]
+                    cur.execute(
+                        f"""DELETE FROM {self.TABLE}
+                        WHERE {self.ROW_ID} > ? AND {self.ROW_ID} <= ?""",
+                        (self.last_drained_id, max_id),
+                    )
+                    self.last_drained_id = max_id
+            logger.info(f"Successfully drained {len(rows)} rows.")
         except Error:
-            logger.exception(f"Error! Cannot delete rows from {self.TABLE}")
+            logger.exception(f"Error! Cannot drain rows from {self.TABLE}")
+            rows = []
+        return rows
 
     def fetch_rows_all_col(
         self, num_rows: int
@@ -178,31 +227,39 @@ class SQLiteDB:
             None
         """
         rows: List[Tuple[str, bool, bool, str, int, int]] = []
-        with self.conn:
-            for r in self.select_rows(self.SCHEMA, num_rows):
-                # see doc: https://docs.python.org/3/library/sqlite3.html#sqlite3.Row
-                # for a description of sqlite3.Row object.
-                row = (
-                    r["macAddress"],
-                    r["isPhysical"] == 1,
-                    r["isWifi"] == 1,
-                    r["captureTime"],
-                    int(r["rssi"]),
-                    int(r["channel"]),
-                )
-                logger.debug(f"Fetched row: {row}")
-                rows.append(row)
-            if len(rows) > 0:
-                self.delete_rows(len(rows))
-            else:
-                logger.info("Fetched 0 rows")
+        start = perf_counter()
+        drained = self.drain_rows(num_rows)
+        metrics.histogram(
+            "local_store_fetch_seconds", "Time to fetch rows from local store"
+        ).observe(perf_counter() - start)
+        metrics.counter(
+            "local_store_rows_fetched_total", "Rows fetched from local store"
+        ).inc(len(drained))
+        for r in drained:
+            # see doc: https://docs.python.org/3/library/sqlite3.html#sqlite3.Row
+            # for a description of sqlite3.Row object.
+            row = (
+                self._load_mac(r["macAddress"]),
+                r["isPhysical"] == 1,
+                r["isWifi"] == 1,
+                r["captureTime"],
+                int(r["rssi"]),
+                int(r["channel"]),
+            )
+            logger.debug(f"Fetched row: {row}")
+            rows.append(row)
+        if not rows:
+            logger.info("Fetched 0 rows")
         return rows
 
     def insert_mult_rows(
         self, rows: List[Tuple[str, bool, bool, str, int, int]]
     ) -> bool:
         """
-        Insert multiple rows to a database
+        Insert multiple rows to a database. In "bulk" INSERT_MODE, all rows are
+        inserted with one `executemany` in a single transaction, and `rows` is
+        left untouched. In "row" INSERT_MODE, rows are popped from `rows` and
+        inserted one by one.
 
         Args:
             rows:       A deque of rows to be inserted
@@ -213,6 +270,37 @@ class SQLiteDB:
         Raises:
             None
         """
+        start = perf_counter()
+        num_rows: int = len(rows)
+        if self.INSERT_MODE == "bulk":
+            is_successful = self.insert_rows_bulk(rows)
+        else:
+            is_successful = self.insert_rows_one_by_one(rows)
+        if is_successful:
+            metrics.histogram(
+                "local_store_insert_seconds",
+                "Time to insert rows in local store",
+            ).observe(perf_counter() - start)
+            metrics.counter(
+                "local_store_rows_inserted_total",
+                "Rows inserted in local store",
+            ).inc(num_rows)
+        return is_successful
+
+    def insert_rows_one_by_one(
+        self, rows: List[Tuple[str, bool, bool, str, int, int]]
+    ) -> bool:
+        """
+        Pop rows from `rows` and insert them one by one, committing only
+        after all rows have been inserted.
+
+        Args:
+            rows:       A list of rows to be inserted
+        Returns:
+            False if an error occurs during insertion, otherwise True.
+        Raises:
+            None
+        """
         is_successful: bool = True
         num_rows: int = len(rows)
         while rows and is_successful:
@@ -224,14 +312,39 @@ class SQLiteDB:
             self.conn.commit()
             logger.info(f"Successfully inserted {num_rows} rows to local DB.")
             sleep(1)
+        else:  # drop the rows inserted so far, they will be reinserted
+            self.conn.rollback()
         return is_successful
 
+    def insert_rows_bulk(
+        self, rows: List[Tuple[str, bool, bool, str, int, int]]
+    ) -> bool:
+        """
+        Insert all rows with the prepared INSERT statement in one transaction.
+        If any insertion fails, the whole transaction is rolled back.
+
+        Args:
+            rows:       A list of rows to be inserted
+        Returns:
+            False if an error occurs during insertion, otherwise True.
+        Raises:
+            None
+        """
+        try:
+            with self.conn:  # commit on success, rollback on exception
+                self.conn.executemany(self.INSERT_SQL, rows)
+            logger.info(f"Successfully inserted {len(rows)} rows to local DB.")
+            return True
+        except Error:
+            logger.exception(f"Error! Cannot insert rows to {self.TABLE}.")
+            return False
+
     def push_to_queue(self, data_q, num_rows: int):
         """
-        Extract {num_rows} rows from db and put them row by row in a queue.
+        Extract {num_rows} rows from db and put them as one batch in a queue.
 
         Args:
-            data_q:         A queue into which the rows are to be pushed
+            data_q:         A BatchQueue into which the rows are to be pushed
             num_rows:       Number of rows to extract and put in queue
         Returns:
             True if some rows are pushed, False if no row is pushed. In other
@@ -247,8 +360,7 @@ class SQLiteDB:
             rows = self.fetch_rows_all_col(num_rows)
             if not rows:
                 row_pushed = False
-            while rows:
-                data_q.put(rows.pop())
+            data_q.put_batch(rows)
         return row_pushed
 
     def extract_from_queue(self, data_q):
@@ -257,7 +369,7 @@ class SQLiteDB:
         storage. If extraction fails, put the data back into data_q.
 
         Args:
-            data_q:     A queue from which rows are extracted.
+            data_q:     A BatchQueue from which rows are extracted.
         Returns:
             False if some error occurs during row insertion to localDB,
             otherwise True. This means if nothing gets inserted to localDB, i.e.
@@ -265,16 +377,30 @@ class SQLiteDB:
         Raises:
             None
         """
-        if not self.is_connected():  # initialize database if necessary
-            self.initialize()
         # collect all rows into a list
-        rows: List[Tuple[str, bool, bool, str, int, int]] = []
-        while not data_q.empty():
-            rows.append(data_q.get())
-        # insert all rows to local db
-        insert_success = self.insert_mult_rows(rows)
+        rows = data_q.get_all()
+        insert_success = self.store_rows(rows)
         if not insert_success:  # insertion failed
             logger.info("Insert data to db failed. Put back into data queue")
-            while rows:
-                data_q.put(rows.pop())  # put the unsent data back
+            data_q.requeue(rows)  # put the unsent data back
         return insert_success
+
+    def store_rows(self, rows: List[Tuple[str, bool, bool, str, int, int]]):
+        """
+        Put rows in local db for stable storage, initializing the database if
+        necessary. `rows` is left intact, such that it can be put back where
+        it came from if storing fails.
+
+        Args:
+            rows:       A list of rows to be stored.
+        Returns:
+            False if some error occurs during row insertion to localDB,
+            otherwise True.
+        Raises:
+            None
+        """
+        if not self.is_connected():  # initialize database if necessary
+            self.initialize()
+        # insert all rows to local db. insert_mult_rows may consume the list
+        # it is given, so hand it a copy.
+        return self.insert_mult_rows(list(rows))
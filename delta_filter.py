@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from typing import Any, List, Tuple
+from utility import MacAddress
+
+
+class DeviceState:
+    """ What was last reported of one MAC address """
+
+    __slots__ = ("reported_at", "rssi", "seen_at")
+
+    def __init__(self, reported_at: int, rssi: int):
+        self.reported_at = reported_at
+        self.rssi = rssi
+        self.seen_at = reported_at
+
+
+class DeltaFilter:
+    """
+    Drop rows of devices that have been reported recently and have not moved,
+    so that stationary devices are not uploaded again every session.
+
+    The state of each reported MAC address is kept in a table ordered by the
+    time it was last seen. A row is kept if the device is new, i.e. not in
+    the table, if its rssi moved by DELTA_RSSI dB or more since it was last
+    reported, or as a keepalive if it was last reported DELTA_KEEPALIVE
+    seconds ago or more. Devices not seen for DELTA_TTL
+    seconds are dropped from the table, and so are the least recently seen
+    ones beyond DELTA_MAX_DEVICES, so that memory stays bounded. A dropped
+    device is new again when it comes back. A device heard on another channel
+    than the one it is reported on is not new, as devices scan all channels.
+
+    Time is the captureTime of the rows, in ms since epoch, such that a
+    replayed or late session is filtered as it would have been live.
+    """
+
+    def __init__(self, COLLECT_CONFIG):
+        self.KEEPALIVE = int(float(COLLECT_CONFIG["DELTA_KEEPALIVE"]) * 1000)
+        self.RSSI = int(COLLECT_CONFIG["DELTA_RSSI"])
+        self.TTL = int(float(COLLECT_CONFIG["DELTA_TTL"]) * 1000)
+        self.MAX_DEVICES = int(COLLECT_CONFIG["DELTA_MAX_DEVICES"])
+        self.devices: "OrderedDict[MacAddress, DeviceState]" = OrderedDict()
+        self.kept = 0
+        self.suppressed = 0
+
+    def __len__(self) -> int:
+        return len(self.devices)
+
+    def filter_rows(
+        self, rows: List[Tuple[Any, ...]]
+    ) -> List[Tuple[Any, ...]]:
+        """
+        Keep the rows of a session that carry news, and update the table.
+
+        Args:
+            rows:   List of tuples (macAddress, isPhysical, isWifi,
+                    captureTime, rssi, channel), as made by
+                    `SessionAggregator.make_rows`.
+        Returns:
+            The rows kept, in the same order.
+        Raises:
+            None
+        """
+        devices = self.devices
+        kept: List[Tuple[Any, ...]] = []
+        latest = 0
+        for row in rows:
+            key = row[0]
+            capture_time, rssi = row[3], row[4]
+            if capture_time > latest:
+                latest = capture_time
+            state = devices.get(key)
+            if state is None:
+                devices[key] = DeviceState(capture_time, rssi)
+                kept.append(row)
+                continue
+            devices.move_to_end(key)
+            state.seen_at = capture_time
+            if (
+                abs(rssi - state.rssi) >= self.RSSI
+                or capture_time - state.reported_at >= self.KEEPALIVE
+            ):
+                state.reported_at = capture_time
+                state.rssi = rssi
+                kept.append(row)
+        self.expire(latest)
+        self.kept += len(kept)
+        self.suppressed += len(rows) - len(kept)
+        return kept
+
+    def expire(self, now: int) -> None:
+        """
+        Drop devices not seen for DELTA_TTL seconds before `now`, in ms since
+        epoch, then the least recently seen beyond DELTA_MAX_DEVICES.
+        """
+        devices = self.devices
+        oldest = now - self.TTL
+        while devices and (
+            len(devices) > self.MAX_DEVICES
+            or next(iter(devices.values())).seen_at <= oldest
+        ):
+            devices.popitem(last=False)
@@ -0,0 +1,167 @@
+import shlex
+import subprocess
+from collections import deque
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from typing import Deque, Dict, List, Optional, Tuple
+import metrics
+from log_setup import get_logger
+
+
+logger = get_logger("collect_data")
+
+
+class HopScheduler:
+    """
+    Switch the channel of a radio from the data collection process, in place
+    of the fixed rotation of `sniff-probes.sh --channel_hop`, and reweight
+    the time spent on each channel by the traffic observed there.
+
+    A round visits every channel once and lasts CHANNEL_DUR seconds per
+    channel on average, as the fixed rotation does. After each session, the
+    yield of a channel, i.e. the number of distinct MAC addresses seen per
+    second spent on it, is folded into a moving average (weight YIELD_ALPHA
+    for the last session). Each channel then gets MIN_SHARE of the round,
+    and the rest of the round is shared in proportion to the yields, so that
+    quiet channels are still explored.
+
+    Switches are logged with their time, such that probe requests read from
+    tcpdump text, which carries no channel, are mapped to the channel the
+    radio was on when they were captured (see `channel_at`).
+
+    The scheduler runs in the data collection process, so the radio stays on
+    its last channel from the moment that process ends until its successor
+    starts hopping again. The yields are kept across restarts, see
+    WindowCheckpoint.
+    """
+
+    def __init__(self, interface: str, channels: List[int], HOP_CONFIG):
+        self.interface = interface
+        self.channels = channels
+        self.CHANNEL_DUR = float(HOP_CONFIG["CHANNEL_DUR"])
+        self.MIN_SHARE = float(HOP_CONFIG["MIN_SHARE"])
+        self.YIELD_ALPHA = float(HOP_CONFIG["YIELD_ALPHA"])
+        self.HOP_CMD = HOP_CONFIG["HOP_CMD"]
+        self.dwell = {c: self.CHANNEL_DUR for c in channels}
+        self.yields: Dict[int, float] = {}
+        self.dwelled = {c: 0.0 for c in channels}  # seconds, this session
+        # (time in ms since epoch, channel) of recent switches
+        self.switches: Deque[Tuple[int, int]] = deque(maxlen=256)
+        self.lock = Lock()
+        self.stopped = Event()
+        self.thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        """ Start switching channels in the background """
+        self.thread = Thread(target=self.run, name="HopScheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def plan(self) -> List[Tuple[int, float]]:
+        """ The next round, as a list of (channel, dwell time in seconds) """
+        with self.lock:
+            return [(c, self.dwell[c]) for c in self.channels]
+
+    def record_dwell(self, channel: int, seconds: float) -> None:
+        with self.lock:
+            self.dwelled[channel] += seconds
+
+    def reweight(self, seen: Dict[int, int]) -> Dict[int, float]:
+        """
+        Update the yield of each channel with the last session, and the dwell
+        times of the next rounds accordingly.
+
+        Args:
+            seen:   Number of distinct MAC addresses seen on each channel in
+                    the session.
+        Returns:
+            The new dwell time of each channel, in seconds.
+        Raises:
+            None
+        """
+        with self.lock:
+            for c in self.channels:
+                if self.dwelled[c] <= 0:
+                    continue  # not visited this session, keep the estimate
+                last = seen.get(c, 0) / self.dwelled[c]
+                prev = self.yields.get(c, last)
+                self.yields[c] = prev + self.YIELD_ALPHA * (last - prev)
+                self.dwelled[c] = 0.0
+            n = len(self.channels)
+            round_dur = self.CHANNEL_DUR * n
+            # channels never visited are assumed as good as the average one
+            known = [self.yields[c] for c in self.channels if c in self.yields]
+            default = sum(known) / len(known) if known else 1.0
+            yields = {c: self.yields.get(c, default) for c in self.channels}
+            total = sum(yields.values())
+            min_share = min(self.MIN_SHARE, 1 / n)
+            for c in self.channels:
+                share = min_share + (1 - n * min_share) * (
+                    yields[c] / total if total > 0 else 1 / n
+                )
+                self.dwell[c] = share * round_dur
+            return dict(self.dwell)
+
+    def weights(self) -> Dict[int, float]:
+        """ The yield of each channel visited so far, see `reweight` """
+        with self.lock:
+            return dict(self.yields)
+
+    def restore(self, yields: Dict[int, float]) -> None:
+        """
+        Resume the yields of a previous data collection process, for the
+        channels still hopped through, and set the dwell times accordingly.
+        """
+        with self.lock:
+            self.yields = {c: y for c, y in yields.items() if c in self.dwell}
+        self.reweight({})
+
+    def switch(self, channel: int) -> bool:
+        """ Switch the radio to `channel` with HOP_CMD, and log the switch """
+        cmd = self.HOP_CMD.format(interface=self.interface, channel=channel)
+        try:
+            subprocess.run(
+                shlex.split(cmd),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=5,
+                check=True,
+            )
+        except (OSError, subprocess.SubprocessError):
+            logger.exception(f"Cannot switch {self.interface} to {channel}")
+            return False
+        # frames captured while the command runs are put on the old channel
+        self.switches.append((int(time() * 1000), channel))
+        return True
+
+    def channel_at(self, captureTime: int) -> int:
+        """
+        The channel the radio was on at `captureTime`, in ms since epoch.
+        The first channel if no switch is logged yet.
+        """
+        switches = self.switches
+        if not switches:
+            return self.channels[0]
+        last_time, channel = switches[-1]
+        if captureTime >= last_time:  # usual case, read shortly after capture
+            return channel
+        for switch_time, channel in reversed(switches):
+            if captureTime >= switch_time:
+                return channel
+        return switches[0][1]  # older than the log
+
+    def run(self) -> None:
+        switches = metrics.counter("hop_switches_total", "Channel switches")
+        while not self.stopped.is_set():
+            for channel, dwell in self.plan():
+                if not self.switch(channel):
+                    if self.stopped.wait(self.CHANNEL_DUR):
+                        return
+                    continue
+                switches.inc()
+                start = monotonic()
+                if self.stopped.wait(dwell):
+                    return
+                self.record_dwell(channel, monotonic() - start)
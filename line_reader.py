@@ -0,0 +1,122 @@
+import logging
+import select
+from typing import Iterator, List, Optional
+
+
+logger = logging.getLogger("collect_data")
+
+
+def readable(stream, timeout: Optional[float]) -> bool:
+    """
+    Wait until `stream` has data to read (or is at EOF), for at most
+    {timeout} seconds. Always True if timeout is None. Only valid for
+    streams read with `read1` in blocks larger than their buffer, which then
+    never holds data `select` cannot see.
+    """
+    if timeout is None:
+        return True
+    return bool(select.select([stream], [], [], timeout)[0])
+
+
+def iter_lines(
+    stream, max_line_len: int = 4096, timeout: Optional[float] = None
+) -> Iterator[List[bytes]]:
+    """
+    Read `stream` one line at a time, yielding each line as a batch of one.
+    This is the original way of reading the output of sniff-probes.sh. The
+    stream is read like in `iter_line_batches`, since `readline` would keep
+    what it reads past the line in the stream's buffer, where `select`
+    cannot see it, and so could not honour the timeout.
+
+    Args:
+        stream:         A buffered binary stream, e.g. stdout of a `Popen`
+                        object.
+        max_line_len:   Maximum length of a partial line kept between reads.
+        timeout:        Max number of seconds to wait for data. An empty
+                        batch is yielded then. None to wait forever.
+    Yields:
+        A list containing a single raw line without the trailing newline,
+        or an empty list on timeout.
+    Raises:
+        None
+    """
+    for lines in iter_line_batches(
+        stream, max_line_len=max_line_len, timeout=timeout
+    ):
+        if not lines:
+            yield lines
+        for line in lines:
+            yield [line]
+
+
+def iter_line_batches(
+    stream,
+    block_size: int = 65536,
+    max_line_len: int = 4096,
+    timeout: Optional[float] = None,
+) -> Iterator[List[bytes]]:
+    """
+    Read `stream` in large blocks and split each block into lines in bulk.
+    `read1` returns as soon as some data is available, so a batch never waits
+    for a full block to be filled. The trailing partial line of a block is
+    kept and prepended to the next block. If it grows beyond `max_line_len`
+    it is discarded, which bounds memory if the stream produces garbage.
+
+    Args:
+        stream:         A buffered binary stream, e.g. stdout of a `Popen`
+                        object.
+        block_size:     Maximum number of bytes read per call.
+        max_line_len:   Maximum length of a partial line kept between blocks.
+        timeout:        Max number of seconds to wait for data. An empty
+                        batch is yielded then. None to wait forever.
+    Yields:
+        A list of raw lines without the trailing newline.
+    Raises:
+        None
+    """
+    partial = b""
+    while True:
+        if not readable(stream, timeout):
+            yield []
+            continue
+        block = stream.read1(block_size)
+        if not block:
+            break
+        lines = block.split(b"\n")
+        lines[0] = partial + lines[0]
+        partial = lines.pop()
+        if len(partial) > max_line_len:
+            logger.warning(
+                f"Discard partial line longer than {max_line_len} bytes"
+            )
+            partial = b""
+        if lines:
+            yield lines
+    if partial:
+        yield [partial]
+
+
+def make_line_reader(stream, COLLECT_CONFIG) -> Iterator[List[bytes]]:
+    """
+    Create a reader of `stream` according to READ_MODE in COLLECT_CONFIG.
+
+    Args:
+        stream:             A binary stream, e.g. stdout of a `Popen` object.
+        COLLECT_CONFIG:     Config for READ_MODE, BLOCK_SIZE, MAX_LINE_LEN and
+                            IDLE_TICK
+    Returns:
+        An iterator yielding batches of raw lines.
+    Raises:
+        ValueError if READ_MODE is neither "block" nor "line".
+    """
+    timeout = float(COLLECT_CONFIG["IDLE_TICK"])
+    if COLLECT_CONFIG["READ_MODE"] == "block":
+        return iter_line_batches(
+            stream,
+            int(COLLECT_CONFIG["BLOCK_SIZE"]),
+            int(COLLECT_CONFIG["MAX_LINE_LEN"]),
+            timeout,
+        )
+    if COLLECT_CONFIG["READ_MODE"] == "line":
+        return iter_lines(stream, int(COLLECT_CONFIG["MAX_LINE_LEN"]), timeout)
+    raise ValueError(f"Unknown READ_MODE {COLLECT_CONFIG['READ_MODE']}")
@@ -0,0 +1,28 @@
+from spill_journal import SpillJournal
+
+
+def make_local_store(APP_CONFIG, mac_as_int: bool = False):
+    """
+    Create the local store selected by BACKEND in the [local_store] section.
+    Both backends offer the same interface, see SQLiteDB. sqlite is only
+    imported if selected.
+
+    Args:
+        APP_CONFIG:     The parsed app_config.ini
+        mac_as_int:     Whether MAC addresses are collected as ints.
+    Returns:
+        A SQLiteDB or a SpillJournal.
+    Raises:
+        ValueError if BACKEND is neither "sqlite" nor "journal".
+    """
+    STORE_CONFIG = APP_CONFIG["local_store"]
+    backend = STORE_CONFIG["BACKEND"]
+    if backend == "sqlite":
+        from db import SQLiteDB
+
+        return SQLiteDB(
+            APP_CONFIG["sqlite"], APP_CONFIG["health_check"], mac_as_int
+        )
+    if backend == "journal":
+        return SpillJournal(STORE_CONFIG)
+    raise ValueError(f"Unknown local store BACKEND {backend}")
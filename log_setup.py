@@ -0,0 +1,66 @@
+import json
+import logging
+import logging.config
+import os
+from typing import Any, Dict
+
+# next to this module, wherever the program is run from
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(BASE_DIR, "logger_config.yaml")
+# logger_config.yaml parsed into JSON, which loads without importing yaml
+CACHE_FILE = os.path.join(BASE_DIR, "__pycache__", "logger_config.json")
+
+_configured = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Get the logger `name`, setting up logging first if this process has not
+    done so yet. Child processes are forked with logging already set up.
+    """
+    if not _configured:
+        setup()
+    return logging.getLogger(name)
+
+
+def setup(path: str = CONFIG_FILE) -> None:
+    """ Set up logging from logger_config.yaml, once per process """
+    global _configured
+    logging.config.dictConfig(load_config(path))
+    _configured = True
+
+
+def load_config(path: str = CONFIG_FILE) -> Dict[str, Any]:
+    """
+    Load the logging config from CACHE_FILE if it is as recent as `path`,
+    else parse `path` and cache it. A cache that cannot be written, e.g. on a
+    read-only file system, is skipped.
+
+    Args:
+        path:   Path to the YAML logging config.
+    Returns:
+        The logging config, as taken by `logging.config.dictConfig`.
+    Raises:
+        OSError if `path` cannot be read.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    try:
+        with open(CACHE_FILE, "r") as f:
+            cached = json.load(f)
+        if cached["path"] == path and cached["mtime"] == mtime:
+            return cached["config"]
+    except (OSError, ValueError, KeyError):
+        pass
+    import yaml
+
+    with open(path, "r") as f:
+        config = yaml.safe_load(f.read())
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp = f"{CACHE_FILE}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({"path": path, "mtime": mtime, "config": config}, f)
+        os.replace(tmp, CACHE_FILE)  # readers never see a partial file
+    except (OSError, TypeError):
+        pass
+    return config
@@ -0,0 +1,59 @@
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple
+from utility import MacAddress, hash_mac
+
+
+class MacHasher:
+    """
+    Hash MAC addresses through a size-bounded LRU cache keyed by the raw MAC
+    address. The same devices probe over and over again, so most calls are
+    served from the cache instead of running blake2b.
+    """
+
+    def __init__(self, maxsize: int = 8192):
+        self.hash = lru_cache(maxsize=maxsize)(hash_mac)
+
+    def hash_batch(self, mac_addresses: Iterable[MacAddress]) -> List[str]:
+        """
+        Hash all MAC addresses of a session at once. Each distinct address is
+        hashed only once.
+
+        Args:
+            mac_addresses:  MAC addresses to be hashed.
+        Returns:
+            Hashes in the same order as mac_addresses.
+        Raises:
+            None
+        """
+        hashed: Dict[MacAddress, str] = {}
+        result: List[str] = []
+        for mac_address in mac_addresses:
+            h = hashed.get(mac_address)
+            if h is None:
+                h = hashed[mac_address] = self.hash(mac_address)
+            result.append(h)
+        return result
+
+    def hash_rows(self, rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        """
+        Replace the macAddress column (first column) of each row with its hash.
+
+        Args:
+            rows:   List of tuples, each of which represents a row.
+        Returns:
+            A new list of rows with hashed macAddress.
+        Raises:
+            None
+        """
+        hashes = self.hash_batch(r[0] for r in rows)
+        return [(h,) + r[1:] for h, r in zip(hashes, rows)]
+
+    def hit_rate(self) -> float:
+        """ Fraction of calls served from the cache so far """
+        info = self.hash.cache_info()
+        total = info.hits + info.misses
+        return info.hits / total if total else 0.0
+
+    def cache_info(self):
+        """ hits, misses, maxsize and currsize of the cache """
+        return self.hash.cache_info()
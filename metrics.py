@@ -0,0 +1,236 @@
+import json
+import os
+from bisect import bisect_left
+from threading import Lock, Thread, Event, get_ident
+from time import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+from log_setup import get_logger
+
+
+logger = get_logger("main")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+class Counter:
+    """ A value that only goes up """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+    def export(self) -> float:
+        return self.value
+
+
+class Gauge:
+    """
+    A value that goes up and down. Either set it, or give it a function
+    returning the current value, evaluated at each flush.
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        function: Optional[Callable[[], float]] = None,
+    ):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def export(self) -> float:
+        if self.function is not None:
+            return float(self.function())
+        return self.value
+
+
+class Histogram:
+    """ Distribution of observed values over fixed bucket upper bounds """
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = Lock()
+
+    def observe(self, value: float) -> None:
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def export(self) -> Dict[str, Union[float, Dict[str, int]]]:
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative: Dict[str, int] = {}
+        running = 0
+        for bound, n in zip(self.buckets + ["+Inf"], counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class Registry:
+    """
+    The metrics of one process, by name. A forked child process starts with
+    an empty registry, such that it only exports the metrics it creates.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self.lock = Lock()
+
+    def clear(self) -> None:
+        self.metrics = {}
+        self.lock = Lock()
+
+    def get_or_create(self, cls, name: str, *args) -> Metric:
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.setdefault(name, cls(name, *args))
+        return metric
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "timestamp": time(),
+                "metrics": {
+                    name: metric.export()
+                    for name, metric in list(self.metrics.items())
+                },
+            }
+        )
+
+    def to_prometheus(self) -> str:
+        """ Metrics in the Prometheus text exposition format """
+        lines: List[str] = []
+        for name, metric in list(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            value = metric.export()
+            if isinstance(value, dict):
+                for bound, n in value["buckets"].items():
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {n}')
+                lines.append(f"{name}_sum {value['sum']}")
+                lines.append(f"{name}_count {value['count']}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+os.register_at_fork(after_in_child=REGISTRY.clear)
+
+
+def counter(name: str, help: str = "") -> Counter:
+    """ Get the counter called {name}, creating it if necessary """
+    return REGISTRY.get_or_create(Counter, name, help)
+
+
+def gauge(
+    name: str, help: str = "", function: Optional[Callable[[], float]] = None
+) -> Gauge:
+    """ Get the gauge called {name}, creating it if necessary """
+    return REGISTRY.get_or_create(Gauge, name, help, function)
+
+
+def histogram(
+    name: str, help: str = "", buckets: Sequence[float] = LATENCY_BUCKETS
+) -> Histogram:
+    """ Get the histogram called {name}, creating it if necessary """
+    return REGISTRY.get_or_create(Histogram, name, help, buckets)
+
+
+def write_atomic(path: str, text: str) -> None:
+    # a temporary file per writer, such that concurrent writers of the same
+    # path do not replace each other's temporary file
+    tmp_path = f"{path}.{os.getpid()}.{get_ident()}"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def flush(METRICS_CONFIG, process_name: str) -> None:
+    """
+    Write the metrics of this process to {process_name}.json and
+    {process_name}.prom under METRICS_DIR. Files are replaced atomically, so
+    a scraper never reads a partial file.
+    """
+    metrics_dir = METRICS_CONFIG["METRICS_DIR"]
+    try:
+        os.makedirs(metrics_dir, exist_ok=True)
+        base = os.path.join(metrics_dir, process_name)
+        write_atomic(base + ".json", REGISTRY.to_json())
+        write_atomic(base + ".prom", REGISTRY.to_prometheus())
+    except OSError:
+        logger.exception("Error! Cannot write metrics.")
+
+
+def start_flusher(
+    METRICS_CONFIG, process_name: str
+) -> Optional[Tuple[Event, Thread]]:
+    """
+    Flush the metrics of this process every FLUSH_INTERVAL seconds from a
+    background thread, unless metrics are disabled.
+
+    Args:
+        METRICS_CONFIG: The [metrics] section of app_config.ini.
+        process_name:   Name of the files written, see `flush`.
+    Returns:
+        The Event stopping the flusher and its thread, to be given to
+        `stop_flusher`, or None if metrics are disabled.
+    Raises:
+        None
+    """
+    if not METRICS_CONFIG.getboolean("ENABLED"):
+        return None
+    interval = float(METRICS_CONFIG["FLUSH_INTERVAL"])
+    stop = Event()
+
+    def run():
+        while not stop.wait(interval):
+            flush(METRICS_CONFIG, process_name)
+        flush(METRICS_CONFIG, process_name)
+
+    thread = Thread(target=run, name="Metrics", daemon=True)
+    thread.start()
+    return stop, thread
+
+
+def stop_flusher(flusher: Optional[Tuple[Event, Thread]]) -> None:
+    """
+    Stop a flusher started by `start_flusher`, and wait for its thread to
+    write the last metrics of this process.
+    """
+    if flusher is None:
+        return
+    stop, thread = flusher
+    stop.set()
+    thread.join()
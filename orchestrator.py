@@ -0,0 +1,605 @@
+import asyncio
+import configparser
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import JoinableQueue
+from multiprocessing.connection import wait
+from queue import Empty
+from time import monotonic
+from typing import Callable, Dict, List, Optional, Tuple
+from batch_queue import BatchQueue
+from child_process import start_command, start_child, kill_child, kill_cmd
+from collect_data import collect_data
+from connectivity import ConnectivityMonitor
+from hop_scheduler import HopScheduler
+from local_store import make_local_store
+from spill_journal import SpillJournal
+from supervisor import RESTART_GAP_BUCKETS, RestartBackoff, StandbyCollector
+from payload_encoding import get_encoder
+import upload_service
+import metrics
+from log_setup import get_logger
+
+
+logger = get_logger("main")
+
+
+class Radio:
+    """
+    One capture (sniff-probes.sh on one interface) and the data collection
+    process reading it. Each radio has its own msg_q, so that it is watched
+    and restarted independently of the others, and its own overflow journal,
+    which must have a single writer. If the radio has a HopScheduler, data
+    collection runs it to switch channels.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        SNIFF_CMD: str,
+        OVERFLOW_CONFIG,
+        backoff: RestartBackoff,
+        scheduler: Optional[HopScheduler] = None,
+    ):
+        self.name = name
+        self.SNIFF_CMD = SNIFF_CMD
+        self.OVERFLOW_CONFIG = OVERFLOW_CONFIG
+        self.backoff = backoff
+        self.scheduler = scheduler
+        self.msg_q = JoinableQueue()  # inform health of child process
+        self.overflow: Optional[SpillJournal] = None  # read side
+        self.probe_proc = None
+        self.col_data_proc = None
+        self.standby: Optional[StandbyCollector] = None
+
+
+class Orchestrator:
+    """
+    Event-driven main loop. Independent asyncio tasks ingest session batches
+    from the data collection processes, upload them via MQTT, spill them to the
+    local database when the device has been offline for too long, and watch
+    connectivity and the health of the child processes.
+
+    Tasks are woken up by state changes (new data, connectivity transition,
+    child failure) through a shared condition instead of fixed sleeps. All
+    blocking work runs in worker threads. sqlite runs on a dedicated thread,
+    because a connection cannot be used from another thread than the one that
+    created it. The BatchQueue's local deque and the online state are only
+    touched from the event loop thread.
+    """
+
+    def __init__(
+        self,
+        APP_CONFIG,
+        SNIFF_CMDS: Dict[str, str],
+        SESS_DUR: int,
+        HOP_CHANNELS: Optional[Dict[str, List[int]]] = None,
+        mqtt_client=None,
+    ):
+        self.APP_CONFIG = APP_CONFIG
+        self.HEALTH_CHECK_CONFIG = APP_CONFIG["health_check"]
+        self.COLLECT_CONFIG = APP_CONFIG["collect_data"]
+        self.AWS_IOT_CONFIG = APP_CONFIG["aws_iot"]
+        self.METRICS_CONFIG = APP_CONFIG["metrics"]
+        self.OVERFLOW_CONFIG = APP_CONFIG["overflow"]
+        self.HOP_CONFIG = APP_CONFIG["channel_hop"]
+        self.SESS_DUR = SESS_DUR
+        self.RETRY_INTERVAL = int(self.HEALTH_CHECK_CONFIG["RETRY_INTERVAL"])
+        self.MAX_OFFLINE_DUR = int(self.HEALTH_CHECK_CONFIG["MAX_OFFLINE_DUR"])
+        self.CONNECTIVITY_INTERVAL = int(
+            self.HEALTH_CHECK_CONFIG["CONNECTIVITY_INTERVAL"]
+        )
+        self.STATS_INTERVAL = int(self.HEALTH_CHECK_CONFIG["STATS_INTERVAL"])
+        self.WARM_STANDBY = self.HEALTH_CHECK_CONFIG.getboolean("WARM_STANDBY")
+        self.HIGH_WATER_ROWS = int(self.OVERFLOW_CONFIG["HIGH_WATER_ROWS"])
+        self.LOW_WATER_ROWS = int(self.OVERFLOW_CONFIG["LOW_WATER_ROWS"])
+        self.PAGE_ROWS = int(self.OVERFLOW_CONFIG["PAGE_ROWS"])
+        self.convert_fun = get_encoder(self.AWS_IOT_CONFIG["PAYLOAD_ENCODING"])
+
+        # Key data structures
+        # transmit data from every col_data_proc to here. Above
+        # HIGH_WATER_ROWS, they write to their overflow journal instead.
+        self.data_q = BatchQueue(self.HIGH_WATER_ROWS)
+        self.us = upload_service.UploadService(
+            self.AWS_IOT_CONFIG, mqtt_client
+        )
+        self.monitor = ConnectivityMonitor(self.HEALTH_CHECK_CONFIG, self.us)
+        self.localDB = None  # SQLiteDB or SpillJournal, created on db thread
+        # one capture and data collection per radio (WiFi interface). Radios
+        # in HOP_CHANNELS have their channels switched by data collection.
+        HOP_CHANNELS = HOP_CHANNELS or {}
+        self.radios = [
+            Radio(
+                name,
+                SNIFF_CMD,
+                self.radio_overflow_config(name, SNIFF_CMDS),
+                RestartBackoff(self.HEALTH_CHECK_CONFIG),
+                HopScheduler(name, HOP_CHANNELS[name], self.HOP_CONFIG)
+                if name in HOP_CHANNELS
+                else None,
+            )
+            for name, SNIFF_CMD in SNIFF_CMDS.items()
+        ]
+
+        # state shared among tasks
+        self.is_online = False
+        self.offline_since = monotonic()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.changed: Optional[asyncio.Condition] = None
+        self.db_executor = ThreadPoolExecutor(max_workers=1)
+
+        metrics.gauge(
+            "data_q_rows", "Rows held in memory", lambda: len(self.data_q)
+        )
+        metrics.gauge(
+            "data_q_overflow_rows",
+            "Rows in the overflow journal",
+            lambda: self.data_q.overflow_rows(),
+        )
+        metrics.gauge(
+            "online", "1 if the device is online", lambda: self.is_online
+        )
+        metrics.gauge(
+            "offline_seconds",
+            "Duration of the current outage",
+            lambda: 0 if self.is_online else monotonic() - self.offline_since,
+        )
+        self.offline_total = metrics.counter(
+            "offline_seconds_total", "Total duration of past outages"
+        )
+        self.restarts = metrics.counter(
+            "capture_restarts_total", "Restarts of a radio's processes"
+        )
+        self.task_restarts = metrics.counter(
+            "task_restarts_total", "Restarts of a failed orchestrator task"
+        )
+        self.failovers = metrics.counter(
+            "capture_failovers_total",
+            "Restarts of data collection alone, reading on the same capture",
+        )
+        self.restart_gap = metrics.histogram(
+            "capture_restart_gap_seconds",
+            "Time from the end of a data collection process to its restart",
+            RESTART_GAP_BUCKETS,
+        )
+
+    def radio_overflow_config(self, name: str, SNIFF_CMDS: Dict[str, str]):
+        """
+        Overflow config of a radio. With several radios, each one writes to
+        its own subdirectory of JOURNAL_DIR.
+        """
+        if len(SNIFF_CMDS) == 1:
+            return self.OVERFLOW_CONFIG
+        config = configparser.ConfigParser()
+        config.read_dict({"overflow": self.OVERFLOW_CONFIG})
+        config["overflow"]["JOURNAL_DIR"] = os.path.join(
+            self.OVERFLOW_CONFIG["JOURNAL_DIR"], name
+        )
+        return config["overflow"]
+
+    async def run(self) -> None:
+        """
+        Start the child processes, then set up localDB and the MQTT client
+        and run all tasks. Capture starts first, so that no probe request is
+        lost while sqlite and the AWS IoT SDK load. Until ingest runs, the
+        sessions pushed wait in data_q.
+        """
+        self.loop = asyncio.get_event_loop()
+        self.changed = asyncio.Condition()
+        if self.HIGH_WATER_ROWS:
+            for radio in self.radios:
+                radio.overflow = await self.in_thread(
+                    SpillJournal, radio.OVERFLOW_CONFIG, "r"
+                )
+                # rows left by a previous run are paged in before new ones
+                self.data_q.add_overflow(
+                    await self.in_thread(radio.overflow.count_rows)
+                )
+        await self.in_thread(self.start_processes)
+        self.localDB = await self.in_db(
+            make_local_store,
+            self.APP_CONFIG,
+            self.COLLECT_CONFIG.getboolean("MAC_AS_INT"),
+        )
+        await self.in_thread(self.us.setup_client)
+        # an acknowledgement frees a slot in the publish window
+        self.us.on_ack = self.notify_threadsafe
+        # so is a connectivity change
+        self.monitor.on_change = self.notify_threadsafe
+        # a lost MQTT connection is checked at once, not after PROBE_TTL
+        self.us.on_offline = self.monitor.invalidate
+        self.monitor.start()
+        metrics.start_flusher(self.METRICS_CONFIG, "main")
+        await asyncio.gather(
+            self.supervise(self.ingest),
+            self.supervise(self.page_overflow),
+            self.supervise(self.upload),
+            self.supervise(self.track_acks),
+            self.supervise(self.spill),
+            self.supervise(self.watch_connectivity),
+            *(
+                self.supervise(self.watch_children, radio)
+                for radio in self.radios
+            ),
+        )
+
+    async def supervise(self, task: Callable, *args) -> None:
+        """
+        Run the coroutine function `task` with `args`, and run it again
+        RETRY_INTERVAL seconds after it fails, such that an unexpected error
+        in one task neither ends the others nor the program.
+        """
+        while True:
+            try:
+                return await task(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    f"Error! Task {task.__name__} failed. "
+                    f"Restart in {self.RETRY_INTERVAL} seconds."
+                )
+                self.task_restarts.inc()
+                await asyncio.sleep(self.RETRY_INTERVAL)
+
+    def in_thread(self, func: Callable, *args):
+        """ Run a blocking function in the default worker threads """
+        return self.loop.run_in_executor(None, func, *args)
+
+    def in_db(self, func: Callable, *args):
+        """ Run a blocking function on the dedicated database thread """
+        return self.loop.run_in_executor(self.db_executor, func, *args)
+
+    async def notify(self) -> None:
+        """ Wake up all tasks waiting for a state change """
+        async with self.changed:
+            self.changed.notify_all()
+
+    def notify_threadsafe(self) -> None:
+        """ Wake up all tasks waiting for a state change, from any thread """
+        self.loop.call_soon_threadsafe(asyncio.ensure_future, self.notify())
+
+    async def wait_until(
+        self, predicate: Callable[[], bool], timeout: Optional[float] = None
+    ) -> bool:
+        """
+        Wait until `predicate` is true, re-evaluating it on each state change.
+
+        Args:
+            predicate:  Function returning the condition to wait for.
+            timeout:    Max number of seconds to wait. None to wait forever.
+        Returns:
+            The value of `predicate` when the wait ends.
+        Raises:
+            None
+        """
+
+        async def wait() -> None:
+            # the lock is taken in the task wait_for runs, such that it is
+            # held again by the time that task ends, cancelled or not
+            async with self.changed:
+                await self.changed.wait_for(predicate)
+
+        try:
+            await asyncio.wait_for(wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return predicate()
+
+    def has_backlog(self) -> bool:
+        """
+        Whether the local database might still hold rows. The connection is
+        closed once the database is found empty, and reopened when rows are
+        stored again.
+        """
+        return self.localDB.is_connected()
+
+    async def ingest(self) -> None:
+        """ Move session batches from the collector into the local line """
+        while True:
+            rows = await self.in_thread(self.data_q.wait_batch, 1.0)
+            if rows:
+                self.data_q.append(rows)
+                await self.notify()
+
+    async def page_overflow(self) -> None:
+        """
+        Page rows back in from the overflow journals, oldest first, while
+        online and data_q holds fewer than LOW_WATER_ROWS rows. Collectors
+        keep writing to their overflow journal until all of them have been
+        emptied, rows left by a previous run included, so that rows stay in
+        order.
+        """
+        if not self.HIGH_WATER_ROWS:
+            return
+        while True:
+            if not await self.wait_until(
+                lambda: self.is_online
+                and self.data_q.overflow_rows() > 0
+                and len(self.data_q) < self.LOW_WATER_ROWS,
+                1.0,  # the collectors do not notify of new overflow rows
+            ):
+                continue
+            paged = False
+            for radio in self.radios:
+                rows = await self.in_thread(
+                    radio.overflow.fetch_rows_all_col, self.PAGE_ROWS
+                )
+                if rows:
+                    self.data_q.page_in(rows)
+                    paged = True
+            if paged:
+                await self.notify()
+            else:
+                await asyncio.sleep(1)  # a collector is mid-write
+
+    async def upload(self) -> None:
+        """
+        Send batches via MQTT as soon as there is data, the MQTT client is
+        online and fewer than PUBLISH_WINDOW batches are in flight. Rows left
+        in the local database are uploaded when there is nothing else to send.
+        """
+        while True:
+            await self.wait_until(
+                lambda: self.is_online
+                and self.us.online
+                and not self.us.window_full()
+                and (not self.data_q.empty() or self.has_backlog())
+            )
+            if self.data_q.empty():
+                # take at most one batch of rows out of localDB each time. If
+                # there is none left, close localDB
+                rows = await self.in_db(
+                    self.localDB.fetch_rows_all_col, self.us.batch_rows
+                )
+                if rows:
+                    self.data_q.append_local(rows)
+                else:
+                    await self.in_db(self.localDB.close_connection)
+                continue
+            batch, payload = self.us.make_payload(
+                self.data_q, self.convert_fun
+            )
+            if not batch:  # none of its rows can be encoded
+                continue
+            if not await self.in_thread(self.us.publish_async, batch, payload):
+                logger.info("MQTT msg not sent. Put back into data queue")
+                self.data_q.requeue(batch)
+                logger.info("Close MQTT client connection and retry")
+                await self.in_thread(self.us.disconnect)
+                await asyncio.sleep(self.RETRY_INTERVAL)
+
+    async def track_acks(self) -> None:
+        """
+        Put batches not acknowledged in time back in front of the line, and
+        log publishing metrics every STATS_INTERVAL seconds.
+        """
+        last_stats = monotonic()
+        while True:
+            await asyncio.sleep(1)
+            expired = self.us.expire_in_flight()
+            for batch in reversed(expired):  # oldest batch ends up first
+                self.data_q.requeue(batch)
+            if expired:
+                await self.notify()
+            if monotonic() - last_stats >= self.STATS_INTERVAL:
+                logger.info(f"MQTT publishing: {self.us.stats_summary()}")
+                last_stats = monotonic()
+
+    async def spill(self) -> None:
+        """
+        Push all data to localDB for stable storage once the device has been
+        offline for more than MAX_OFFLINE_DUR. If such push fails, close
+        localDB and try again later.
+        """
+        while True:
+            await self.wait_until(
+                lambda: not self.is_online and not self.data_q.empty()
+            )
+            offline_dur = monotonic() - self.offline_since
+            if offline_dur <= self.MAX_OFFLINE_DUR:
+                # internet is off but we are still waiting
+                await self.wait_until(
+                    lambda: self.is_online, self.MAX_OFFLINE_DUR - offline_dur
+                )
+                continue
+            logger.info("Internet off for too long. Push data to database")
+            rows = self.data_q.get_all()
+            if not await self.in_db(self.localDB.store_rows, rows):
+                self.data_q.requeue(rows)
+                logger.info("Close db connection and retry")
+                await self.in_db(self.localDB.close_connection)
+                await asyncio.sleep(self.RETRY_INTERVAL)
+
+    async def watch_connectivity(self) -> None:
+        """
+        Connect or disconnect the MQTT client as the ConnectivityMonitor
+        reports the device online or offline, checking at least every
+        CONNECTIVITY_INTERVAL seconds.
+        """
+        while True:
+            online = self.monitor.online
+            try:
+                if online and not self.us.online:
+                    await self.in_thread(self.us.connect)
+                elif not online and not self.us.offline:
+                    await self.in_thread(self.us.disconnect)
+            except Exception:
+                logger.exception("Error! Cannot (dis)connect MQTT client.")
+            if online != self.is_online:
+                self.is_online = online
+                if online:
+                    self.offline_total.inc(monotonic() - self.offline_since)
+                else:
+                    self.offline_since = monotonic()
+            if not online:
+                logger.warning(
+                    "Device offline for "
+                    f"{monotonic() - self.offline_since:.0f} seconds"
+                )
+            await self.notify()
+            await self.wait_until(
+                lambda: self.monitor.online != self.is_online,
+                self.CONNECTIVITY_INTERVAL,
+            )
+
+    async def watch_children(self, radio: Radio) -> None:
+        """
+        Restart data collection of a radio as soon as its process ends, e.g.
+        after reporting a failure. Its open sessions are resumed from their
+        checkpoint. If the capture is still running and outputs text, which
+        can be picked up midway, data collection alone is restarted, by the
+        standby if any, and reads on from the same pipe. Otherwise, capture
+        is restarted as well. Restarts are immediate, with backoff on
+        repeated failures, see RestartBackoff. Other radios keep running
+        meanwhile.
+        """
+        while True:
+            if not await self.in_thread(self.wait_children, radio, 1.0):
+                continue
+            ended_at = monotonic()
+            self.drain_msgs(radio)
+            if radio.scheduler is not None:
+                logger.warning(
+                    f"Channel hopping on {radio.name} stopped until data "
+                    "collection is restarted"
+                )
+            delay = radio.backoff.next_delay()
+            if delay:
+                logger.info(
+                    f"Retry probing and data collection on {radio.name} "
+                    f"in {delay:.0f} seconds"
+                )
+                await asyncio.sleep(delay)
+            if (
+                radio.probe_proc.poll() is None
+                and self.COLLECT_CONFIG["READ_MODE"] != "pcap"
+            ):
+                await self.in_thread(self.restart_collector, radio)
+                self.failovers.inc()
+            else:
+                await self.in_thread(self.stop_radio, radio)
+                await self.in_thread(self.start_radio, radio)
+            radio.backoff.started()
+            self.restarts.inc()
+            self.restart_gap.observe(monotonic() - ended_at)
+            logger.info(
+                f"Data collection on {radio.name} restarted in "
+                f"{monotonic() - ended_at:.3f} seconds"
+            )
+            if self.WARM_STANDBY:
+                await self.in_thread(self.start_standby, radio)
+
+    def wait_children(self, radio: Radio, timeout: float) -> bool:
+        """
+        Wait for the data collection process of a radio to end, at most
+        `timeout` seconds. True if it has ended, or if capture has.
+        """
+        return (
+            bool(wait([radio.col_data_proc.sentinel], timeout))
+            or radio.probe_proc.poll() is not None
+        )
+
+    def drain_msgs(self, radio: Radio) -> None:
+        """ Take the messages left in a radio's msg_q, e.g. "fail" """
+        while True:
+            try:
+                msg = radio.msg_q.get_nowait()
+            except Empty:
+                return
+            radio.msg_q.task_done()
+            logger.info(f"Data collection on {radio.name} reports: {msg}")
+
+    def start_processes(self) -> None:
+        """ Start probing and data collection on every radio """
+        for radio in self.radios:
+            self.start_radio(radio)
+        if self.WARM_STANDBY:
+            for radio in self.radios:
+                self.start_standby(radio)
+
+    def stop_processes(self) -> None:
+        """ Stop probing and data collection on every radio started """
+        for radio in self.radios:
+            if radio.probe_proc is not None:
+                self.stop_radio(radio)
+
+    def start_radio(self, radio: Radio) -> None:
+        """ Start probing and data collection on a radio """
+        radio.probe_proc = start_command(
+            radio.SNIFF_CMD,
+            f"Probe Request Sniff ({radio.name})",
+            self.HEALTH_CHECK_CONFIG,
+            -1,
+        )
+        radio.col_data_proc = start_child(
+            collect_data,
+            f"Data Collection ({radio.name})",
+            self.HEALTH_CHECK_CONFIG,
+            *self.collector_args(radio),
+        )
+
+    def collector_args(self, radio: Radio) -> Tuple:
+        """ Arguments of `collect_data` for a radio """
+        return (
+            radio.probe_proc,
+            self.data_q,
+            radio.msg_q,
+            self.SESS_DUR,
+            self.COLLECT_CONFIG,
+            radio.OVERFLOW_CONFIG,
+            self.METRICS_CONFIG,
+            "collect_data"
+            if len(self.radios) == 1
+            else f"collect_data-{radio.name}",
+            radio.scheduler,
+        )
+
+    def restart_collector(self, radio: Radio) -> None:
+        """
+        Start data collection on a radio whose capture is running, handing
+        over to the standby if any.
+        """
+        radio.col_data_proc.join()
+        if radio.standby is not None:
+            radio.col_data_proc = radio.standby.take_over()
+            radio.standby = None
+        else:
+            radio.col_data_proc = start_child(
+                collect_data,
+                f"Data Collection ({radio.name})",
+                self.HEALTH_CHECK_CONFIG,
+                *self.collector_args(radio),
+            )
+
+    def start_standby(self, radio: Radio) -> None:
+        """ Fork a standby data collection process for a radio """
+        if radio.standby is not None:
+            radio.standby.discard()
+        radio.standby = StandbyCollector(
+            f"Data Collection ({radio.name})", *self.collector_args(radio)
+        )
+
+    def stop_radio(self, radio: Radio) -> None:
+        """
+        Stop probing and data collection on a radio. Data collection is
+        warned first, such that it pushes its open sessions before probing is
+        killed, and is only terminated if it does not end in time.
+        """
+        if radio.standby is not None:  # of no use with another capture
+            radio.standby.discard()
+            radio.standby = None
+        kill_child(
+            radio.col_data_proc,
+            f"Data Collection ({radio.name})",
+            radio.msg_q,
+            self.RETRY_INTERVAL,
+        )
+        kill_cmd(
+            radio.probe_proc,
+            f"Probe Request Sniffing ({radio.name})",
+            self.RETRY_INTERVAL,
+        )
+        # not to stop the next data collection process, if this one ended
+        # without taking the warning
+        self.drain_msgs(radio)
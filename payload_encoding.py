@@ -0,0 +1,233 @@
+import json
+import lzma
+import struct
+import zlib
+from typing import Any, Callable, Dict, List, Tuple, Union
+from utility import (
+    convert_to_payload,
+    convert_to_payload_test,
+    int_to_mac,
+    mac_to_str,
+    to_epoch_ms,
+)
+
+
+Encoder = Callable[[List[Tuple[Any, ...]], str], Union[str, bytes]]
+
+# Registry of payload encoders by name. Each encoder takes a batch of rows and
+# the thing name, and returns the payload to publish. A name may be suffixed
+# with "+zlib" or "+lzma" to compress the payload, see `get_encoder`.
+ENCODERS: Dict[str, Encoder] = {
+    "json": convert_to_payload,
+    "json_test": convert_to_payload_test,
+}
+
+# Every binary payload starts with HEADER: magic, format version, codec id and
+# compression id, such that the cloud side knows how to decode it. Columnar
+# JSON without compression carries the version in its "v" field instead.
+MAGIC = b"GP"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBB")
+CODEC_IDS = {"columnar": 1, "binary": 2}
+COMPRESSORS: Dict[str, Tuple[int, Callable[[bytes], bytes]]] = {
+    "zlib": (1, lambda data: zlib.compress(data, 9)),
+    "lzma": (2, lambda data: lzma.compress(data, preset=6)),
+}
+DECOMPRESSORS: Dict[int, Callable[[bytes], bytes]] = {
+    0: lambda data: data,
+    1: zlib.decompress,
+    2: lzma.decompress,
+}
+
+# binary codec: thing name length, thing name, MAC length, number of rows,
+# then for each row: MAC, flags (bit 0 isPhysical, bit 1 isWifi), captureTime
+# in ms since epoch, rssi and channel.
+BINARY_PREFIX = struct.Struct("<H")
+BINARY_COUNTS = struct.Struct("<BI")
+MAC_LEN = 6  # raw MAC address
+HASHED_MAC_LEN = 32  # blake2b digest of a hashed MAC address
+
+
+def register_encoder(name: str) -> Callable[[Encoder], Encoder]:
+    """ Decorator registering an encoder under `name` """
+
+    def decorator(encoder: Encoder) -> Encoder:
+        ENCODERS[name] = encoder
+        return encoder
+
+    return decorator
+
+
+def get_encoder(name: str) -> Encoder:
+    """
+    Look up a payload encoder by name, e.g. "json", "binary" or
+    "columnar+zlib". A "+zlib" or "+lzma" suffix compresses the output of the
+    named encoder and prefixes it with HEADER.
+
+    Args:
+        name:   Name of the encoder.
+    Returns:
+        The encoder.
+    Raises:
+        ValueError if no such encoder or compression is registered, or if the
+        encoder cannot be compressed, e.g. "json+zlib".
+    """
+    base, _, compression = name.partition("+")
+    if base not in ENCODERS:
+        raise ValueError(f"Unknown payload encoding {name!r}")
+    encoder = ENCODERS[base]
+    if not compression:
+        return encoder
+    if compression not in COMPRESSORS:
+        raise ValueError(f"Unknown compression in payload encoding {name!r}")
+    if base not in CODEC_IDS:
+        raise ValueError(
+            f"Payload encoding {name!r} cannot be compressed, only "
+            f"{', '.join(CODEC_IDS)} can"
+        )
+    compression_id, compress = COMPRESSORS[compression]
+
+    def compressed(rows: List[Tuple[Any, ...]], THINGNAME: str) -> bytes:
+        # the codec is told by the body, as the binary encoder falls back to
+        # columnar for some batches
+        body = encoder(rows, THINGNAME)
+        if isinstance(body, str):
+            codec_id = CODEC_IDS["columnar"]
+            body = body.encode("utf-8")
+        else:  # binary codec, header added below
+            codec_id = CODEC_IDS["binary"]
+            body = body[HEADER.size :]
+        return HEADER.pack(
+            MAGIC, FORMAT_VERSION, codec_id, compression_id
+        ) + compress(body)
+
+    return compressed
+
+
+@register_encoder("columnar")
+def encode_columnar(rows: List[Tuple[Any, ...]], THINGNAME: str) -> str:
+    """
+    JSON payload with one array per field instead of one object per row, so
+    that keys are not repeated on every row.
+    """
+    return json.dumps(
+        {
+            "v": FORMAT_VERSION,
+            "thingName": THINGNAME,
+            "macAddressHash": [mac_to_str(r[0]) for r in rows],
+            "isPhysical": [r[1] for r in rows],
+            "isWifi": [r[2] for r in rows],
+            "captureTime": [to_epoch_ms(r[3]) for r in rows],
+            "rssi": [r[4] for r in rows],
+            "channel": [r[5] for r in rows],
+        },
+        separators=(",", ":"),
+    )
+
+
+def _mac_len(mac_address: Union[str, int]) -> int:
+    if isinstance(mac_address, str) and ":" not in mac_address:
+        return HASHED_MAC_LEN
+    return MAC_LEN
+
+
+def _mac_to_bytes(mac_address: Union[str, int]) -> bytes:
+    if isinstance(mac_address, int):
+        return mac_address.to_bytes(MAC_LEN, "big")
+    return bytes.fromhex(mac_address.replace(":", ""))
+
+
+@register_encoder("binary")
+def encode_binary(
+    rows: List[Tuple[Any, ...]], THINGNAME: str
+) -> Union[str, bytes]:
+    """
+    Packed binary payload, see BINARY_PREFIX and BINARY_COUNTS. MAC addresses
+    have a single width per payload, so a batch mixing raw and hashed MAC
+    addresses, e.g. rows stored before and after HASH_MAC is changed, is
+    encoded as columnar JSON instead.
+    """
+    mac_lens = {_mac_len(r[0]) for r in rows}
+    if len(mac_lens) > 1:
+        return encode_columnar(rows, THINGNAME)
+    mac_len = mac_lens.pop() if mac_lens else MAC_LEN
+    row_struct = struct.Struct(f"<{mac_len}sBqbB")
+    name = THINGNAME.encode("utf-8")
+    parts = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, CODEC_IDS["binary"], 0),
+        BINARY_PREFIX.pack(len(name)),
+        name,
+        BINARY_COUNTS.pack(mac_len, len(rows)),
+    ]
+    pack = row_struct.pack
+    for r in rows:
+        parts.append(
+            pack(
+                _mac_to_bytes(r[0]),
+                r[1] | r[2] << 1,
+                to_epoch_ms(r[3]),
+                r[4],
+                r[5],
+            )
+        )
+    return b"".join(parts)
+
+
+def decode_payload(
+    payload: Union[str, bytes]
+) -> Tuple[str, List[Tuple[Any, ...]]]:
+    """
+    Decode a payload produced by the columnar or binary encoders, compressed
+    or not. This is what the cloud side does, and is used for verification.
+
+    Args:
+        payload:    The payload.
+    Returns:
+        The thing name and the list of rows, with MAC addresses as strings.
+    Raises:
+        ValueError if the payload is not in a known format.
+    """
+    if isinstance(payload, str) or payload[:2] != MAGIC:
+        doc = json.loads(payload)
+        columns = [
+            doc["macAddressHash"],
+            doc["isPhysical"],
+            doc["isWifi"],
+            doc["captureTime"],
+            doc["rssi"],
+            doc["channel"],
+        ]
+        return doc["thingName"], list(zip(*columns))
+    _, version, codec_id, compression_id = HEADER.unpack_from(payload)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unknown payload format version {version}")
+    if compression_id not in DECOMPRESSORS:
+        raise ValueError(f"Unknown payload compression {compression_id}")
+    body = DECOMPRESSORS[compression_id](payload[HEADER.size :])
+    if codec_id == CODEC_IDS["columnar"]:
+        return decode_payload(body.decode("utf-8"))
+    if codec_id != CODEC_IDS["binary"]:
+        raise ValueError(f"Unknown payload codec {codec_id}")
+    (name_len,) = BINARY_PREFIX.unpack_from(body)
+    offset = BINARY_PREFIX.size
+    name = body[offset : offset + name_len].decode("utf-8")
+    offset += name_len
+    mac_len, _ = BINARY_COUNTS.unpack_from(body, offset)
+    offset += BINARY_COUNTS.size
+    rows = []
+    for mac, flags, capture_time, rssi, channel in struct.iter_unpack(
+        f"<{mac_len}sBqbB", body[offset:]
+    ):
+        rows.append(
+            (
+                mac.hex()
+                if mac_len == HASHED_MAC_LEN
+                else int_to_mac(int.from_bytes(mac, "big")),
+                bool(flags & 1),
+                bool(flags & 2),
+                capture_time,
+                rssi,
+                channel,
+            )
+        )
+    return name, rows
@@ -0,0 +1,178 @@
+import struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from line_reader import readable
+from utility import MacAddress
+
+
+# pcap global header: magic, version major and minor, thiszone, sigfigs,
+# snaplen, linktype. Record header: seconds, fraction of a second, captured
+# length, original length.
+GLOBAL_HEADER_LEN = 24
+RECORD_HEADER_LEN = 16
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+# magic as read little endian -> (byte order, fractions of a second per ms)
+PCAP_MAGIC = {
+    0xA1B2C3D4: ("<", 1000),
+    0xD4C3B2A1: (">", 1000),
+    0xA1B23C4D: ("<", 1000000),  # nanosecond resolution
+    0x4D3CB2A1: (">", 1000000),
+}
+MAX_RECORD_LEN = 262144
+
+# radiotap fields before dBm antenna signal (bit 5): (alignment, size)
+RADIOTAP_FIELDS = [(8, 8), (1, 1), (1, 1), (2, 4), (1, 2), (1, 1)]
+RADIOTAP_CHANNEL = 3
+RADIOTAP_DBM_ANTSIGNAL = 5
+RADIOTAP_EXT = 0x80000000
+PROBE_REQUEST = 0x40  # first byte of frame control: type 0, subtype 4
+
+RADIOTAP_HEADER = struct.Struct("<HI")  # it_len, first present word
+HEX = ["%02x" % i for i in range(256)]
+
+# Struct unpacking (frequency, dBm antenna signal) for each radiotap layout
+# seen, by first present word, and by (first present word, number of present
+# words) if there are several. False if the layout lacks either field.
+_layouts: Dict[Any, Union[struct.Struct, bool]] = {}
+
+
+def iter_pcap_records(
+    stream, block_size: int = 65536, timeout: Optional[float] = None
+) -> Iterator[List[Tuple[int, bytes]]]:
+    """
+    Read a pcap stream, e.g. the output of `tcpdump -U -w -`, in large blocks
+    and split each block into records in bulk. A record cut at the end of a
+    block is completed with the next block.
+
+    Args:
+        stream:         A buffered binary stream, e.g. stdout of a `Popen`
+                        object, or a pcap file opened in binary mode.
+        block_size:     Maximum number of bytes read per call.
+        timeout:        Max number of seconds to wait for data. An empty
+                        batch is yielded then. None to wait forever.
+    Yields:
+        A list of (captureTime, frame) tuples, captureTime being in
+        milliseconds since epoch, and frame the radiotap header followed by
+        the 802.11 frame.
+    Raises:
+        ValueError if the stream is not a radiotap pcap, or is corrupted.
+    """
+    buf = b""
+    while len(buf) < GLOBAL_HEADER_LEN:
+        if not readable(stream, timeout):
+            yield []
+            continue
+        block = stream.read1(block_size)
+        if not block:
+            return
+        buf += block
+    (magic,) = struct.unpack_from("<I", buf)
+    if magic not in PCAP_MAGIC:
+        raise ValueError(f"Not a pcap stream, magic {magic:#x}")
+    order, per_ms = PCAP_MAGIC[magic]
+    (linktype,) = struct.unpack_from(order + "I", buf, 20)
+    if linktype != LINKTYPE_IEEE802_11_RADIOTAP:
+        raise ValueError(f"Link type {linktype} is not radiotap")
+    record_header = struct.Struct(order + "IIII")
+    offset = GLOBAL_HEADER_LEN
+    while True:
+        records: List[Tuple[int, bytes]] = []
+        end = len(buf)
+        while offset + RECORD_HEADER_LEN <= end:
+            sec, frac, incl_len, _ = record_header.unpack_from(buf, offset)
+            if incl_len > MAX_RECORD_LEN:
+                raise ValueError(f"Corrupted pcap record of {incl_len} bytes")
+            start = offset + RECORD_HEADER_LEN
+            if start + incl_len > end:
+                break
+            records.append(
+                (sec * 1000 + frac // per_ms, buf[start : start + incl_len])
+            )
+            offset = start + incl_len
+        if records:
+            yield records
+        if not readable(stream, timeout):
+            yield []
+            continue
+        block = stream.read1(block_size)
+        if not block:
+            break
+        buf = buf[offset:] + block
+        offset = 0
+
+
+def _layout(frame: bytes, present: int) -> Union[struct.Struct, bool]:
+    """
+    Work out where the channel and dBm antenna signal fields of a radiotap
+    header are, which depends on the fields present before them, and cache a
+    Struct unpacking both. False if either field is missing.
+    """
+    first, words = present, 1
+    while present & RADIOTAP_EXT:
+        (present,) = struct.unpack_from("<I", frame, 4 + 4 * words)
+        words += 1
+    key = first if words == 1 else (first, words)
+    if key not in _layouts:
+        if not (first >> RADIOTAP_CHANNEL & 1) or not (
+            first >> RADIOTAP_DBM_ANTSIGNAL & 1
+        ):
+            _layouts[key] = False
+        else:
+            offset = 4 + 4 * words
+            offsets = {}
+            for bit, (align, size) in enumerate(RADIOTAP_FIELDS):
+                if first >> bit & 1:
+                    offset += -offset % align
+                    offsets[bit] = offset
+                    offset += size
+            chan, signal = (
+                offsets[RADIOTAP_CHANNEL],
+                offsets[RADIOTAP_DBM_ANTSIGNAL],
+            )
+            _layouts[key] = struct.Struct(f"<{chan}xH{signal - chan - 2}xb")
+    return _layouts[key]
+
+
+def frequency_to_channel(freq: int) -> int:
+    """ Convert a channel frequency in MHz into an IEEE 802.11 channel """
+    if freq == 2484:
+        return 14
+    if freq < 2484:
+        return (freq - 2407) // 5
+    return (freq - 5000) // 5
+
+
+def parse_radiotap_probe(
+    frame: bytes, mac_as_int: bool = False
+) -> Optional[Tuple[int, int, MacAddress]]:
+    """
+    Extract channel, rssi and source MAC address from a captured probe
+    request, i.e. a radiotap header followed by an 802.11 frame.
+
+    Args:
+        frame:          A frame from `iter_pcap_records`.
+        mac_as_int:     Produce mac_address as a 48-bit int instead of str.
+    Returns:
+        A tuple (channel, rssi, mac_address) if the frame is a probe request
+        carrying channel and signal strength, otherwise None. The channel
+        comes from the frequency the frame is received on.
+    Raises:
+        None
+    """
+    try:
+        it_len, present = RADIOTAP_HEADER.unpack_from(frame, 2)
+        layout = _layouts.get(present)
+        if layout is None:  # new layout, or several present words
+            layout = _layout(frame, present)
+        if not layout or frame[it_len] != PROBE_REQUEST:
+            return None
+        freq, rssi = layout.unpack_from(frame)
+        sa = frame[it_len + 10 : it_len + 16]
+        if len(sa) != 6:
+            return None
+    except (struct.error, IndexError):
+        return None
+    if mac_as_int:
+        mac_address: MacAddress = int.from_bytes(sa, "big")
+    else:
+        mac_address = ":".join([HEX[b] for b in sa])
+    return frequency_to_channel(freq), rssi, mac_address
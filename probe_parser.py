@@ -0,0 +1,107 @@
+import re
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from utility import MacAddress
+
+
+# Pattern collect_data used to compile on every line. The greedy `.+` means it
+# picks the LAST "-XXdBm" before the LAST valid "SA:" address. It is slow
+# because it backtracks from the end of the line, so it is only used as a
+# fallback for lines the fast pattern does not cover.
+PROBE_PATTERN = re.compile(
+    rb"(\d{4}-\d{2}-\d{2}\s\d{2}\:\d{2}\:\d{2}\.\d{3}).+(-\d+)dBm.+SA((\:[0-9a-f]{2}){6})"
+)
+
+# Fast pattern for the common tcpdump line, which carries exactly one "dBm"
+# field. It scans forward to the signal strength without backtracking.
+FAST_PROBE_PATTERN = re.compile(
+    rb"(\d{4}-\d\d-\d\d\s\d\d:\d\d:\d\d\.\d{3})[^-]*(-\d+)dBm.*SA:((?:[0-9a-f]{2}:){5}[0-9a-f]{2})"
+)
+_MAX_CHANNEL_LINE = 8
+
+# epoch milliseconds of each "%Y-%m-%d %H:%M:%S" prefix seen recently. All
+# lines captured within the same second share the prefix.
+_second_cache: Dict[bytes, int] = {}
+_SECOND_CACHE_SIZE = 256
+
+
+def capture_time_to_ms(capture_time: bytes) -> int:
+    """
+    Convert a local time as printed by `tcpdump -tttt`, truncated to
+    milliseconds, into milliseconds since epoch. Only the millisecond part
+    is converted for each call; the per-second prefix is cached.
+
+    Args:
+        capture_time:   Local time such as b"2019-10-24 13:45:01.123"
+    Returns:
+        Milliseconds since epoch.
+    Raises:
+        ValueError if capture_time is not in the expected format.
+    """
+    prefix = capture_time[:19]
+    base = _second_cache.get(prefix)
+    if base is None:
+        if len(_second_cache) >= _SECOND_CACHE_SIZE:
+            _second_cache.clear()
+        base = _second_cache[prefix] = int(
+            datetime.strptime(
+                prefix.decode("ascii"), "%Y-%m-%d %H:%M:%S"
+            ).timestamp()
+            * 1000
+        )
+    return base + int(capture_time[20:23])
+
+
+def parse_channel(line: bytes) -> Optional[int]:
+    """
+    Parse a channel switch line echoed by `channel_hop` in sniff-probes.sh.
+
+    Args:
+        line:   A raw line read from the probing process.
+    Returns:
+        The new channel as an int if `line` only contains digits, otherwise
+        None.
+    Raises:
+        None
+    """
+    if len(line) > _MAX_CHANNEL_LINE:  # cheap reject for probe request lines
+        return None
+    stripped = line.strip()
+    if stripped.isdigit():
+        return int(stripped)
+    return None
+
+
+def parse_probe(
+    line: bytes, mac_as_int: bool = False
+) -> Optional[Tuple[int, int, MacAddress]]:
+    """
+    Extract captureTime, rssi and source MAC address from a raw line of
+    tcpdump output (`tcpdump -tttt -e`) without decoding the whole line.
+    Results are identical to matching PROBE_PATTERN against the line.
+
+    Args:
+        line:           A raw line read from the probing process.
+        mac_as_int:     Produce mac_address as a 48-bit int instead of str.
+    Returns:
+        A tuple (captureTime, rssi, mac_address) if the line is a probe
+        request, otherwise None. captureTime is in milliseconds since epoch.
+    Raises:
+        None
+    """
+    m = FAST_PROBE_PATTERN.match(line) if line.count(b"dBm") == 1 else None
+    if m is not None:
+        capture_time, rssi, mac_address = m.groups()
+    else:
+        m = PROBE_PATTERN.match(line)
+        if m is None:
+            return None
+        capture_time, rssi, mac_address = m.group(1, 2, 3)
+        mac_address = mac_address[1:]  # drop the leading ":"
+    return (
+        capture_time_to_ms(capture_time),
+        int(rssi),
+        int(mac_address.translate(None, b":"), 16)
+        if mac_as_int
+        else mac_address.decode("ascii"),
+    )
@@ -1,6 +1,6 @@
 #!/bin/bash
 
-# channel hop every 0.5 seconds
+# channel hop over CHANNELS every CHANNEL_DUR seconds
 channel_hop() {
   IEEE80211bg="1 2 3 4 5 6 7 8 9 10 11"
   IEEE80211bg_intl="$IEEE80211b 12 13 14"
@@ -9,8 +9,10 @@ channel_hop() {
   IEEE80211bga_intl="$IEEE80211bg_intl $IEEE80211a"
 
   while true ; do
-    for CHAN in $IEEE80211bg ; do
-      echo $CHAN
+    for CHAN in $CHANNELS ; do
+      if [[ $PCAP != "true" ]]; then  # stdout carries pcap data otherwise
+        echo $CHAN
+      fi
       # echo "switching $IFACE to channel $CHAN"
       sudo iwconfig $IFACE channel $CHAN
       sleep $CHANNEL_DUR
@@ -31,7 +33,13 @@ main() {
   fi
 
   # No filtering for the output
-  if [[ $OUTPUT == "" ]]; then
+  if [[ $PCAP == "true" ]]; then  # raw radiotap frames, flushed per packet
+    if [[ $OUTPUT == "" ]]; then
+      sudo tcpdump -U -w - -I -i "$IFACE" -s 256 type mgt subtype probe-req
+    else
+      sudo tcpdump -U -w - -I -i "$IFACE" -s 256 type mgt subtype probe-req | tee "$OUTPUT"
+    fi
+  elif [[ $OUTPUT == "" ]]; then
     sudo tcpdump -tttt -l -I -i "$IFACE" -e -s 256 type mgt subtype probe-req
   else  # only produce output file if user explicitly specifies so.
     sudo tcpdump -tttt -l -I -i "$IFACE" -e -s 256 type mgt subtype probe-req | tee -a "$OUTPUT"
@@ -48,16 +56,20 @@ cleanup() {
 
 # DEFAULTS
 CHANNEL_HOP="false"
+PCAP="false"
 OUTPUT=""
 IFACE=""
 CHANNEL_DUR="0.5"
+CHANNELS="1 2 3 4 5 6 7 8 9 10 11"
 
 print_usage() {
-  printf "%s\n" "Usage: sniff-probes.sh [--channel_hop] [-i wifi_interface] [-o output_file] [-d channel_duration]"
+  printf "%s\n" "Usage: sniff-probes.sh [--channel_hop] [--pcap] [-i wifi_interface] [-o output_file] [-d channel_duration] [-c channels]"
   printf "%s\t%s\n" "--channel_hop" "Enable channel hop while monitoring. Default: false"
+  printf "%s\t\t%s\n" "--pcap" "Write raw pcap to stdout instead of text. Default: false"
   printf "%s\t\t%s\n" "-i" "WiFi device interface in monitor mode. Required." \
     "-o" "Output file name. Default: no file output" \
-    "-d" "Time to spend on each channel in channel hop, in seconds. Default: 0.5"
+    "-d" "Time to spend on each channel in channel hop, in seconds. Default: 0.5" \
+    "-c" "Comma separated channels to hop through, e.g. 1,6,11. Default: 1 to 11"
 }
 
 # Parse options and flags
@@ -67,6 +79,10 @@ while [[ "$#" -gt 0 ]]; do
       CHANNEL_HOP="true"
       shift 1
       ;;
+    --pcap)  # write pcap instead of text, without channel lines
+      PCAP="true"
+      shift 1
+      ;;
     -i)  # wifi device interface that is in monitor mode
       if [[ "$2" != "" ]]; then
         IFACE="$2"
@@ -97,6 +113,16 @@ while [[ "$#" -gt 0 ]]; do
       fi
       shift 1
       ;;
+    -c)  # channels to hop through
+      if [[ "$2" =~ ^[0-9]+(,[0-9]+)*$ ]]; then
+        CHANNELS="${2//,/ }"
+        shift 1
+      else # -c must be followed by a comma separated list of channels
+        print_usage
+        exit 1
+      fi
+      shift 1
+      ;;
     *) # unsupported flags
       print_usage
       exit 1
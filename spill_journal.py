@@ -0,0 +1,386 @@
+import os
+import pickle
+import struct
+import zlib
+from time import perf_counter
+import metrics
+from log_setup import get_logger
+from typing import Any, List, Optional, Tuple
+
+
+logger = get_logger("db")
+
+# each record: length and crc32 of the pickled rows, number of rows, then the
+# pickled rows. The number of rows lets `count_rows` skip the pickled rows.
+RECORD_HEADER = struct.Struct("<III")
+SEGMENT_SUFFIX = ".seg"
+OFFSET_FILE = "read_offset"
+
+
+class SpillJournal:
+    """
+    Append-only local store, an alternative to SQLiteDB with the same
+    interface. Rows are appended as length-prefixed, checksummed records to
+    numbered segment files under JOURNAL_DIR. A new segment is started when
+    the current one exceeds SEGMENT_BYTES. All records appended in one
+    `store_rows` call are synced with a single fsync.
+
+    Rows are read back sequentially from a read position (segment, byte
+    offset, rows already consumed in the record at that offset), persisted in
+    OFFSET_FILE after every fetch. A segment is deleted as a whole once the
+    read position moves past it, so data is written once and never rewritten.
+    As with SQLiteDB, fetched rows are gone from local storage.
+
+    With mode "a" (append only) and "r" (read only), one process can append
+    to a journal while another one reads it. The reader then considers the
+    latest segment as the one being appended to.
+    """
+
+    def __init__(self, STORE_CONFIG, mode: str = "rw"):
+        self.JOURNAL_DIR = STORE_CONFIG["JOURNAL_DIR"]
+        self.SEGMENT_BYTES = int(STORE_CONFIG["SEGMENT_BYTES"])
+        self.RECORD_ROWS = int(STORE_CONFIG["RECORD_ROWS"])
+        self.FSYNC = STORE_CONFIG.getboolean("FSYNC")
+        self.OFFSET_PATH = os.path.join(self.JOURNAL_DIR, OFFSET_FILE)
+        self.mode = mode
+        self.opened = False
+        self.writer = None  # file object of the segment being appended to
+        self.write_seg = 0
+        self.reader = None  # file object of the segment being read
+        self.read_pos: Tuple[int, int, int] = (0, 0, 0)
+        self.initialize()
+
+    def initialize(self) -> bool:
+        """
+        Open the journal: restore the read position, depending on the mode.
+        A new segment is started by the first append, see `append_records`.
+
+        Return:
+            True if the journal is opened. Otherwise, False
+        """
+        try:
+            os.makedirs(self.JOURNAL_DIR, exist_ok=True)
+            segments = self.segments()
+            if "r" in self.mode:
+                self.read_pos = self.load_read_pos(segments)
+            self.opened = True
+            logger.info(
+                f"Journal opened, {len(segments)} segments left to read."
+            )
+            return True
+        except (OSError, ValueError):
+            logger.exception("Error! Cannot open journal.")
+            self.close_connection()
+            return False
+
+    def segment_path(self, seg: int) -> str:
+        return os.path.join(self.JOURNAL_DIR, f"{seg:010d}{SEGMENT_SUFFIX}")
+
+    def segments(self) -> List[int]:
+        """ Numbers of all segment files, in order """
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.JOURNAL_DIR)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def sync_dir(self) -> None:
+        """ Make creation and deletion of files in JOURNAL_DIR durable """
+        if self.FSYNC:
+            fd = os.open(self.JOURNAL_DIR, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def load_read_pos(self, segments: List[int]) -> Tuple[int, int, int]:
+        """ Restore the persisted read position, or start from the oldest """
+        first = segments[0] if segments else 0
+        try:
+            with open(self.OFFSET_PATH, "r") as f:
+                seg, offset, skip = (int(v) for v in f.read().split())
+        except FileNotFoundError:
+            return (first, 0, 0)
+        if seg < first:  # segment already deleted
+            return (first, 0, 0)
+        return (seg, offset, skip)
+
+    def save_read_pos(self) -> None:
+        """ Persist the read position atomically """
+        tmp_path = self.OFFSET_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(" ".join(str(v) for v in self.read_pos))
+            if self.FSYNC:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.OFFSET_PATH)
+
+    def close_connection(self) -> None:
+        """
+        Close the journal. In mode "rw", if every row has been read, all
+        segments and the read position are removed, so that the journal
+        starts afresh.
+        """
+        try:
+            drained = self.mode == "rw" and self.read_pos == self.end_pos()
+            for f in (self.writer, self.reader):
+                if f is not None:
+                    f.close()
+            self.writer = self.reader = None
+            self.opened = False
+            if drained:
+                for seg in self.segments():
+                    os.remove(self.segment_path(seg))
+                if os.path.exists(self.OFFSET_PATH):
+                    os.remove(self.OFFSET_PATH)
+            logger.info("Journal successfully closed.")
+        except OSError:
+            logger.exception("Error! Cannot close journal.")
+
+    def is_connected(self) -> bool:
+        """ Return True if the journal is open, otherwise False """
+        return self.opened
+
+    def end_pos(self) -> Tuple[int, int, int]:
+        """ Read position once every row has been read """
+        if self.writer is not None:
+            return (self.write_seg, self.writer.tell(), 0)
+        segments = self.segments()
+        if not segments:
+            return self.read_pos
+        last = segments[-1]
+        return (last, os.path.getsize(self.segment_path(last)), 0)
+
+    def last_segment(self) -> int:
+        """ Number of the segment being appended to """
+        if self.writer is not None:
+            return self.write_seg
+        segments = self.segments()
+        return segments[-1] if segments else 0
+
+    def append_records(self, rows: List[Tuple[Any, ...]]) -> None:
+        """
+        Append rows as records of at most RECORD_ROWS rows, then flush and
+        sync them once. A new segment is started beforehand on the first
+        append since the journal was opened, or if the current one is full.
+        Appending to a new segment means a record torn by a crash can only be
+        at the end of a segment no longer written to.
+        """
+        if self.writer is None:
+            segments = self.segments()
+            self.write_seg = segments[-1] + 1 if segments else 1
+            self.writer = open(self.segment_path(self.write_seg), "ab")
+            self.sync_dir()
+        elif self.writer.tell() >= self.SEGMENT_BYTES:
+            self.writer.close()
+            self.write_seg += 1
+            self.writer = open(self.segment_path(self.write_seg), "ab")
+            self.sync_dir()
+        for i in range(0, len(rows), self.RECORD_ROWS):
+            record = rows[i : i + self.RECORD_ROWS]
+            data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            self.writer.write(
+                RECORD_HEADER.pack(len(data), zlib.crc32(data), len(record))
+            )
+            self.writer.write(data)
+        self.writer.flush()
+        if self.FSYNC:
+            os.fsync(self.writer.fileno())
+
+    def read_record(
+        self,
+    ) -> Optional[Tuple[Tuple[int, int, int], List[Tuple[Any, ...]]]]:
+        """
+        Read the record at the read position and move the read position past
+        it. At the end of a segment no longer written to, move on to the next
+        segment and delete the one read. A truncated or corrupted record ends
+        its segment.
+
+        Returns:
+            The position of the record and its rows not consumed yet, or None
+            if there is nothing left to read.
+        """
+        while True:
+            seg, offset, skip = self.read_pos
+            if self.reader is None or self.reader.name != self.segment_path(
+                seg
+            ):
+                if self.reader is not None:
+                    self.reader.close()
+                    self.reader = None
+                if not os.path.exists(self.segment_path(seg)):
+                    later = [s for s in self.segments() if s > seg]
+                    if not later:
+                        return None
+                    self.read_pos = (later[0], 0, 0)
+                    continue
+                self.reader = open(self.segment_path(seg), "rb")
+            self.reader.seek(offset)
+            header = self.reader.read(RECORD_HEADER.size)
+            if len(header) == RECORD_HEADER.size:
+                length, crc, _ = RECORD_HEADER.unpack(header)
+                data = self.reader.read(length)
+                if len(data) == length and zlib.crc32(data) == crc:
+                    self.read_pos = (seg, self.reader.tell(), 0)
+                    return (seg, offset, skip), pickle.loads(data)[skip:]
+            # end of segment, or a record not completely written yet
+            if seg >= self.last_segment():  # caught up with the writer
+                return None
+            if header:
+                logger.error(
+                    f"Corrupted record in journal segment {seg} at "
+                    f"{offset}. Skip rest of segment."
+                )
+            self.reader.close()
+            self.reader = None
+            os.remove(self.segment_path(seg))
+            self.read_pos = (seg + 1, 0, 0)
+
+    def count_rows(self) -> int:
+        """
+        Number of rows left to read, e.g. by a previous run, without moving
+        the read position. Only record headers are read, so that counting a
+        large backlog is cheap. A truncated record ends the count of its
+        segment, as in `read_record`. A record whose pickled rows are
+        corrupted is counted, although `read_record` skips it.
+
+        Returns:
+            The number of rows. 0 if the journal cannot be read.
+        Raises:
+            None
+        """
+        seg, offset, skip = self.read_pos
+        count = -skip
+        try:
+            for s in self.segments():
+                if s < seg:
+                    continue
+                with open(self.segment_path(s), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    pos = offset if s == seg else 0
+                    while pos + RECORD_HEADER.size <= size:
+                        f.seek(pos)
+                        length, _, num_rows = RECORD_HEADER.unpack(
+                            f.read(RECORD_HEADER.size)
+                        )
+                        pos += RECORD_HEADER.size + length
+                        if pos > size:
+                            break
+                        count += num_rows
+        except OSError:
+            logger.exception("Error! Cannot count rows in journal.")
+            return 0
+        return max(count, 0)
+
+    def fetch_rows_all_col(
+        self, num_rows: int
+    ) -> List[Tuple[str, bool, bool, str, int, int]]:
+        """
+        Extract the next {num_rows} rows from the journal (read and advance
+        the persisted read position)
+        Args:
+            num_rows:       Number of rows to be fetched
+        Return:
+            A list of tuples with each tuple representing a row of data.
+        Raises:
+            None
+        """
+        rows: List[Tuple[str, bool, bool, str, int, int]] = []
+        start = perf_counter()
+        try:
+            while len(rows) < num_rows:
+                record = self.read_record()
+                if record is None:
+                    break
+                (seg, offset, skip), record_rows = record
+                take = num_rows - len(rows)
+                rows.extend(record_rows[:take])
+                if len(record_rows) > take:
+                    # come back to this record, skipping the rows fetched
+                    self.read_pos = (seg, offset, skip + take)
+            self.save_read_pos()
+        except (OSError, pickle.UnpicklingError):
+            logger.exception("Error! Cannot read rows from journal.")
+        metrics.histogram(
+            "local_store_fetch_seconds", "Time to fetch rows from local store"
+        ).observe(perf_counter() - start)
+        metrics.counter(
+            "local_store_rows_fetched_total", "Rows fetched from local store"
+        ).inc(len(rows))
+        logger.info(f"Fetched {len(rows)} rows")
+        return rows
+
+    def store_rows(self, rows: List[Tuple[str, bool, bool, str, int, int]]):
+        """
+        Put rows in the journal for stable storage, opening it if necessary.
+        `rows` is left intact, such that it can be put back where it came
+        from if storing fails.
+
+        Args:
+            rows:       A list of rows to be stored.
+        Returns:
+            False if some error occurs while appending, otherwise True.
+        Raises:
+            None
+        """
+        if not self.is_connected() and not self.initialize():
+            return False
+        try:
+            start = perf_counter()
+            self.append_records(rows)
+            metrics.histogram(
+                "local_store_insert_seconds",
+                "Time to insert rows in local store",
+            ).observe(perf_counter() - start)
+            metrics.counter(
+                "local_store_rows_inserted_total",
+                "Rows inserted in local store",
+            ).inc(len(rows))
+            logger.info(f"Successfully appended {len(rows)} rows to journal.")
+            return True
+        except OSError:
+            logger.exception("Error! Cannot append rows to journal.")
+            return False
+
+    def push_to_queue(self, data_q, num_rows: int):
+        """
+        Extract {num_rows} rows from the journal and put them as one batch in
+        a queue.
+
+        Args:
+            data_q:         A BatchQueue into which the rows are to be pushed
+            num_rows:       Number of rows to extract and put in queue
+        Returns:
+            True if some rows are pushed, False if no row is pushed, i.e. the
+            journal is empty.
+        Raises:
+            None
+        """
+        row_pushed: bool = True  # flag
+        if self.is_connected():
+            rows = self.fetch_rows_all_col(num_rows)
+            if not rows:
+                row_pushed = False
+            data_q.put_batch(rows)
+        return row_pushed
+
+    def extract_from_queue(self, data_q):
+        """
+        Extract all data rows from data_q and append them to the journal. If
+        that fails, put the data back into data_q.
+
+        Args:
+            data_q:     A BatchQueue from which rows are extracted.
+        Returns:
+            False if some error occurs while appending, otherwise True.
+        Raises:
+            None
+        """
+        rows = data_q.get_all()
+        insert_success = self.store_rows(rows)
+        if not insert_success:
+            logger.info(
+                "Append data to journal failed. Put back into data queue"
+            )
+            data_q.requeue(rows)  # put the unsent data back
+        return insert_success
@@ -0,0 +1,82 @@
+from multiprocessing import Event, Process
+from time import monotonic
+from collect_data import collect_data
+from log_setup import get_logger
+
+
+logger = get_logger("main")
+
+RESTART_GAP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class RestartBackoff:
+    """
+    Delay before restarting the processes of a radio after a failure. The
+    first failure restarts them immediately. Each further failure within
+    STABLE_AFTER seconds of the last restart waits RESTART_BACKOFF_MIN
+    seconds, doubled every time up to RESTART_BACKOFF_MAX, such that a radio
+    failing over and over does not spin.
+    """
+
+    def __init__(self, HEALTH_CHECK_CONFIG):
+        self.RESTART_BACKOFF_MIN = float(
+            HEALTH_CHECK_CONFIG["RESTART_BACKOFF_MIN"]
+        )
+        self.RESTART_BACKOFF_MAX = float(
+            HEALTH_CHECK_CONFIG["RESTART_BACKOFF_MAX"]
+        )
+        self.STABLE_AFTER = float(HEALTH_CHECK_CONFIG["STABLE_AFTER"])
+        self.failures = 0  # in a row, each within STABLE_AFTER of the last
+        self.started_at = monotonic()
+
+    def started(self) -> None:
+        """ Note that the processes are (re)started """
+        self.started_at = monotonic()
+
+    def next_delay(self) -> float:
+        """ Count a failure, and return the seconds to wait to restart """
+        if monotonic() - self.started_at >= self.STABLE_AFTER:
+            self.failures = 0
+        self.failures += 1
+        if self.failures == 1:
+            return 0.0
+        return min(
+            self.RESTART_BACKOFF_MIN * 2 ** (self.failures - 2),
+            self.RESTART_BACKOFF_MAX,
+        )
+
+
+def wait_then_collect(go, *args) -> None:
+    """ Run `collect_data` with `args` once `go` is set """
+    go.wait()
+    collect_data(*args)
+
+
+class StandbyCollector:
+    """
+    A data collection process forked ahead of time, idle until it takes over
+    from the data collection process of a radio that dies. It is forked with
+    the capture process of the radio running, so it inherits the pipe of its
+    output and reads on where the dead one stopped. A standby is only of use
+    with the capture it was forked with.
+    """
+
+    def __init__(self, name: str, *args):
+        self.name = name
+        self.go = Event()
+        self.process = Process(
+            target=wait_then_collect, args=(self.go,) + args
+        )
+        self.process.start()
+        logger.info(f"Standby {name} process successfully created!")
+
+    def take_over(self) -> Process:
+        """ Start collecting data, and return the process doing so """
+        self.go.set()
+        return self.process
+
+    def discard(self) -> None:
+        """ Terminate the standby, unless it has taken over """
+        if not self.go.is_set() and self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
@@ -1,24 +1,99 @@
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
-from time import sleep
-import logging
-import logging.config
-import yaml
-from typing import List, Tuple
+from threading import RLock
+from time import monotonic, sleep
+import metrics
+from log_setup import get_logger
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-# set up logger
-with open("logger_config.yaml", "r") as f:
-    config = yaml.safe_load(f.read())
-    logging.config.dictConfig(config)
-logger = logging.getLogger("AWSIoTPythonSDK.core")
+logger = get_logger("AWSIoTPythonSDK.core")
+
+PAYLOAD_BUCKETS = (1000, 5000, 10000, 25000, 50000, 100000, 131072)
 
 
 class UploadService:
     """ A class to handle uploading probe request data via MQTT to aws IoT.
     """
 
-    def __init__(self, AWS_IOT_CONFIG):
-        # Create, configure, and connect a MQTT client.
-        self.myAWSIoTMQTTClient = AWSIoTMQTTClient(AWS_IOT_CONFIG["CLIENT_ID"])
+    def __init__(self, AWS_IOT_CONFIG, client=None):
+        # The MQTT client is created and configured by `setup_client`, so
+        # that the SDK is only imported once data collection is running. A
+        # client offering the same interface as AWSIoTMQTTClient can be given
+        # instead, e.g. a local stand-in for benchmarks.
+        self.AWS_IOT_CONFIG = AWS_IOT_CONFIG
+        self.myAWSIoTMQTTClient = client
+
+        # Persistent param
+        self.CLIENT_ID = AWS_IOT_CONFIG["CLIENT_ID"]
+        self.TOPIC = AWS_IOT_CONFIG["TOPIC"]
+        self.BATCH_SIZE = int(AWS_IOT_CONFIG["BATCH_SIZE"])
+        self.THINGNAME = AWS_IOT_CONFIG["THINGNAME"]
+        self.PUBLISH_WINDOW = int(AWS_IOT_CONFIG["PUBLISH_WINDOW"])
+        self.ACK_TIMEOUT = int(AWS_IOT_CONFIG["ACK_TIMEOUT"])
+        self.MIN_BATCH_SIZE = int(AWS_IOT_CONFIG["MIN_BATCH_SIZE"])
+        self.MAX_BATCH_SIZE = int(AWS_IOT_CONFIG["MAX_BATCH_SIZE"])
+        self.BATCH_STEP = int(AWS_IOT_CONFIG["BATCH_STEP"])
+        self.MAX_PAYLOAD_BYTES = int(AWS_IOT_CONFIG["MAX_PAYLOAD_BYTES"])
+        self.TARGET_LATENCY = float(AWS_IOT_CONFIG["TARGET_LATENCY"])
+
+        # adaptive batching, see `make_batch` and `adjust_batch_size`. Starts
+        # at BATCH_SIZE rows, and with no estimate of the payload size per row
+        self.batch_rows = self.BATCH_SIZE
+        self.bytes_per_row = 0.0
+
+        # flags
+        self.online = False
+        self.offline = True
+
+        # pipelined publishing. Batches published with `publish_async` stay
+        # in `in_flight`, keyed by packet id, until acknowledged. The SDK
+        # invokes ack callbacks on its own thread, hence the lock.
+        self.lock = RLock()
+        self.in_flight: Dict[int, Tuple[List[Tuple[Any, ...]], float]] = {}
+        self.on_ack: Optional[Callable[[], None]] = None
+        # invoked from the MQTT client's thread when the connection is lost
+        self.on_offline: Optional[Callable[[], None]] = None
+        self.stats = {
+            "acked_batches": 0,
+            "acked_rows": 0,
+            "failed_batches": 0,
+            "ack_latency_sum": 0.0,
+            "max_in_flight": 0,
+        }
+        self.stats_since = monotonic()
+        metrics.gauge(
+            "mqtt_in_flight_batches",
+            "Batches published but not yet acknowledged",
+            lambda: len(self.in_flight),
+        )
+        metrics.gauge(
+            "mqtt_batch_rows", "Current batch size", lambda: self.batch_rows
+        )
+        self.payload_bytes = metrics.histogram(
+            "mqtt_payload_bytes", "Size of published payloads", PAYLOAD_BUCKETS
+        )
+        self.ack_seconds = metrics.histogram(
+            "mqtt_ack_seconds", "Time from publish to acknowledgement"
+        )
+        self.publish_failures = metrics.counter(
+            "mqtt_publish_failures_total",
+            "Batches not published or not acknowledged in time",
+        )
+        self.acked_rows = metrics.counter(
+            "mqtt_acked_rows_total", "Rows acknowledged by the broker"
+        )
+        self.dropped_rows = metrics.counter(
+            "mqtt_unencodable_rows_total",
+            "Rows dropped as they cannot be encoded into a payload",
+        )
+
+    def setup_client(self) -> None:
+        """ Create the MQTT client if none is given, and configure it """
+        AWS_IOT_CONFIG = self.AWS_IOT_CONFIG
+        if self.myAWSIoTMQTTClient is None:
+            from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+
+            self.myAWSIoTMQTTClient = AWSIoTMQTTClient(
+                AWS_IOT_CONFIG["CLIENT_ID"]
+            )
         self.myAWSIoTMQTTClient.configureEndpoint(
             AWS_IOT_CONFIG["ENDPOINT"], int(AWS_IOT_CONFIG["PORT"])
         )
@@ -31,21 +106,14 @@ class UploadService:
         self.myAWSIoTMQTTClient.configureAutoReconnectBackoffTime(1, 32, 20)
         self.myAWSIoTMQTTClient.configureConnectDisconnectTimeout(10)
         self.myAWSIoTMQTTClient.configureMQTTOperationTimeout(5)
+        # no offline queue in the SDK: while offline, rows wait in data_q and
+        # localDB, and a publish fails instead of being queued unacknowledged
+        self.myAWSIoTMQTTClient.configureOfflinePublishQueueing(0)
 
         # set up callbacks for online and offline situation
         self.myAWSIoTMQTTClient.onOnline = self.my_online_callback
         self.myAWSIoTMQTTClient.onOffline = self.my_offline_callback
 
-        # Persistent param
-        self.CLIENT_ID = AWS_IOT_CONFIG["CLIENT_ID"]
-        self.TOPIC = AWS_IOT_CONFIG["TOPIC"]
-        self.BATCH_SIZE = int(AWS_IOT_CONFIG["BATCH_SIZE"])
-        self.THINGNAME = AWS_IOT_CONFIG["THINGNAME"]
-
-        # flags
-        self.online = False
-        self.offline = True
-
     def make_batch(
         self, data_q
     ) -> List[Tuple[str, bool, bool, str, int, int]]:
@@ -53,57 +121,192 @@ class UploadService:
         Make a batch of rows to be sent via MQTT in one shot
 
         Args:
-            data_q:     The data queue from which we get row data to make batch
+            data_q:     The BatchQueue from which we get row data to make batch
         Returns:
             A list of tuple, representing a batch of data to be sent.
         Raises:
             None
         """
-        batch_size: int = 0
-        batch: List[Tuple[str, bool, bool, str, int, int]] = []
-        # number of rows in each batch cannot exceed BATCH_SIZE
-        while not data_q.empty() and batch_size < self.BATCH_SIZE:
-            batch.append(data_q.get())
-            batch_size += 1
-        return batch
-
-    def send_MQTT(self, data_q, convert_fun) -> bool:
+        # number of rows in each batch cannot exceed the adaptive batch size,
+        # nor the number of rows expected to fit in MAX_PAYLOAD_BYTES
+        max_rows = self.batch_rows
+        if self.bytes_per_row:
+            max_rows = min(
+                max_rows, int(self.MAX_PAYLOAD_BYTES / self.bytes_per_row)
+            )
+        return data_q.get_rows(max(max_rows, 1))
+
+    def make_payload(self, data_q, convert_fun) -> Tuple[List, Any]:
         """
-        Send a batch of rows via MQTT to aws iot. If sending fails, put the
-        unsent data back into data_q.
+        Make a batch with `make_batch` and encode it. If the payload exceeds
+        MAX_PAYLOAD_BYTES, the rows that do not fit are put back in front of
+        data_q and the rest is encoded again. If the batch cannot be encoded,
+        the rows that cannot are dropped, see `drop_unencodable`.
 
         Args:
-            data_q:     The data queue from which we get row to send via MQTT
+            data_q:         The BatchQueue from which we get row data.
+            convert_fun:    Function converting the batch into a payload.
         Returns:
-            True if data sending succeeds, otherwise False. If no data is sent
-            either due to no data present in data_q or fewer than batch size
-            number of rows in data_q, we default to return True because this is
-            not considered an error.
+            The batch and its payload. The batch is empty if data_q is empty,
+            or if none of its rows can be encoded.
         Raises:
             None
         """
         batch = self.make_batch(data_q)
-        if batch:
+        try:
+            payload = convert_fun(batch, self.THINGNAME)
+        except Exception:
+            logger.exception("Error! Cannot encode batch. Encode row by row.")
+            batch = self.drop_unencodable(batch, convert_fun)
             payload = convert_fun(batch, self.THINGNAME)
-            ret = False  # flag
+        while len(payload) > self.MAX_PAYLOAD_BYTES and len(batch) > 1:
+            keep = int(len(batch) * self.MAX_PAYLOAD_BYTES / len(payload))
+            keep = min(max(keep, 1), len(batch) - 1)
+            data_q.requeue(batch[keep:])
+            batch = batch[:keep]
+            payload = convert_fun(batch, self.THINGNAME)
+        if batch:
+            # exponentially weighted average of the payload size per row
+            size = len(payload) / len(batch)
+            self.bytes_per_row = (
+                0.8 * self.bytes_per_row + 0.2 * size
+                if self.bytes_per_row
+                else size
+            )
+        return batch, payload
+
+    def drop_unencodable(self, batch, convert_fun) -> List[Tuple[Any, ...]]:
+        """
+        Encode the rows of a batch one by one, and drop those that cannot be
+        encoded, e.g. a malformed MAC address. Such rows would fail again if
+        put back, and hold up the rows behind them.
+
+        Args:
+            batch:          A list of rows that cannot be encoded together.
+            convert_fun:    Function converting the batch into a payload.
+        Returns:
+            The rows of the batch that can be encoded, in order.
+        Raises:
+            None
+        """
+        rows = []
+        for row in batch:
             try:
-                ret = self.myAWSIoTMQTTClient.publish(self.TOPIC, payload, 1)
+                convert_fun([row], self.THINGNAME)
             except Exception as e:
-                logger.error(f"Error in sending MQTT: {e}")
-            sleep(6)  # block slightly longer than duration of time out
-            if ret:
-                logger.debug(f"Published msg:\n{payload}")
-                logger.info(
-                    f"Publish {len(batch)} rows to {self.TOPIC} successful."
+                logger.error(f"Drop row that cannot be encoded: {row!r}, {e}")
+                continue
+            rows.append(row)
+        self.dropped_rows.inc(len(batch) - len(rows))
+        return rows
+
+    def adjust_batch_size(self, grow: bool, reason: str) -> None:
+        """
+        Additive increase, multiplicative decrease of the batch size, as in
+        TCP congestion control: grow by BATCH_STEP rows after a full batch is
+        acknowledged quickly, halve after a slow acknowledgement or a failure.
+
+        Args:
+            grow:   Whether to grow or to shrink the batch size.
+            reason: What triggers the adjustment, for logging.
+        Returns:
+            None
+        Raises:
+            None
+        """
+        with self.lock:
+            old = self.batch_rows
+            if grow:
+                new = min(old + self.BATCH_STEP, self.MAX_BATCH_SIZE)
+            else:
+                new = max(old // 2, self.MIN_BATCH_SIZE)
+            self.batch_rows = new
+        if new != old:
+            logger.info(f"Batch size {old} -> {new} rows ({reason})")
+
+    def publish_async(self, batch, payload) -> bool:
+        """
+        Publish a batch of rows via MQTT without waiting for the broker's
+        acknowledgement. The batch stays in flight until `my_puback_callback`
+        is invoked with its packet id, or it expires in `expire_in_flight`.
+
+        Args:
+            batch:      A list of rows to be sent.
+            payload:    The batch encoded by `make_payload`.
+        Returns:
+            True if the batch is handed over to the MQTT client, otherwise
+            False.
+        Raises:
+            None
+        """
+        try:
+            with self.lock:
+                mid = self.myAWSIoTMQTTClient.publishAsync(
+                    self.TOPIC, payload, 1, ackCallback=self.my_puback_callback
+                )
+                if not isinstance(mid, int):  # "QUEUED" offline, never acked
+                    raise RuntimeError(f"publish not sent, got {mid!r}")
+                self.in_flight[mid] = (batch, monotonic())
+                self.stats["max_in_flight"] = max(
+                    self.stats["max_in_flight"], len(self.in_flight)
                 )
-            else:  # msg sent failed.
-                logger.error(f"Publish payload to {self.TOPIC} FAILED!")
-                logger.info("MQTT msg not sent. Put back into data queue")
-                while batch:
-                    data_q.put(batch.pop())  # put the unsent data back
-            return ret
-        else:
-            return True  # no data to send, default to return True
+        except Exception as e:
+            logger.error(f"Error in sending MQTT: {e}")
+            self.publish_failures.inc()
+            self.adjust_batch_size(False, "publish failed")
+            return False
+        self.payload_bytes.observe(len(payload))
+        logger.debug(f"Published msg {mid}:\n{payload}")
+        return True
+
+    def window_full(self) -> bool:
+        """ Whether PUBLISH_WINDOW batches are already in flight """
+        return len(self.in_flight) >= self.PUBLISH_WINDOW
+
+    def expire_in_flight(self) -> List[List[Tuple[Any, ...]]]:
+        """
+        Give up on batches not acknowledged within ACK_TIMEOUT seconds.
+
+        Returns:
+            The expired batches, oldest first. They must be sent again.
+        Raises:
+            None
+        """
+        now = monotonic()
+        expired: List[Tuple[float, List[Tuple[Any, ...]]]] = []
+        with self.lock:
+            for mid, (batch, sent) in list(self.in_flight.items()):
+                if now - sent > self.ACK_TIMEOUT:
+                    del self.in_flight[mid]
+                    expired.append((sent, batch))
+            self.stats["failed_batches"] += len(expired)
+        self.publish_failures.inc(len(expired))
+        if expired:
+            logger.error(
+                f"{len(expired)} batches to {self.TOPIC} not acknowledged "
+                f"within {self.ACK_TIMEOUT} seconds"
+            )
+            self.adjust_batch_size(False, "acknowledgement timed out")
+        return [batch for _, batch in sorted(expired, key=lambda e: e[0])]
+
+    def stats_summary(self) -> str:
+        """ Summarize publishing metrics since the last summary, and reset """
+        with self.lock:
+            stats, in_flight = dict(self.stats), len(self.in_flight)
+            elapsed = monotonic() - self.stats_since
+            for key in self.stats:
+                self.stats[key] = 0
+            self.stats_since = monotonic()
+        acked = stats["acked_batches"]
+        avg_latency = stats["ack_latency_sum"] / acked if acked else 0.0
+        return (
+            f"in flight {in_flight} (max {stats['max_in_flight']}), "
+            f"{acked} batches acked, {stats['failed_batches']} failed, "
+            f"avg ack latency {avg_latency:.3f}s, "
+            f"{stats['acked_rows'] / elapsed:.1f} rows/sec, "
+            f"batch size {self.batch_rows} rows, "
+            f"{self.bytes_per_row:.1f} bytes/row"
+        )
 
     def connect(self):
         """ connect shadow client and create shadow handler """
@@ -124,3 +327,26 @@ class UploadService:
         logger.info(f"{self.CLIENT_ID} OFFLINE.")
         self.offline = True
         self.online = False
+        if self.on_offline is not None:
+            self.on_offline()
+
+    def my_puback_callback(self, mid):
+        with self.lock:
+            entry = self.in_flight.pop(mid, None)
+            if entry is None:  # already expired and sent again
+                return
+            batch, sent = entry
+            latency = monotonic() - sent
+            self.stats["acked_batches"] += 1
+            self.stats["acked_rows"] += len(batch)
+            self.stats["ack_latency_sum"] += latency
+            full = len(batch) >= self.batch_rows
+        self.ack_seconds.observe(latency)
+        self.acked_rows.inc(len(batch))
+        logger.info(f"Publish {len(batch)} rows to {self.TOPIC} acknowledged.")
+        if latency > self.TARGET_LATENCY:
+            self.adjust_batch_size(False, f"ack latency {latency:.2f}s")
+        elif full:  # only grow if the batch size is what limits throughput
+            self.adjust_batch_size(True, f"ack latency {latency:.2f}s")
+        if self.on_ack is not None:
+            self.on_ack()
@@ -1,21 +1,20 @@
 from collections import defaultdict
 from hashlib import blake2b
-from typing import Dict, List, Any, Tuple
-import http.client as httplib
+from typing import Dict, List, Any, Tuple, Union
 import json
 from datetime import datetime
 
 
-def internet_on():  # borrowed from https://stackoverflow.com/a/29854274/9723036
-    """ Check whether internet is on """
-    conn = httplib.HTTPConnection("www.google.com", timeout=5)
-    try:
-        conn.request("HEAD", "/")
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+# A MAC address is either a colon separated string, e.g. "ab:cd:ef:01:23:45",
+# or the same address packed into a 48-bit int, e.g. 0xABCDEF012345.
+MacAddress = Union[str, int]
+
+# Locally administered (i.e. randomized) bit of the first octet of a MAC
+# address, as positioned in the 48-bit int representation.
+LOCAL_ADMIN_BIT = 0x02 << 40
+
+MAC_SALT = "2ZbaDDdb".encode("utf-8")  # This salt MUST NOT change!
+_MAC_HASHER = blake2b(digest_size=32, salt=MAC_SALT)
 
 
 def make_data_chunk(
@@ -50,9 +49,45 @@ def make_data_chunk(
         data_chunk[channel][mac_address]["captureTime"].append(captureTime)
 
 
-def hash_mac(mac_address: str) -> str:
+def mac_to_int(mac_address: str) -> int:
+    """ Pack a colon separated MAC address into a 48-bit int """
+    return int(mac_address.replace(":", ""), 16)
+
+
+def int_to_mac(mac_address: int) -> str:
+    """ Unpack a 48-bit int into a lower-case colon separated MAC address """
+    h = f"{mac_address:012x}"
+    return f"{h[0:2]}:{h[2:4]}:{h[4:6]}:{h[6:8]}:{h[8:10]}:{h[10:12]}"
+
+
+def is_physical(mac_address: MacAddress) -> bool:
+    """
+    Tell whether mac_address is a physical (i.e. unique) MAC address, as
+    opposed to a randomized one, by checking its locally administered bit.
+
+    Args:
+        mac_address: mac address of the device whose probe request is captured
+    Returns:
+        True if mac_address is physical, otherwise False.
+    Raises:
+        None
+    """
+    if isinstance(mac_address, int):
+        return not mac_address & LOCAL_ADMIN_BIT
+    return not int(mac_address[:2], 16) & 0x02
+
+
+def mac_to_str(mac_address: MacAddress) -> str:
+    """ Produce the string form of mac_address, whichever form it is in """
+    if isinstance(mac_address, int):
+        return int_to_mac(mac_address)
+    return mac_address
+
+
+def hash_mac(mac_address: MacAddress) -> str:
     """
-    Produce a hash for mac_address, with salt included.
+    Produce a hash for mac_address, with salt included. The salted hasher is
+    built once and copied for each call.
 
     Args:
         mac_address: mac address of the device whose probe request is captured
@@ -61,9 +96,8 @@ def hash_mac(mac_address: str) -> str:
     Raises:
         None
     """
-    SALT = "2ZbaDDdb".encode("utf-8")  # This salt MUST NOT change!
-    h_addr = blake2b(digest_size=32, salt=SALT)
-    h_addr.update(mac_address.encode("utf-8"))
+    h_addr = _MAC_HASHER.copy()
+    h_addr.update(mac_to_str(mac_address).encode("utf-8"))
     return h_addr.hexdigest()
 
 
@@ -90,7 +124,7 @@ def make_db_insertable_data(
                 (
                     # hash_mac(mac_address),
                     mac_address,
-                    bin(int(mac_address[:2], 16))[-2] == "0",  # '0' = unique
+                    is_physical(mac_address),
                     is_wifi,
                     v["captureTime"][0],
                     sum(v["rssi"]) // len(v["rssi"]),
@@ -100,6 +134,20 @@ def make_db_insertable_data(
     return insertable
 
 
+def to_epoch_ms(captureTime: Union[int, str]) -> int:
+    """
+    Produce captureTime in milliseconds since epoch. captureTime is already
+    so, unless it comes from a local database written before captureTime was
+    stored as an int, in which case it is a "%Y-%m-%d %H:%M:%S.%f" string.
+    """
+    if isinstance(captureTime, int):
+        return captureTime
+    return int(
+        datetime.strptime(captureTime, "%Y-%m-%d %H:%M:%S.%f").timestamp()
+        * 1000
+    )
+
+
 def convert_to_payload(rows: List[Tuple[Any, ...]], THINGNAME: str) -> str:
     """
     Convert `rows` into an appropriate payload for uploading via MQTT.
@@ -117,13 +165,10 @@ def convert_to_payload(rows: List[Tuple[Any, ...]], THINGNAME: str) -> str:
     msgDict["messages"] = list()
     for r in rows:
         rowDict: Dict[str, Any] = {
-            "macAddressHash": r[0],
+            "macAddressHash": mac_to_str(r[0]),
             "isPhysical": r[1],
             "isWifi": r[2],
-            "captureTime": int(
-                datetime.strptime(r[3], "%Y-%m-%d %H:%M:%S.%f").timestamp()
-                * 1000
-            ),
+            "captureTime": to_epoch_ms(r[3]),
             "rssi": r[4],
             "channel": r[5],
         }
@@ -137,4 +182,4 @@ def convert_to_payload_test(
     """ Same purpose as `convert_to_payload`, but with easier implementation
         for testing on Fanchen's personal aws iot
     """
-    return json.dumps(rows)
+    return json.dumps([(mac_to_str(r[0]),) + tuple(r[1:]) for r in rows])